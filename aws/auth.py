@@ -0,0 +1,326 @@
+"""Authentication and authorization of clients.
+
+By default every client id is the name of a secret holding the token of the
+client. Unknown client ids are remembered for a while, so requests with made
+up client ids do not cause a Secrets Manager call each. Verified tokens are
+remembered as hash, so repeated requests of the same client skip the secret
+lookup entirely.
+
+Alternatively, one credential document holds the token hashes and the allowed
+domains of all clients. It is compiled into an index once per refresh, so
+authentication and authorization are dict lookups.
+"""
+
+import hashlib
+import hmac
+import json
+import re
+from collections.abc import Callable
+from dataclasses import dataclass
+from threading import Lock
+
+from botocore.exceptions import ClientError
+
+from aws import metrics
+from aws.cache import TTLCache
+from aws.zone import normalize_record_name
+
+# Names and ARNs of Secrets Manager secrets
+# See: https://docs.aws.amazon.com/secretsmanager/latest/apireference/API_GetSecretValue.html#SecretsManager-GetSecretValue-request-SecretId
+CLIENT_ID_PATTERN: re.Pattern = re.compile(r"[A-Za-z0-9/_+=.@:-]{1,2048}")
+
+
+def token_hash(token: str) -> bytes:
+    """Return the hash of a token, so tokens are not kept in memory.
+
+    :type token: str
+    :param token:
+    :return:
+    """
+    return hashlib.sha256(token.encode()).digest()
+
+
+def tokens_match(token: str, expected_token: str | None) -> bool:
+    """Compare tokens in constant time.
+
+    :type token: str
+    :param token:
+    :type expected_token: str | None
+    :param expected_token:
+    :return:
+    """
+    if not isinstance(token, str) or not isinstance(expected_token, str):
+        return False
+    return hmac.compare_digest(token.encode(), expected_token.encode())
+
+
+class Authenticator:
+    """Verify the tokens of clients with a negative and a positive cache."""
+
+    def __init__(
+        self,
+        get_token: Callable[[str], str | None],
+        verified_tokens: TTLCache,
+        unknown_clients: TTLCache,
+    ):
+        """Initialize the authenticator.
+
+        :type get_token: Callable[[str], str | None]
+        :param get_token: returns the token of a client id, raises a
+            ResourceNotFoundException ClientError for unknown client ids
+        :type verified_tokens: TTLCache
+        :param verified_tokens: cache for verified (client id, token hash) pairs
+        :type unknown_clients: TTLCache
+        :param unknown_clients: cache for unknown client ids
+        """
+        self.get_token = get_token
+        self.verified_tokens = verified_tokens
+        self.unknown_clients = unknown_clients
+
+    def rejects(self, client_id: str) -> bool:
+        """Check if the client id fails authentication without a secret lookup.
+
+        :type client_id: str
+        :param client_id:
+        :return: True for malformed and known unknown client ids
+        """
+        if not isinstance(client_id, str) or not CLIENT_ID_PATTERN.fullmatch(client_id):
+            return True
+        return bool(self.unknown_clients.get(client_id))
+
+    def is_verified(self, client_id: str, token: str) -> bool:
+        """Check if the token of the client was verified recently.
+
+        :type client_id: str
+        :param client_id:
+        :type token: str
+        :param token:
+        :return: True if the token is authenticated without a secret lookup
+        """
+        if not isinstance(client_id, str) or not isinstance(token, str):
+            return False
+        return bool(self.verified_tokens.get((client_id, token_hash(token))))
+
+    def authenticate(self, client_id: str, token: str) -> bool:
+        """Check if the token belongs to the client.
+
+        :type client_id: str
+        :param client_id:
+        :type token: str
+        :param token:
+        :return:
+        """
+        if not isinstance(client_id, str) or not CLIENT_ID_PATTERN.fullmatch(client_id):
+            return False
+        if not isinstance(token, str):
+            return False
+        key = (client_id, token_hash(token))
+        if self.verified_tokens.get(key):
+            metrics.count("VerifiedTokenCacheHit")
+            return True
+        if self.unknown_clients.get(client_id):
+            metrics.count("UnknownClientCacheHit")
+            return False
+
+        try:
+            expected_token = self.get_token(client_id)
+        except ClientError as exc:
+            if exc.response["Error"]["Code"] != "ResourceNotFoundException":
+                raise
+            self.unknown_clients.set(client_id, True)
+            return False
+        if not tokens_match(token, expected_token):
+            return False
+        self.verified_tokens.set(key, True)
+        return True
+
+    def authorize(self, client_id: str, domain: str) -> bool:
+        """Check if the client may update the domain.
+
+        Every client may update every domain of the hosted zones.
+
+        :type client_id: str
+        :param client_id:
+        :type domain: str
+        :param domain:
+        :return:
+        """
+        return True
+
+
+@dataclass(frozen=True)
+class ClientCredentials:
+    """Token hash and allowed domains of a client."""
+
+    token_hash: bytes
+    domains: frozenset[str] = frozenset()
+    wildcard_domains: frozenset[str] = frozenset()
+    all_domains: bool = False
+
+    @classmethod
+    def from_dict(cls, credentials: dict) -> "ClientCredentials":
+        """Compile the credentials of a client from the credential document.
+
+        Domain patterns are either a domain, "*.<domain>" for all subdomains of
+        domain or "*" for all domains.
+
+        :type credentials: dict
+        :param credentials:
+        :return:
+        """
+        domains = set()
+        wildcard_domains = set()
+        all_domains = False
+        for pattern in credentials.get("domains", []):
+            pattern = normalize_record_name(pattern)
+            if pattern == "*":
+                all_domains = True
+            elif pattern.startswith("*."):
+                wildcard_domains.add(pattern[2:])
+            else:
+                domains.add(pattern)
+        return cls(
+            token_hash=bytes.fromhex(credentials["token_sha256"]),
+            domains=frozenset(domains),
+            wildcard_domains=frozenset(wildcard_domains),
+            all_domains=all_domains,
+        )
+
+    def allows(self, domain: str) -> bool:
+        """Check if domain matches one of the allowed domain patterns.
+
+        :type domain: str
+        :param domain:
+        :return:
+        """
+        if self.all_domains:
+            return True
+        domain = normalize_record_name(domain)
+        if domain in self.domains:
+            return True
+        labels = domain.split(".")
+        return any(
+            ".".join(labels[index:]) in self.wildcard_domains
+            for index in range(1, len(labels))
+        )
+
+
+class CredentialIndex:
+    """Credentials of all clients indexed by client id."""
+
+    def __init__(self, clients: dict[str, ClientCredentials]):
+        """Initialize the index.
+
+        :type clients: dict[str, ClientCredentials]
+        :param clients: credentials per client id
+        """
+        self.clients = clients
+
+    @classmethod
+    def from_document(cls, document: str) -> "CredentialIndex":
+        """Compile the credential document.
+
+        The document is a JSON object like
+        {"clients": {"<client id>": {"token_sha256": "<hex digest>",
+        "domains": ["home.example.com", "*.office.example.com"]}}}.
+
+        :type document: str
+        :param document:
+        :return:
+        """
+        try:
+            clients = json.loads(document)["clients"]
+            return cls(
+                {
+                    client_id: ClientCredentials.from_dict(credentials)
+                    for client_id, credentials in clients.items()
+                }
+            )
+        except (KeyError, TypeError, AttributeError, ValueError) as exc:
+            raise ValueError(f"Invalid credential document: {exc!r}") from None
+
+    def authenticate(self, client_id: str, token: str) -> bool:
+        """Check if the token belongs to the client.
+
+        :type client_id: str
+        :param client_id:
+        :type token: str
+        :param token:
+        :return:
+        """
+        credentials = self.clients.get(client_id)
+        if credentials is None or not isinstance(token, str):
+            return False
+        return hmac.compare_digest(token_hash(token), credentials.token_hash)
+
+    def authorize(self, client_id: str, domain: str) -> bool:
+        """Check if the client may update the domain.
+
+        :type client_id: str
+        :param client_id:
+        :type domain: str
+        :param domain:
+        :return:
+        """
+        credentials = self.clients.get(client_id)
+        return credentials is not None and credentials.allows(domain)
+
+
+class CredentialDocumentAuthenticator:
+    """Authenticate and authorize clients with one credential document."""
+
+    def __init__(self, get_document: Callable[[], str]):
+        """Initialize the authenticator.
+
+        :type get_document: Callable[[], str]
+        :param get_document: returns the current credential document, usually
+            from a cache which refreshes it from time to time
+        """
+        self.get_document = get_document
+        self._document: str | None = None
+        self._index: CredentialIndex | None = None
+        self._lock = Lock()
+
+    def index(self) -> CredentialIndex:
+        """Return the index of the current document, compile it if it changed.
+
+        :return:
+        """
+        document = self.get_document()
+        with self._lock:
+            if self._index is None or document != self._document:
+                self._index = CredentialIndex.from_document(document)
+                self._document = document
+                metrics.count("CredentialIndexCompiled")
+            return self._index
+
+    def rejects(self, client_id: str) -> bool:
+        """Check if the client id is not in the credential document.
+
+        :type client_id: str
+        :param client_id:
+        :return:
+        """
+        return not isinstance(client_id, str) or client_id not in self.index().clients
+
+    def authenticate(self, client_id: str, token: str) -> bool:
+        """Check if the token belongs to the client.
+
+        :type client_id: str
+        :param client_id:
+        :type token: str
+        :param token:
+        :return:
+        """
+        return self.index().authenticate(client_id, token)
+
+    def authorize(self, client_id: str, domain: str) -> bool:
+        """Check if the client may update the domain.
+
+        :type client_id: str
+        :param client_id:
+        :type domain: str
+        :param domain:
+        :return:
+        """
+        return self.index().authorize(client_id, domain)
@@ -0,0 +1,89 @@
+"""In-memory caches."""
+
+from collections import OrderedDict
+from collections.abc import Hashable
+from threading import Lock
+from time import monotonic
+from typing import Any
+
+
+class TTLCache:
+    """Size bounded cache with LRU eviction and a maximum age per entry."""
+
+    def __init__(self, max_size: int, max_age: float):
+        """Initialize the cache.
+
+        :type max_size: int
+        :param max_size: maximum number of entries, 0 disables the cache
+        :type max_age: float
+        :param max_age: seconds after which an entry expires, 0 disables the cache
+        """
+        self.max_size = max_size
+        self.max_age = max_age
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        """Return the number of entries including expired ones.
+
+        :return:
+        """
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the value for key if it is cached and not expired.
+
+        :type key: Hashable
+        :param key:
+        :param default:
+        :return:
+        """
+        with self._lock:
+            try:
+                expires_at, value = self._entries[key]
+            except KeyError:
+                return default
+            if monotonic() >= expires_at:
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, max_age: float | None = None) -> None:
+        """Cache a value, evict the least recently used entry if the cache is full.
+
+        :type key: Hashable
+        :param key:
+        :param value:
+        :type max_age: float | None
+        :param max_age: overrides the maximum age of the cache for this entry
+        :return:
+        """
+        max_age = self.max_age if max_age is None else max_age
+        if self.max_size <= 0 or max_age <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (monotonic() + max_age, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove key and return its value.
+
+        :type key: Hashable
+        :param key:
+        :param default:
+        :return:
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self) -> None:
+        """Remove all entries.
+
+        :return:
+        """
+        with self._lock:
+            self._entries.clear()
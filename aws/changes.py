@@ -0,0 +1,83 @@
+"""Route 53 change batches.
+
+See: https://docs.aws.amazon.com/Route53/latest/DeveloperGuide/DNSLimitations.html#limits-api-requests-changeresourcerecordsets
+"""
+
+from collections.abc import Iterable, Iterator
+
+MAX_CHANGES_PER_BATCH: int = 1000
+MAX_CHARACTERS_PER_BATCH: int = 32000
+
+
+def build_change(domain: str, record_type: str, ip: str, ttl: int) -> dict:
+    """Build an UPSERT change for a simple resource record set.
+
+    :type domain: str
+    :param domain:
+    :type record_type: str
+    :param record_type:
+    :type ip: str
+    :param ip:
+    :type ttl: int
+    :param ttl:
+    :return:
+    """
+    return {
+        "Action": "UPSERT",
+        "ResourceRecordSet": {
+            "Name": domain,
+            "Type": record_type,
+            "TTL": ttl,
+            "ResourceRecords": [{"Value": ip}],
+        },
+    }
+
+
+def change_size(change: dict) -> tuple[int, int]:
+    """Return the number of records and value characters a change counts with.
+
+    UPSERT changes count twice against both limits.
+
+    :type change: dict
+    :param change:
+    :return:
+    """
+    records = change["ResourceRecordSet"].get("ResourceRecords", [])
+    factor = 2 if change["Action"] == "UPSERT" else 1
+    characters = sum(len(record["Value"]) for record in records)
+    return factor * max(len(records), 1), factor * characters
+
+
+def chunk_changes(
+    changes: Iterable[dict],
+    max_changes: int = MAX_CHANGES_PER_BATCH,
+    max_characters: int = MAX_CHARACTERS_PER_BATCH,
+) -> Iterator[list[dict]]:
+    """Split changes into as few change batches as the Route 53 limits allow.
+
+    :type changes: Iterable[dict]
+    :param changes:
+    :type max_changes: int
+    :param max_changes:
+    :type max_characters: int
+    :param max_characters:
+    :return:
+    """
+    chunk: list[dict] = []
+    chunk_changes_count = 0
+    chunk_characters = 0
+    for change in changes:
+        changes_count, characters = change_size(change)
+        if chunk and (
+            chunk_changes_count + changes_count > max_changes
+            or chunk_characters + characters > max_characters
+        ):
+            yield chunk
+            chunk = []
+            chunk_changes_count = 0
+            chunk_characters = 0
+        chunk.append(change)
+        chunk_changes_count += changes_count
+        chunk_characters += characters
+    if chunk:
+        yield chunk
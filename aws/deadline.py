@@ -0,0 +1,162 @@
+"""Deadlines for the AWS API calls of an invocation.
+
+Lambda ends an invocation which exceeds its timeout without a response, so the
+router neither learns the outcome nor when to retry. The deadline of an
+invocation is its remaining time minus a reserve for building the response.
+AWS API calls only start an attempt while time remains, and the connect and
+read timeouts of every attempt are capped to the remaining time. Otherwise
+DeadlineExceeded is raised and the handler answers with a retryable error
+while there is still time.
+
+The deadline is held in a context variable, so it applies to all calls made
+while handling the invocation, including those running in the zone executor.
+"""
+
+import logging
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from time import monotonic
+from typing import TYPE_CHECKING, Any
+
+from urllib3.util import Timeout
+
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
+
+logger = logging.getLogger()
+
+MIN_TIMEOUT: float = 0.01
+
+_current_deadline: ContextVar["Deadline | None"] = ContextVar(
+    "current_deadline", default=None
+)
+
+
+class DeadlineExceeded(Exception):
+    """The remaining time of the invocation is too short for an operation."""
+
+
+@dataclass(frozen=True)
+class Deadline:
+    """Point in time of the monotonic clock by which calls must complete."""
+
+    expires_at: float
+
+    @classmethod
+    def from_context(cls, context: Any, reserve: float = 0.0) -> "Deadline | None":
+        """Create the deadline of a Lambda invocation.
+
+        :param context: Lambda context
+        :type reserve: float
+        :param reserve: seconds kept for building the response
+        :return: None if the context does not provide the remaining time
+        """
+        get_remaining_time = getattr(context, "get_remaining_time_in_millis", None)
+        if get_remaining_time is None:
+            return None
+        return cls(monotonic() + get_remaining_time() / 1000 - reserve)
+
+    def remaining(self) -> float:
+        """Return the seconds until the deadline, negative once it passed.
+
+        :return:
+        """
+        return self.expires_at - monotonic()
+
+    def check(self, needed: float, operation: str) -> None:
+        """Raise DeadlineExceeded unless more than needed seconds remain.
+
+        :type needed: float
+        :param needed:
+        :type operation: str
+        :param operation: name used in the error message
+        :return:
+        """
+        remaining = self.remaining()
+        if remaining <= needed:
+            raise DeadlineExceeded(
+                f"{operation} needs more than {needed:.3f}s, "
+                f"{max(remaining, 0.0):.3f}s remain"
+            )
+
+
+class DeadlineTimeout(Timeout):
+    """Timeout of urllib3 connection pools capped to the current deadline.
+
+    urllib3 clones the timeout of the pool for every request, in the thread
+    making the request, so the clone sees the deadline of the invocation.
+    """
+
+    def clone(self) -> Timeout:
+        """Create the timeout of a request.
+
+        :return:
+        """
+        current_deadline = current()
+        if current_deadline is None:
+            return super().clone()
+        remaining = max(current_deadline.remaining(), MIN_TIMEOUT)
+        total = remaining if self.total is None else min(self.total, remaining)
+        return Timeout(connect=self._connect, read=self._read, total=total)
+
+
+def cap_timeouts(client: "BaseClient") -> "BaseClient":
+    """Cap the connect and read timeouts of the client's calls to the deadline.
+
+    botocore has no timeouts per call, so the timeout of the pool managers of
+    the client's HTTP session is replaced, including those for proxies. This
+    relies on private attributes of botocore's URLLib3Session. If they are not
+    found, the client keeps the timeouts of its configuration. Call this before
+    the first call, which creates the pools.
+
+    :type client: BaseClient
+    :param client:
+    :return:
+    """
+    http_session = getattr(getattr(client, "_endpoint", None), "http_session", None)
+    timeout = getattr(http_session, "_timeout", None)
+    proxy_managers = getattr(http_session, "_proxy_managers", None)
+    managers = [
+        getattr(http_session, "_manager", None),
+        *(proxy_managers or {}).values(),
+    ]
+    if (
+        not isinstance(timeout, Timeout)
+        or not isinstance(proxy_managers, dict)
+        or not all(hasattr(manager, "connection_pool_kw") for manager in managers)
+    ):
+        logger.warning("Timeouts of the client cannot be capped to the deadline")
+        return client
+    deadline_timeout = DeadlineTimeout(
+        connect=timeout.connect_timeout, read=timeout.read_timeout
+    )
+    # Proxy managers created later take the timeout of the session
+    http_session._timeout = deadline_timeout
+    for manager in managers:
+        manager.connection_pool_kw["timeout"] = deadline_timeout
+    return client
+
+
+def current() -> Deadline | None:
+    """Return the deadline of the current invocation.
+
+    :return:
+    """
+    return _current_deadline.get()
+
+
+@contextmanager
+def bounded(deadline: Deadline | None) -> Iterator[Deadline | None]:
+    """Apply a deadline to the calls made within the block.
+
+    :type deadline: Deadline | None
+    :param deadline: None removes the deadline
+    :return:
+    """
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
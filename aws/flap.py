@@ -0,0 +1,275 @@
+"""Flap detection for records whose reported IP address keeps alternating.
+
+Sites which fail over between two uplinks report alternating IP addresses many
+times an hour, and every flip would be written to Route 53. A short history of
+the reported values per record shows this oscillation: if the value changed at
+least threshold times within the window, the record is flapping and writes are
+held back according to the policy:
+
+* "hold" keeps the published value until the record stopped flapping
+* "confirm" writes a value only after it was reported a number of times in a
+  row
+
+Values of records which are not flapping are written right away.
+"""
+
+import json
+from abc import ABC, abstractmethod
+from itertools import pairwise
+from threading import Lock
+from time import time
+from typing import TYPE_CHECKING
+
+from aws.cache import TTLCache
+from aws.state import StateKey
+
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
+
+FLAP_POLICIES: tuple[str, ...] = ("hold", "confirm")
+
+Report = tuple[float, str]
+
+
+class FlapHistoryStore(ABC):
+    """Interface of the stores for the reported values per record."""
+
+    @abstractmethod
+    def get(self, key: StateKey) -> tuple[Report, ...]:
+        """Return the reports of (hosted zone id, name, type), oldest first.
+
+        :type key: StateKey
+        :param key:
+        :return:
+        """
+
+    @abstractmethod
+    def append(self, key: StateKey, report: Report, max_length: int) -> None:
+        """Append a report and drop the oldest beyond max_length.
+
+        :type key: StateKey
+        :param key:
+        :type report: Report
+        :param report: time and reported value
+        :type max_length: int
+        :param max_length:
+        :return:
+        """
+
+
+class MemoryFlapHistoryStore(FlapHistoryStore):
+    """History of the execution environment in a size bounded cache."""
+
+    def __init__(self, max_size: int, max_age: float):
+        """Initialize the store.
+
+        :type max_size: int
+        :param max_size: maximum number of records
+        :type max_age: float
+        :param max_age: seconds after the last report a history is dropped
+        """
+        self._histories = TTLCache(max_size=max_size, max_age=max_age)
+        self._lock = Lock()
+
+    def get(self, key: StateKey) -> tuple[Report, ...]:
+        """Return the reports of (hosted zone id, name, type), oldest first.
+
+        :type key: StateKey
+        :param key:
+        :return:
+        """
+        return self._histories.get(key, ())
+
+    def append(self, key: StateKey, report: Report, max_length: int) -> None:
+        """Append a report and drop the oldest beyond max_length.
+
+        :type key: StateKey
+        :param key:
+        :type report: Report
+        :param report:
+        :type max_length: int
+        :param max_length:
+        :return:
+        """
+        with self._lock:
+            history = self._histories.get(key, ())
+            self._histories.set(key, (*history, report)[-max_length:])
+
+
+class DynamoDbFlapHistoryStore(FlapHistoryStore):
+    """History shared by all execution environments in a DynamoDB table.
+
+    The table has a string partition key "pk". Items carry an "expires_at"
+    attribute for DynamoDB's time to live. Concurrent reports of the same record
+    may overwrite each other, which only shortens the history.
+
+    See: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb.html
+    """
+
+    def __init__(self, client: "BaseClient", table_name: str, max_age: float):
+        """Initialize the store.
+
+        :type client: BaseClient
+        :param client:
+        :type table_name: str
+        :param table_name:
+        :type max_age: float
+        :param max_age: seconds after the last report a history expires
+        """
+        self._client = client
+        self.table_name = table_name
+        self.max_age = max_age
+
+    @staticmethod
+    def partition_key(key: StateKey) -> str:
+        """Return the partition key for (hosted zone id, name, type).
+
+        :type key: StateKey
+        :param key:
+        :return:
+        """
+        return "flap#" + "#".join(key)
+
+    def get(self, key: StateKey) -> tuple[Report, ...]:
+        """Return the reports of (hosted zone id, name, type), oldest first.
+
+        :type key: StateKey
+        :param key:
+        :return:
+        """
+        response = self._client.get_item(
+            TableName=self.table_name,
+            Key={"pk": {"S": self.partition_key(key)}},
+        )
+        item = response.get("Item")
+        if item is None:
+            return ()
+        return tuple(
+            (reported_at, value)
+            for reported_at, value in json.loads(item["reports"]["S"])
+        )
+
+    def append(self, key: StateKey, report: Report, max_length: int) -> None:
+        """Append a report and drop the oldest beyond max_length.
+
+        :type key: StateKey
+        :param key:
+        :type report: Report
+        :param report:
+        :type max_length: int
+        :param max_length:
+        :return:
+        """
+        history = (*self.get(key), report)[-max_length:]
+        self._client.put_item(
+            TableName=self.table_name,
+            Item={
+                "pk": {"S": self.partition_key(key)},
+                "reports": {"S": json.dumps(history, separators=(",", ":"))},
+                "expires_at": {"N": str(int(report[0] + self.max_age))},
+            },
+        )
+
+
+class FlapDetector:
+    """Decide whether reported values of a record may be written."""
+
+    def __init__(
+        self,
+        store: FlapHistoryStore,
+        policy: str = "hold",
+        window: float = 3600.0,
+        threshold: int = 4,
+        confirmations: int = 3,
+        history_size: int = 16,
+    ):
+        """Initialize the detector.
+
+        :type store: FlapHistoryStore
+        :param store:
+        :type policy: str
+        :param policy: "hold" or "confirm"
+        :type window: float
+        :param window: seconds in which changes of the value are counted
+        :type threshold: int
+        :param threshold: changes within the window which make a record flap
+        :type confirmations: int
+        :param confirmations: reports in a row the "confirm" policy requires
+        :type history_size: int
+        :param history_size: reports kept per record
+        """
+        if policy not in FLAP_POLICIES:
+            raise ValueError(f"Unknown flap policy: {policy}")
+        self.store = store
+        self.policy = policy
+        self.window = window
+        self.threshold = threshold
+        self.confirmations = confirmations
+        self.history_size = max(history_size, threshold + 1, confirmations)
+
+    def report(
+        self,
+        key: StateKey,
+        value: str,
+        now: float | None = None,
+        published: str | None = None,
+    ) -> None:
+        """Add a reported value to the history of a record.
+
+        Reports of the published value are only added if the history last saw
+        another value, so repeated reports without a change are not written.
+
+        :type key: StateKey
+        :param key: (hosted zone id, name, type)
+        :type value: str
+        :param value:
+        :type now: float | None
+        :param now:
+        :type published: str | None
+        :param published: value of the record in Route 53
+        :return:
+        """
+        if value == published:
+            history = self.store.get(key)
+            if not history or history[-1][1] == value:
+                return
+        reported_at = time() if now is None else now
+        self.store.append(key, (reported_at, value), self.history_size)
+
+    def is_flapping(self, history: tuple[Report, ...], now: float) -> bool:
+        """Check if the value changed threshold times within the window.
+
+        :type history: tuple[Report, ...]
+        :param history:
+        :type now: float
+        :param now:
+        :return:
+        """
+        changes = sum(
+            1
+            for (_, previous), (reported_at, value) in pairwise(history)
+            if value != previous and now - reported_at < self.window
+        )
+        return changes >= self.threshold
+
+    def holds(self, key: StateKey, value: str, now: float | None = None) -> bool:
+        """Check if writing the value to the record is held back.
+
+        :type key: StateKey
+        :param key: (hosted zone id, name, type)
+        :type value: str
+        :param value:
+        :type now: float | None
+        :param now:
+        :return:
+        """
+        now = time() if now is None else now
+        history = self.store.get(key)
+        if not self.is_flapping(history, now):
+            return False
+        if self.policy == "hold":
+            return True
+        recent = history[-self.confirmations :]
+        return len(recent) < self.confirmations or any(
+            reported != value for _, reported in recent
+        )
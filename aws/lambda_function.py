@@ -1,54 +1,502 @@
 """AWS Lambda function."""
 
+import base64
+import ipaddress
 import json
 import logging
+import math
 import os
 from collections import namedtuple
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import copy_context
+from functools import partial, wraps
+from time import time
+from typing import TYPE_CHECKING, Any
 
-import boto3
-from aws_secretsmanager_caching import SecretCache, SecretCacheConfig
-from botocore.client import BaseClient
 from botocore.exceptions import ClientError
 
-DnsRecord = namedtuple("DnsRecord", ["domain", "ip"])
+from aws import deadline, metrics, profiling, registry, startup
+from aws.auth import Authenticator, CredentialDocumentAuthenticator
+from aws.cache import TTLCache
+from aws.changes import build_change, chunk_changes
+from aws.flap import (
+    DynamoDbFlapHistoryStore,
+    FlapDetector,
+    FlapHistoryStore,
+    MemoryFlapHistoryStore,
+)
+from aws.ratelimit import (
+    AdaptiveRateLimiter,
+    ClientRateLimiter,
+    DynamoDbClientRateLimiter,
+    MemoryClientRateLimiter,
+)
+from aws.retry import (
+    RetryingClient,
+    RetryMetrics,
+    RetryPolicy,
+    is_retriable_error,
+)
+from aws.state import (
+    DynamoDbStateStore,
+    MemoryStateStore,
+    SqliteStateStore,
+    StateStore,
+)
+from aws.ttl import (
+    AdaptiveTtl,
+    ChangeRateStore,
+    DynamoDbChangeRateStore,
+    MemoryChangeRateStore,
+)
+from aws.zone import (
+    HostedZoneIndex,
+    HostedZoneNotFound,
+    ZoneSnapshot,
+    ZoneSnapshotCache,
+    load_hosted_zone_index,
+    normalize_record_name,
+)
+
+if TYPE_CHECKING:
+    from aws_secretsmanager_caching import SecretCache
+    from botocore.client import BaseClient
+    from botocore.config import Config
+
+DnsRecord = namedtuple(
+    "DnsRecord",
+    ["domain", "ip", "values", "state", "record_type", "ttl"],
+    defaults=[(), None, "A", None],
+)
 
 logger = logging.getLogger()
-logger.setLevel("INFO")
+logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
 
 ROUTE_53_HOSTED_ZONE_ID: str = os.environ.get("ROUTE_53_HOSTED_ZONE_ID")
-ROUTE_53_RECORD_TYPE: str = "A"
+RECORD_TYPES: dict[int, str] = {4: "A", 6: "AAAA"}
 ROUTE_53_RECORD_TTL: int = int(os.environ.get("ROUTE_53_RECORD_TTL", "3600"))
+CLIENT_RATE_LIMIT: float = float(os.environ.get("CLIENT_RATE_LIMIT", "0"))
+CLIENT_RATE_LIMIT_BURST: float = float(os.environ.get("CLIENT_RATE_LIMIT_BURST", "3"))
+CLIENT_RATE_LIMIT_STORE: str = os.environ.get("CLIENT_RATE_LIMIT_STORE", "memory")
 SECRETS_MANAGER_REFRESH_INTERVAL: int = int(
     os.environ.get("SECRETS_MANAGER_REFRESH_INTERVAL", "86400")
 )
+ROUTE_53_ZONE_CACHE_TTL: int = int(os.environ.get("ROUTE_53_ZONE_CACHE_TTL", "60"))
+ROUTE_53_RECORD_LOOKUP_MAX_NAMES: int = int(
+    os.environ.get("ROUTE_53_RECORD_LOOKUP_MAX_NAMES", "1")
+)
+PUBLISHED_IP_CACHE_SIZE: int = int(os.environ.get("PUBLISHED_IP_CACHE_SIZE", "1024"))
+PUBLISHED_IP_CACHE_MAX_AGE: int = int(
+    os.environ.get("PUBLISHED_IP_CACHE_MAX_AGE", "300")
+)
+ROUTE_53_ZONE_DISCOVERY: bool = (
+    os.environ.get("ROUTE_53_ZONE_DISCOVERY", "false").lower() == "true"
+)
+ZONE_CONCURRENCY: int = int(os.environ.get("ZONE_CONCURRENCY", "4"))
+# Invocations handled concurrently by the process, set by the self-hosted server
+HANDLER_CONCURRENCY: int = 1
+UPDATE_MODE: str = os.environ.get("UPDATE_MODE", "sync")
+PREFETCH_RECORDS: bool = os.environ.get("PREFETCH_RECORDS", "false").lower() == "true"
+CHANGE_STATUS_CACHE_TTL: int = int(os.environ.get("CHANGE_STATUS_CACHE_TTL", "5"))
+INSYNC_CACHE_TTL: int = 86400
+RETRY_MAX_ATTEMPTS: int = int(os.environ.get("RETRY_MAX_ATTEMPTS", "4"))
+RETRY_BASE_DELAY: float = float(os.environ.get("RETRY_BASE_DELAY", "0.1"))
+RETRY_MAX_DELAY: float = float(os.environ.get("RETRY_MAX_DELAY", "1.0"))
+ROUTE_53_MAX_REQUEST_RATE: float = float(
+    os.environ.get("ROUTE_53_MAX_REQUEST_RATE", "5")
+)
+SECRETS_MANAGER_MAX_REQUEST_RATE: float = float(
+    os.environ.get("SECRETS_MANAGER_MAX_REQUEST_RATE", "100")
+)
+API_CONNECT_TIMEOUT: float = float(os.environ.get("API_CONNECT_TIMEOUT", "0.5"))
+API_READ_TIMEOUT: float = float(os.environ.get("API_READ_TIMEOUT", "2"))
+DEADLINE_RESERVE: float = int(os.environ.get("DEADLINE_RESERVE_MS", "300")) / 1000
+UPDATE_QUEUE_URL: str = os.environ.get("UPDATE_QUEUE_URL", "")
+STATE_STORE: str = os.environ.get("STATE_STORE", "")
+STATE_STORE_MAX_AGE: int = int(os.environ.get("STATE_STORE_MAX_AGE", "86400"))
+AUTH_CACHE_TTL: int = int(os.environ.get("AUTH_CACHE_TTL", "300"))
+UNKNOWN_CLIENT_CACHE_TTL: int = int(os.environ.get("UNKNOWN_CLIENT_CACHE_TTL", "900"))
+CREDENTIALS_SECRET_ID: str = os.environ.get("CREDENTIALS_SECRET_ID", "")
+TRUSTED_PROXIES: tuple[ipaddress.IPv4Network | ipaddress.IPv6Network, ...] = tuple(
+    ipaddress.ip_network(network.strip(), strict=False)
+    for network in os.environ.get("TRUSTED_PROXIES", "").split(",")
+    if network.strip()
+)
+AUTO_IP_ADDRESS: str = "auto"
+FLAP_POLICY: str = os.environ.get("FLAP_POLICY", "")
+FLAP_WINDOW: int = int(os.environ.get("FLAP_WINDOW", "3600"))
+FLAP_THRESHOLD: int = int(os.environ.get("FLAP_THRESHOLD", "4"))
+FLAP_CONFIRMATIONS: int = int(os.environ.get("FLAP_CONFIRMATIONS", "3"))
+FLAP_HISTORY_SIZE: int = int(os.environ.get("FLAP_HISTORY_SIZE", "16"))
+FLAP_HISTORY_STORE: str = os.environ.get("FLAP_HISTORY_STORE", "memory")
+TTL_MODE: str = os.environ.get("TTL_MODE", "fixed")
+ADAPTIVE_TTL_MIN: int = int(os.environ.get("ADAPTIVE_TTL_MIN", "60"))
+ADAPTIVE_TTL_MAX: int = int(os.environ.get("ADAPTIVE_TTL_MAX", "86400"))
+ADAPTIVE_TTL_FRACTION: float = float(os.environ.get("ADAPTIVE_TTL_FRACTION", "0.01"))
+ADAPTIVE_TTL_CHANGE_FACTOR: float = float(
+    os.environ.get("ADAPTIVE_TTL_CHANGE_FACTOR", "2")
+)
+ADAPTIVE_TTL_STORE: str = os.environ.get("ADAPTIVE_TTL_STORE", "memory")
+BULK_UPDATE_MAX_ENTRIES: int = int(os.environ.get("BULK_UPDATE_MAX_ENTRIES", "1000"))
+
+
+def create_client_config(**kwargs: Any) -> "Config":
+    """Create the configuration of AWS clients.
+
+    Connections are kept alive and pooled, so calls of warm execution
+    environments skip the TLS handshake. The pool has a connection for every
+    concurrent invocation and every thread updating hosted zones. The timeouts
+    bound how long a single attempt may take, within the deadline of an
+    invocation they are capped to its remaining time.
+
+    See: https://botocore.amazonaws.com/v1/documentation/api/latest/reference/config.html
+
+    :type kwargs: Any
+    :param kwargs: further configuration
+    :return:
+    """
+    from botocore.config import Config
+
+    return Config(
+        connect_timeout=API_CONNECT_TIMEOUT,
+        read_timeout=API_READ_TIMEOUT,
+        tcp_keepalive=True,
+        max_pool_connections=max(10, HANDLER_CONCURRENCY + ZONE_CONCURRENCY),
+        **kwargs,
+    )
+
+
+def create_retrying_client(
+    client: "BaseClient", max_rate: float | None
+) -> RetryingClient:
+    """Wrap a client, so its calls are retried and rate limited.
+
+    All wrapped clients of the execution environment share the retry policy
+    and the retry metrics.
+
+    :type client: BaseClient
+    :param client:
+    :type max_rate: float | None
+    :param max_rate: requests per second, None disables rate limiting
+    :return:
+    """
+    return RetryingClient(
+        client,
+        policy=registry.get("retry_policy"),
+        rate_limiter=None if max_rate is None else AdaptiveRateLimiter(max_rate),
+        metrics=registry.get("retry_metrics"),
+    )
 
 
-def route_53_client() -> BaseClient:
-    """Instantiate the Route53 client.
+def create_route_53_client() -> RetryingClient:
+    """Create the Route53 client.
+
+    Retries are handled by RetryingClient with a rate limiter shared by all
+    Route53 calls of the execution environment instead of botocore.
 
     See: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/route53.html
 
     :return:
     """
-    client = boto3.client("route53")
+    import boto3
+
+    client = metrics.instrument_client(
+        deadline.cap_timeouts(
+            boto3.client(
+                "route53",
+                config=create_client_config(retries={"total_max_attempts": 1}),
+            )
+        )
+    )
+    return create_retrying_client(client, max_rate=ROUTE_53_MAX_REQUEST_RATE)
+
+
+def create_secrets_manager_client() -> RetryingClient:
+    """Create the SecretsManager client.
+
+    See: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/secretsmanager.html
+
+    :return:
+    """
+    import boto3
+
+    client = metrics.instrument_client(
+        deadline.cap_timeouts(
+            boto3.client(
+                "secretsmanager",
+                config=create_client_config(retries={"total_max_attempts": 1}),
+            )
+        )
+    )
+    return create_retrying_client(client, max_rate=SECRETS_MANAGER_MAX_REQUEST_RATE)
+
+
+def create_dynamodb_client() -> "BaseClient":
+    """Create the DynamoDB client.
+
+    See: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb.html
+
+    :return:
+    """
+    import boto3
+
+    client = metrics.instrument_client(
+        deadline.cap_timeouts(boto3.client("dynamodb", config=create_client_config()))
+    )
     return client
 
 
-def secrets_manager_cache() -> SecretCache:
-    """Instantiate the SecretsManager and it's cache.
+def create_sqs_client() -> "BaseClient":
+    """Create the SQS client.
+
+    See: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/sqs.html
+
+    :return:
+    """
+    import boto3
+
+    client = metrics.instrument_client(
+        deadline.cap_timeouts(boto3.client("sqs", config=create_client_config()))
+    )
+    return client
+
+
+def create_secrets_manager_cache() -> "SecretCache":
+    """Create the SecretsManager cache.
 
     See: https://github.com/aws/aws-secretsmanager-caching-python?tab=readme-ov-file#usage
 
     :return:
     """
-    client = boto3.client("secretsmanager")
+    from aws_secretsmanager_caching import SecretCache, SecretCacheConfig
+
     cache_config = SecretCacheConfig(
         secret_refresh_interval=SECRETS_MANAGER_REFRESH_INTERVAL
     )
-    cache = SecretCache(config=cache_config, client=client)
+    cache = SecretCache(config=cache_config, client=registry.get("secretsmanager"))
     return cache
 
 
+def create_zone_snapshot_cache() -> ZoneSnapshotCache:
+    """Create the in-memory cache for hosted zone snapshots.
+
+    :return:
+    """
+    return ZoneSnapshotCache(ttl=ROUTE_53_ZONE_CACHE_TTL)
+
+
+def create_published_ip_cache() -> TTLCache:
+    """Create the in-memory cache for the last published IP of each record.
+
+    :return:
+    """
+    return TTLCache(
+        max_size=PUBLISHED_IP_CACHE_SIZE, max_age=PUBLISHED_IP_CACHE_MAX_AGE
+    )
+
+
+def create_state_store() -> StateStore | None:
+    """Create the state store configured with STATE_STORE.
+
+    Supported values are "memory", "sqlite:<path>" and "dynamodb:<table name>".
+
+    :return:
+    """
+    if not STATE_STORE:
+        return None
+    kind, _, location = STATE_STORE.partition(":")
+    if kind == "memory":
+        return MemoryStateStore()
+    if kind == "sqlite":
+        return SqliteStateStore(location)
+    if kind == "dynamodb":
+        return DynamoDbStateStore(registry.get("dynamodb"), location)
+    raise ValueError(f"Unknown state store: {STATE_STORE}")
+
+
+def create_flap_detector() -> FlapDetector | None:
+    """Create the flap detector configured with FLAP_POLICY.
+
+    FLAP_HISTORY_STORE is "memory" or "dynamodb:<table name>".
+
+    :return:
+    """
+    if not FLAP_POLICY:
+        return None
+    kind, _, location = FLAP_HISTORY_STORE.partition(":")
+    store: FlapHistoryStore
+    if kind == "memory":
+        store = MemoryFlapHistoryStore(
+            max_size=PUBLISHED_IP_CACHE_SIZE, max_age=FLAP_WINDOW
+        )
+    elif kind == "dynamodb":
+        store = DynamoDbFlapHistoryStore(
+            registry.get("dynamodb"), location, max_age=FLAP_WINDOW
+        )
+    else:
+        raise ValueError(f"Unknown flap history store: {FLAP_HISTORY_STORE}")
+    return FlapDetector(
+        store,
+        policy=FLAP_POLICY,
+        window=FLAP_WINDOW,
+        threshold=FLAP_THRESHOLD,
+        confirmations=FLAP_CONFIRMATIONS,
+        history_size=FLAP_HISTORY_SIZE,
+    )
+
+
+def create_adaptive_ttl() -> AdaptiveTtl | None:
+    """Create the adaptive TTL policy if TTL_MODE is "adaptive".
+
+    ADAPTIVE_TTL_STORE is "memory" or "dynamodb:<table name>".
+
+    :return:
+    """
+    if TTL_MODE == "fixed":
+        return None
+    if TTL_MODE != "adaptive":
+        raise ValueError(f"Unknown TTL mode: {TTL_MODE}")
+    kind, _, location = ADAPTIVE_TTL_STORE.partition(":")
+    store: ChangeRateStore
+    if kind == "memory":
+        store = MemoryChangeRateStore(max_size=PUBLISHED_IP_CACHE_SIZE)
+    elif kind == "dynamodb":
+        store = DynamoDbChangeRateStore(registry.get("dynamodb"), location)
+    else:
+        raise ValueError(f"Unknown adaptive TTL store: {ADAPTIVE_TTL_STORE}")
+    return AdaptiveTtl(
+        store,
+        min_ttl=ADAPTIVE_TTL_MIN,
+        max_ttl=ADAPTIVE_TTL_MAX,
+        fraction=ADAPTIVE_TTL_FRACTION,
+        default_ttl=ROUTE_53_RECORD_TTL,
+        change_factor=ADAPTIVE_TTL_CHANGE_FACTOR,
+    )
+
+
+def create_hosted_zone_index() -> HostedZoneIndex:
+    """Create the index of all hosted zones of the account.
+
+    :return:
+    """
+    return load_hosted_zone_index(route_53_client())
+
+
+def create_zone_executor() -> ThreadPoolExecutor:
+    """Create the thread pool for updating several hosted zones concurrently.
+
+    :return:
+    """
+    return ThreadPoolExecutor(
+        max_workers=ZONE_CONCURRENCY, thread_name_prefix="hosted-zone"
+    )
+
+
+def create_change_status_cache() -> TTLCache:
+    """Create the short-lived cache for the status of Route 53 changes.
+
+    :return:
+    """
+    return TTLCache(max_size=1024, max_age=CHANGE_STATUS_CACHE_TTL)
+
+
+def create_retry_policy() -> RetryPolicy:
+    """Create the retry policy for AWS API calls.
+
+    :return:
+    """
+    return RetryPolicy(
+        max_attempts=RETRY_MAX_ATTEMPTS,
+        base_delay=RETRY_BASE_DELAY,
+        max_delay=RETRY_MAX_DELAY,
+    )
+
+
+def create_client_rate_limiter() -> ClientRateLimiter | None:
+    """Create the rate limiter for requests per client id.
+
+    CLIENT_RATE_LIMIT is the number of requests per minute, 0 disables rate
+    limiting. CLIENT_RATE_LIMIT_STORE is "memory" or "dynamodb:<table name>".
+
+    :return:
+    """
+    if CLIENT_RATE_LIMIT <= 0:
+        return None
+    rate = CLIENT_RATE_LIMIT / 60
+    kind, _, location = CLIENT_RATE_LIMIT_STORE.partition(":")
+    if kind == "memory":
+        return MemoryClientRateLimiter(rate=rate, burst=CLIENT_RATE_LIMIT_BURST)
+    if kind == "dynamodb":
+        return DynamoDbClientRateLimiter(
+            registry.get("dynamodb"),
+            location,
+            rate=rate,
+            burst=CLIENT_RATE_LIMIT_BURST,
+        )
+    raise ValueError(f"Unknown client rate limit store: {CLIENT_RATE_LIMIT_STORE}")
+
+
+def create_authenticator() -> Authenticator | CredentialDocumentAuthenticator:
+    """Create the authenticator with its caches.
+
+    With CREDENTIALS_SECRET_ID, all clients are authenticated and authorized
+    with the credential document in that secret. Otherwise, every client id is
+    the name of the secret holding its token.
+
+    :return:
+    """
+    if CREDENTIALS_SECRET_ID:
+        return CredentialDocumentAuthenticator(
+            get_document=partial(get_secret, CREDENTIALS_SECRET_ID)
+        )
+    return Authenticator(
+        get_token=get_secret,
+        verified_tokens=TTLCache(max_size=1024, max_age=AUTH_CACHE_TTL),
+        unknown_clients=TTLCache(max_size=4096, max_age=UNKNOWN_CLIENT_CACHE_TTL),
+    )
+
+
+registry.register("retry_policy", create_retry_policy)
+registry.register("retry_metrics", RetryMetrics)
+registry.register("route53", create_route_53_client)
+registry.register("secretsmanager", create_secrets_manager_client)
+registry.register("dynamodb", create_dynamodb_client)
+registry.register("sqs", create_sqs_client)
+registry.register("secret_cache", create_secrets_manager_cache)
+registry.register("zone_snapshots", create_zone_snapshot_cache)
+registry.register("published_ips", create_published_ip_cache)
+registry.register("state_store", create_state_store)
+registry.register("flap_detector", create_flap_detector)
+registry.register("adaptive_ttl", create_adaptive_ttl)
+registry.register("hosted_zones", create_hosted_zone_index)
+registry.register("zone_executor", create_zone_executor)
+registry.register("change_statuses", create_change_status_cache)
+registry.register("authenticator", create_authenticator)
+registry.register("client_rate_limiter", create_client_rate_limiter)
+
+
+def route_53_client() -> "BaseClient":
+    """Return the Route53 client of this execution environment.
+
+    The client is created once and reused by all following invocations.
+
+    :return:
+    """
+    return registry.get("route53")
+
+
+def secrets_manager_cache() -> "SecretCache":
+    """Return the SecretsManager cache of this execution environment.
+
+    The cache is created once and reused by all following invocations, so
+    secrets are only fetched again after SECRETS_MANAGER_REFRESH_INTERVAL.
+
+    :return:
+    """
+    return registry.get("secret_cache")
+
+
 def get_secret(secret_id: str) -> str:
     """Retrieve secret.
 
@@ -58,97 +506,1253 @@ def get_secret(secret_id: str) -> str:
     :param secret_id:
     :return:
     """
-    logger.info(f"Retrieving secret for secret_id {secret_id}")
+    logger.info("Retrieving secret for secret_id %s", secret_id)
     cache = secrets_manager_cache()
-    secret = cache.get_secret_string(secret_id)
+    with metrics.phase("Secret"):
+        secret = cache.get_secret_string(secret_id)
     return secret
 
 
-def get_dns_records(domains: list[str]) -> list[DnsRecord]:
-    """Retrieve the DNS records for the given domains if they exist.
+def authenticate(client_id: str, token: str) -> bool:
+    """Check if the token belongs to the client.
+
+    Unknown clients are rejected like clients with an invalid token.
+
+    :type client_id: str
+    :param client_id:
+    :type token: str
+    :param token:
+    :return:
+    """
+    authenticator: Authenticator | CredentialDocumentAuthenticator = registry.get(
+        "authenticator"
+    )
+    return authenticator.authenticate(client_id, token)
 
-    See: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/route53/client/list_resource_record_sets.html
 
+def authorize(client_id: str, domains: list[str]) -> bool:
+    """Check if the client may update all domains.
+
+    :type client_id: str
+    :param client_id:
     :type domains: list[str]
     :param domains:
     :return:
     """
-    logger.info(f"Getting DNS record for {domains}")
+    authenticator: Authenticator | CredentialDocumentAuthenticator = registry.get(
+        "authenticator"
+    )
+    return all(authenticator.authorize(client_id, domain) for domain in domains)
+
+
+def should_prefetch(client_id: str, token: str) -> bool:
+    """Check if the DNS records are worth reading while the token is checked.
+
+    Client ids which fail authentication anyway do not cause Route 53 calls,
+    and recently verified tokens are checked without waiting for a secret.
+    Once the credential document is read, no token check waits for a secret.
+
+    :type client_id: str
+    :param client_id:
+    :type token: str
+    :param token:
+    :return:
+    """
+    authenticator: Authenticator | CredentialDocumentAuthenticator = registry.get(
+        "authenticator"
+    )
+    if authenticator.rejects(client_id):
+        return False
+    if isinstance(authenticator, CredentialDocumentAuthenticator):
+        return False
+    return not authenticator.is_verified(client_id, token)
+
+
+def rate_limit_response(client_id: str) -> dict | None:
+    """Build a 429 response if the client sent too many requests.
+
+    Client ids which fail authentication anyway are not limited, so requests
+    with made up client ids do not add state to the rate limiter.
+
+    :type client_id: str
+    :param client_id:
+    :return: None if the request is allowed
+    """
+    client_rate_limiter: ClientRateLimiter | None = registry.get("client_rate_limiter")
+    if client_rate_limiter is None:
+        return None
+    authenticator: Authenticator | CredentialDocumentAuthenticator = registry.get(
+        "authenticator"
+    )
+    if authenticator.rejects(client_id):
+        return None
+    retry_after = client_rate_limiter.acquire(client_id)
+    if retry_after <= 0:
+        return None
+    logger.warning("Client %s exceeded the rate limit", client_id)
+    metrics.count("RateLimited")
+    return {
+        "statusCode": 429,
+        "headers": {"Retry-After": str(math.ceil(retry_after))},
+        "body": json.dumps("Too many requests"),
+    }
+
+
+def parse_client_ip_address(
+    value: str,
+) -> ipaddress.IPv4Address | ipaddress.IPv6Address:
+    """Parse the address of a client or proxy.
+
+    IPv4 addresses mapped to IPv6 by dual-stack sockets are returned as IPv4
+    addresses, so they set the A-record.
+
+    :type value: str
+    :param value: IP address, optionally with prefix length
+    :return:
+    """
+    ip_address = ipaddress.ip_interface(value.strip()).ip
+    if isinstance(ip_address, ipaddress.IPv6Address) and ip_address.ipv4_mapped:
+        return ip_address.ipv4_mapped
+    return ip_address
+
+
+def client_ip_address(event: dict) -> str | None:
+    """Return the address of the client which sent the request.
+
+    The source IP of the request is the client unless it is a trusted proxy.
+    Then the X-Forwarded-For header is read from the right, the first address
+    which is no trusted proxy is the client. Addresses left of it may be forged
+    by the client and are ignored. The walk stops at a hop which is no address,
+    e.g. "unknown" or with a port, as the client cannot be told from it.
+
+    :type event: dict
+    :param event:
+    :return: None if the client is unknown, e.g. all hops are trusted proxies
+    """
+    source_ip = event.get("requestContext", {}).get("http", {}).get("sourceIp")
+    if not source_ip:
+        return None
+    forwarded_for = (event.get("headers") or {}).get("x-forwarded-for", "")
+    hops = [hop for hop in forwarded_for.split(",") if hop.strip()]
+    try:
+        ip_address = parse_client_ip_address(source_ip)
+        while any(ip_address in network for network in TRUSTED_PROXIES):
+            if not hops:
+                return None
+            ip_address = parse_client_ip_address(hops.pop())
+    except ValueError:
+        return None
+    return ip_address.compressed
+
+
+def parse_ip_addresses(
+    query_parameters: dict, event: dict | None = None
+) -> dict[str, str]:
+    """Parse the IP addresses from the ip and ip6 query parameters.
+
+    The record type is derived from the address family, so an IPv6 address
+    can be sent with either parameter. The value auto, or omitting both
+    parameters, uses the address of the client, which is only looked up then.
+
+    :type query_parameters: dict
+    :param query_parameters:
+    :type event: dict | None
+    :param event: request, see client_ip_address()
+    :return: IP address per record type
+    """
+    parameters = {
+        parameter: query_parameters[parameter]
+        for parameter in ("ip", "ip6")
+        if parameter in query_parameters
+    } or {"ip": AUTO_IP_ADDRESS}
+    ip_addresses: dict[str, str] = {}
+    for parameter, value in parameters.items():
+        if value == AUTO_IP_ADDRESS:
+            client_ip = None if event is None else client_ip_address(event)
+            if client_ip is None:
+                raise KeyError(parameter)
+            value = client_ip
+        ip_address = ipaddress.ip_address(value)
+        record_type = RECORD_TYPES[ip_address.version]
+        if record_type in ip_addresses:
+            raise ValueError(f"Multiple IP addresses for record type {record_type}")
+        ip_addresses[record_type] = ip_address.compressed
+    return ip_addresses
+
+
+def normalize_ip_address(value: str) -> str:
+    """Normalize an IP address, so IPv6 addresses can be compared as strings.
+
+    :type value: str
+    :param value:
+    :return:
+    """
+    try:
+        return ipaddress.ip_address(value).compressed
+    except ValueError:
+        return value
+
+
+def published_ip_key(
+    hosted_zone_id: str, domain: str, record_type: str
+) -> tuple[str, str, str]:
+    """Return the key of a record in the published IP cache.
+
+    :type hosted_zone_id: str
+    :param hosted_zone_id:
+    :type domain: str
+    :param domain:
+    :type record_type: str
+    :param record_type:
+    :return:
+    """
+    return hosted_zone_id, normalize_record_name(domain), record_type
+
+
+def report_ip_address(hosted_zone_id: str, dns_record: DnsRecord, ip: str) -> None:
+    """Add a reported IP address to the flap history of its record.
+
+    :type hosted_zone_id: str
+    :param hosted_zone_id:
+    :type dns_record: DnsRecord
+    :param dns_record: record as published in Route 53
+    :type ip: str
+    :param ip:
+    :return:
+    """
+    flap_detector: FlapDetector | None = registry.get("flap_detector")
+    if flap_detector is None:
+        return
+    flap_detector.report(
+        published_ip_key(hosted_zone_id, dns_record.domain, dns_record.record_type),
+        ip,
+        published=dns_record.ip,
+    )
+
 
-    # Determine StartRecordName
+def is_held(hosted_zone_id: str, domain: str, record_type: str, ip: str) -> bool:
+    """Check if writing the IP address is held back because the record flaps.
+
+    :type hosted_zone_id: str
+    :param hosted_zone_id:
+    :type domain: str
+    :param domain:
+    :type record_type: str
+    :param record_type:
+    :type ip: str
+    :param ip:
+    :return:
+    """
+    flap_detector: FlapDetector | None = registry.get("flap_detector")
+    if flap_detector is None or not flap_detector.holds(
+        published_ip_key(hosted_zone_id, domain, record_type), ip
+    ):
+        return False
+    logger.info(
+        "%s record for domain %s is flapping, ip %s is held back",
+        record_type,
+        domain,
+        ip,
+    )
+    metrics.count("SuppressedWrites")
+    return True
+
+
+def record_ttl(
+    hosted_zone_id: str, dns_record: DnsRecord, ip: str, changed: bool
+) -> int | None:
+    """Return the TTL to write the IP address with.
+
+    With the adaptive TTL mode, changes of the IP address are tracked and the
+    TTL of an unchanged record is only changed if it is far off.
+
+    :type hosted_zone_id: str
+    :param hosted_zone_id:
+    :type dns_record: DnsRecord
+    :param dns_record:
+    :type ip: str
+    :param ip:
+    :type changed: bool
+    :param changed: True if the IP address of the record changes
+    :return: None if the record does not need to be written
+    """
+    adaptive_ttl: AdaptiveTtl | None = registry.get("adaptive_ttl")
+    if adaptive_ttl is None:
+        return ROUTE_53_RECORD_TTL if changed else None
+    key = published_ip_key(hosted_zone_id, dns_record.domain, dns_record.record_type)
+    if changed:
+        return adaptive_ttl.record_change(key, time())
+    if dns_record.ttl is None:
+        return None
+    ttl = adaptive_ttl.ttl_update(key, dns_record.ttl, time())
+    if ttl is not None:
+        logger.info(
+            "TTL of %s record for domain %s will be changed from %d to %d",
+            dns_record.record_type,
+            dns_record.domain,
+            dns_record.ttl,
+            ttl,
+        )
+        metrics.count("TtlUpdates")
+    return ttl
+
+
+def is_published_by_batch_handler(key: tuple[str, str, str], ip: str) -> bool:
+    """Check if the batch handler recently published the IP address of a record.
+
+    The batch handler runs in other execution environments, so only its writes
+    to the state store are visible. A hit is added to the published IP cache.
+
+    :type key: tuple[str, str, str]
+    :param key: (hosted zone id, domain, record type)
+    :type ip: str
+    :param ip:
+    :return: False unless updates are queued and a state store is configured
+    """
+    state_store: StateStore | None = registry.get("state_store")
+    if not UPDATE_QUEUE_URL or state_store is None:
+        return False
+    state = state_store.get(key)
+    if (
+        state is None
+        or state.value != ip
+        or time() - state.updated_at >= STATE_STORE_MAX_AGE
+    ):
+        return False
+    published_ips: TTLCache = registry.get("published_ips")
+    published_ips.set(key, ip)
+    return True
+
+
+def is_published(
+    hosted_zones: dict[str, list[str]], ip_addresses: dict[str, str]
+) -> bool:
+    """Check if this process recently published the IP addresses for all domains.
+
+    Entries expire after PUBLISHED_IP_CACHE_MAX_AGE seconds, so the records are
+    validated against Route 53 again from time to time. With queued updates
+    the batch handler publishes the IP addresses, so records missing from the
+    cache are looked up in the state store it writes.
+
+    :type hosted_zones: dict[str, list[str]]
+    :param hosted_zones: domains per hosted zone id
+    :type ip_addresses: dict[str, str]
+    :param ip_addresses:
+    :return:
+    """
+    published_ips: TTLCache = registry.get("published_ips")
+    published = all(
+        published_ips.get(key) == ip or is_published_by_batch_handler(key, ip)
+        for key, ip in (
+            (published_ip_key(hosted_zone_id, domain, record_type), ip)
+            for hosted_zone_id, domains in hosted_zones.items()
+            for domain in domains
+            for record_type, ip in ip_addresses.items()
+        )
+    )
+    metrics.count("PublishedIpCacheHit" if published else "PublishedIpCacheMiss")
+    return published
+
+
+def get_dns_records(
+    hosted_zone_id: str,
+    domains: list[str],
+    record_types: list[str] | None = None,
+    loaded_snapshots: list[ZoneSnapshot] | None = None,
+) -> list[DnsRecord]:
+    """Retrieve the DNS records for the given domains if they exist.
+
+    If a state store is configured and holds recent values for all records,
+    these are used. Otherwise, the records are looked up in a snapshot of the
+    whole hosted zone which is cached for ROUTE_53_ZONE_CACHE_TTL seconds, so
+    A and AAAA records are read in the same pass. Without a cached snapshot,
+    the records of up to ROUTE_53_RECORD_LOOKUP_MAX_NAMES domains are read
+    one call per domain instead of paging through the whole zone.
+
+    :type hosted_zone_id: str
+    :param hosted_zone_id:
+    :type domains: list[str]
+    :param domains:
+    :type record_types: list[str] | None
+    :param record_types: defaults to A records
+    :type loaded_snapshots: list[ZoneSnapshot] | None
+    :param loaded_snapshots: if given, the zone snapshot is appended instead of
+        cached, so it can be cached once the client is authenticated
+    :return:
+    """
+    logger.info("Getting DNS record for %s", domains)
     domains.sort()
-    start_record_name = domains[0]
+    record_types = record_types or ["A"]
+    keys = [(domain, record_type) for domain in domains for record_type in record_types]
 
-    # Get current DNS records
-    client = route_53_client()
-    current_route53_record_set = client.list_resource_record_sets(
-        HostedZoneId=ROUTE_53_HOSTED_ZONE_ID,
-        StartRecordType=ROUTE_53_RECORD_TYPE,
-        StartRecordName=start_record_name,
+    state_store: StateStore | None = registry.get("state_store")
+    states = {}
+    if state_store is not None:
+        states = {
+            key: state_store.get(published_ip_key(hosted_zone_id, *key)) for key in keys
+        }
+        if all(
+            state is not None and time() - state.updated_at < STATE_STORE_MAX_AGE
+            for state in states.values()
+        ):
+            metrics.count("StateStoreHit")
+            return [
+                DnsRecord(
+                    domain=domain,
+                    ip=state.value,
+                    values=(state.value,),
+                    state=state,
+                    record_type=record_type,
+                )
+                for (domain, record_type), state in states.items()
+            ]
+        metrics.count("StateStoreMiss")
+
+    zone_snapshots: ZoneSnapshotCache = registry.get("zone_snapshots")
+    snapshot = zone_snapshots.get(
+        route_53_client(),
+        hosted_zone_id,
+        names=domains if len(domains) <= ROUTE_53_RECORD_LOOKUP_MAX_NAMES else None,
+        record_types=record_types,
+        loaded=loaded_snapshots,
     )
 
     # Compile return data
     dns_records = []
-    for domain in domains:
-        try:
-            resource_record_sets = current_route53_record_set["ResourceRecordSets"]
-            matching_resource_record_set = next(
-                resource_record_set
-                for resource_record_set in resource_record_sets
-                if resource_record_set["Name"] == f"{domain}."
+    for domain, record_type in keys:
+        values = tuple(
+            normalize_ip_address(value)
+            for value in snapshot.values(domain, record_type)
+        )
+        state = states.get((domain, record_type))
+        if values:
+            dns_records.append(
+                DnsRecord(
+                    domain=domain,
+                    ip=values[0],
+                    values=values,
+                    state=state,
+                    record_type=record_type,
+                    ttl=snapshot.get(domain, record_type).get("TTL"),
+                )
+            )
+        else:
+            logger.info("Could not find %s record for domain %s", record_type, domain)
+            dns_records.append(
+                DnsRecord(domain=domain, ip=None, state=state, record_type=record_type)
             )
-            current_route53_ip = matching_resource_record_set["ResourceRecords"][0][
-                "Value"
-            ]
-            dns_records.append(DnsRecord(domain=domain, ip=current_route53_ip))
-        except (KeyError, IndexError, StopIteration):
-            logger.info(f"Could not find IP address for domain {domain}")
-            dns_records.append(DnsRecord(domain=domain, ip=None))
     return dns_records
 
 
-def set_dns_records(dns_records: list[DnsRecord], ip: str):
-    """Change the DNS record for the given domain.
+def record_dns_records(
+    hosted_zone_id: str, dns_records: list[DnsRecord], ip_addresses: dict[str, str]
+):
+    """Record the published IP addresses for the given DNS records.
 
-    See: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/route53/client/change_resource_record_sets.html
+    If another execution environment changed the state of a record in the
+    meantime, it is unknown which IP address Route 53 ended up with. The state
+    and the cached records are dropped then, so the next request reads them
+    from Route 53.
 
+    :type hosted_zone_id: str
+    :param hosted_zone_id:
     :type dns_records: list[DnsRecord]
     :param dns_records:
-    :type ip: str
-    :param ip:
+    :type ip_addresses: dict[str, str]
+    :param ip_addresses: IP address per record type
     :return:
     """
+    published_ips: TTLCache = registry.get("published_ips")
+    state_store: StateStore | None = registry.get("state_store")
+    conflict = False
+    for dns_record in dns_records:
+        ip = ip_addresses[dns_record.record_type]
+        key = published_ip_key(
+            hosted_zone_id, dns_record.domain, dns_record.record_type
+        )
+        published_ips.set(key, ip)
+
+        state = dns_record.state
+        if state_store is None or (
+            state is not None
+            and state.value == ip
+            and time() - state.updated_at < STATE_STORE_MAX_AGE
+        ):
+            continue
+        expected_version = None if state is None else state.version
+        if not state_store.put(key, ip, expected_version):
+            logger.warning(
+                "State of %s record for domain %s was changed concurrently",
+                dns_record.record_type,
+                dns_record.domain,
+            )
+            metrics.count("StateStoreConflict")
+            state_store.delete(key)
+            published_ips.pop(key)
+            conflict = True
+    if conflict:
+        zone_snapshots: ZoneSnapshotCache = registry.get("zone_snapshots")
+        zone_snapshots.invalidate(hosted_zone_id)
+
+
+def set_dns_records(
+    hosted_zone_id: str, dns_records: list[DnsRecord], ip_addresses: dict[str, str]
+):
+    """Change the DNS records for the given domains in one change batch.
+
+    Records the flap detector holds back are left unchanged. TTL changes of
+    the adaptive TTL mode are part of the same change batch.
+
+    See: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/route53/client/change_resource_record_sets.html
+
+    :type hosted_zone_id: str
+    :param hosted_zone_id:
+    :type dns_records: list[DnsRecord]
+    :param dns_records:
+    :type ip_addresses: dict[str, str]
+    :param ip_addresses: IP address per record type
+    :return: id of the submitted change, None if nothing changed
+    """
+    change_id = None
     changes: list[dict] = []
+    held: list[DnsRecord] = []
     for dns_record in dns_records:
-        if (dns_record.ip is None) or (dns_record.ip != ip):
+        ip = ip_addresses[dns_record.record_type]
+        changed = (dns_record.ip != ip) or (len(dns_record.values) > 1)
+        report_ip_address(hosted_zone_id, dns_record, ip)
+        if changed and is_held(
+            hosted_zone_id, dns_record.domain, dns_record.record_type, ip
+        ):
+            held.append(dns_record)
+            continue
+        ttl = record_ttl(hosted_zone_id, dns_record, ip, changed)
+        if ttl is not None:
             logger.info(
-                f"DNS record for domain {dns_record.domain} "
-                f"will be updated with ip {ip}"
+                "%s record for domain %s will be updated with ip %s",
+                dns_record.record_type,
+                dns_record.domain,
+                ip,
             )
-            change = {
-                "Action": "UPSERT",
-                "ResourceRecordSet": {
-                    "Name": dns_record.domain,
-                    "Type": ROUTE_53_RECORD_TYPE,
-                    "TTL": ROUTE_53_RECORD_TTL,
-                    "ResourceRecords": [{"Value": ip}],
-                },
-            }
+            change = build_change(dns_record.domain, dns_record.record_type, ip, ttl)
             changes.append(change)
         else:
             logger.info(
-                f"DNS record for domain {dns_record.domain} "
-                f"matched and will not be updated"
+                "%s record for domain %s matched and will not be updated",
+                dns_record.record_type,
+                dns_record.domain,
             )
 
     if changes:
         client = route_53_client()
-        client.change_resource_record_sets(
-            HostedZoneId=ROUTE_53_HOSTED_ZONE_ID,
-            ChangeBatch={"Changes": changes},
+        with metrics.phase("SubmitChanges"):
+            response = client.change_resource_record_sets(
+                HostedZoneId=hosted_zone_id,
+                ChangeBatch={"Changes": changes},
+            )
+        zone_snapshots: ZoneSnapshotCache = registry.get("zone_snapshots")
+        zone_snapshots.apply_changes(hosted_zone_id, changes)
+        change_id = cache_change_info(response["ChangeInfo"])["change_id"]
+
+    record_dns_records(
+        hosted_zone_id,
+        [dns_record for dns_record in dns_records if dns_record not in held],
+        ip_addresses,
+    )
+    return change_id
+
+
+def update_dns_records(
+    hosted_zone_id: str, domains: list[str], ip_addresses: dict[str, str]
+):
+    """Read and change the DNS records for the given domains of one hosted zone.
+
+    :type hosted_zone_id: str
+    :param hosted_zone_id:
+    :type domains: list[str]
+    :param domains:
+    :type ip_addresses: dict[str, str]
+    :param ip_addresses: IP address per record type
+    :return: id of the submitted change, None if nothing changed
+    """
+    with metrics.phase("ReadRecords"):
+        dns_records = get_dns_records(hosted_zone_id, domains, list(ip_addresses))
+    return set_dns_records(hosted_zone_id, dns_records, ip_addresses)
+
+
+def resolve_hosted_zone(domain: str) -> str:
+    """Return the id of the hosted zone the domain belongs to.
+
+    With ROUTE_53_ZONE_DISCOVERY all hosted zones of the account are listed
+    once per execution environment and the domain is assigned to the most
+    specific zone. Otherwise, all domains belong to ROUTE_53_HOSTED_ZONE_ID.
+
+    :type domain: str
+    :param domain:
+    :return:
+    :raises HostedZoneNotFound: if no hosted zone contains the domain
+    """
+    if not ROUTE_53_ZONE_DISCOVERY:
+        return ROUTE_53_HOSTED_ZONE_ID
+
+    hosted_zone_index: HostedZoneIndex = registry.get("hosted_zones")
+    return hosted_zone_index.resolve(domain)
+
+
+def group_domains_by_hosted_zone(domains: list[str]) -> dict[str, list[str]]:
+    """Group the domains by the hosted zone they belong to.
+
+    :type domains: list[str]
+    :param domains:
+    :return: domains per hosted zone id
+    """
+    if not ROUTE_53_ZONE_DISCOVERY:
+        return {ROUTE_53_HOSTED_ZONE_ID: domains}
+
+    hosted_zones: dict[str, list[str]] = {}
+    for domain in domains:
+        hosted_zones.setdefault(resolve_hosted_zone(domain), []).append(domain)
+    return hosted_zones
+
+
+def map_hosted_zones(
+    function: Callable[[str, Any], Any], arguments: dict[str, Any]
+) -> dict[str, Any]:
+    """Call function for every hosted zone, concurrently if there are several.
+
+    :type function: Callable[[str, Any], Any]
+    :param function: called with the hosted zone id and its argument
+    :type arguments: dict[str, Any]
+    :param arguments: argument per hosted zone id
+    :return: result per hosted zone id
+    """
+    if len(arguments) == 1:
+        ((hosted_zone_id, argument),) = arguments.items()
+        return {hosted_zone_id: function(hosted_zone_id, argument)}
+
+    executor: ThreadPoolExecutor = registry.get("zone_executor")
+    futures = {
+        hosted_zone_id: executor.submit(
+            copy_context().run, function, hosted_zone_id, argument
+        )
+        for hosted_zone_id, argument in arguments.items()
+    }
+    return {
+        hosted_zone_id: future.result() for hosted_zone_id, future in futures.items()
+    }
+
+
+def update_hosted_zones(
+    hosted_zones: dict[str, list[str]], ip_addresses: dict[str, str]
+):
+    """Update the DNS records of several hosted zones concurrently.
+
+    :type hosted_zones: dict[str, list[str]]
+    :param hosted_zones: domains per hosted zone id
+    :type ip_addresses: dict[str, str]
+    :param ip_addresses: IP address per record type
+    :return: ids of the submitted changes
+    """
+    change_ids = map_hosted_zones(
+        partial(update_dns_records, ip_addresses=ip_addresses), hosted_zones
+    )
+    return [change_id for change_id in change_ids.values() if change_id is not None]
+
+
+class RecordPrefetch:
+    """DNS records read while the client is authenticated.
+
+    Nothing read by the prefetch is cached before the client is authenticated,
+    so clients with invalid tokens cannot fill the caches.
+    """
+
+    def __init__(
+        self,
+        hosted_zones: dict[str, list[str]],
+        published: bool,
+        futures: dict[str, Future],
+    ):
+        """Initialize the prefetch.
+
+        :type hosted_zones: dict[str, list[str]]
+        :param hosted_zones: domains per hosted zone id
+        :type published: bool
+        :param published: True if the IP addresses are published already
+        :type futures: dict[str, Future]
+        :param futures: DNS records and loaded snapshots per hosted zone id
+        """
+        self.hosted_zones = hosted_zones
+        self.published = published
+        self.futures = futures
+
+    @classmethod
+    def start(
+        cls, domains: list[str], ip_addresses: dict[str, str]
+    ) -> "RecordPrefetch | None":
+        """Start reading the DNS records of all domains in the background.
+
+        :type domains: list[str]
+        :param domains:
+        :type ip_addresses: dict[str, str]
+        :param ip_addresses: IP address per record type
+        :return: None if the domains cannot be updated, the request fails later
+        """
+        try:
+            hosted_zones = group_domains_by_hosted_zone(domains)
+        except HostedZoneNotFound:
+            return None
+        published = is_published(hosted_zones, ip_addresses)
+        futures = {}
+        if not published:
+            executor: ThreadPoolExecutor = registry.get("zone_executor")
+            futures = {
+                hosted_zone_id: executor.submit(
+                    copy_context().run,
+                    cls.read,
+                    hosted_zone_id,
+                    list(zone_domains),
+                    list(ip_addresses),
+                )
+                for hosted_zone_id, zone_domains in hosted_zones.items()
+            }
+        return cls(hosted_zones, published, futures)
+
+    @staticmethod
+    def read(
+        hosted_zone_id: str, domains: list[str], record_types: list[str]
+    ) -> tuple[list[DnsRecord], list[ZoneSnapshot]]:
+        """Read the DNS records of one hosted zone without caching the snapshot.
+
+        :type hosted_zone_id: str
+        :param hosted_zone_id:
+        :type domains: list[str]
+        :param domains:
+        :type record_types: list[str]
+        :param record_types:
+        :return: DNS records and the snapshot they were read from
+        """
+        loaded_snapshots: list[ZoneSnapshot] = []
+        dns_records = get_dns_records(
+            hosted_zone_id, domains, record_types, loaded_snapshots
+        )
+        return dns_records, loaded_snapshots
+
+    def apply(self, ip_addresses: dict[str, str]) -> list[str]:
+        """Change the prefetched DNS records of all hosted zones.
+
+        Must only be called after the client was authenticated.
+
+        :type ip_addresses: dict[str, str]
+        :param ip_addresses: IP address per record type
+        :return: ids of the submitted changes
+        """
+        zone_snapshots: ZoneSnapshotCache = registry.get("zone_snapshots")
+
+        def update(hosted_zone_id: str, future: Future) -> str | None:
+            with metrics.phase("ReadRecords"):
+                dns_records, loaded_snapshots = future.result()
+            for snapshot in loaded_snapshots:
+                zone_snapshots.put(snapshot)
+            return set_dns_records(hosted_zone_id, dns_records, ip_addresses)
+
+        futures, self.futures = self.futures, {}
+        change_ids = map_hosted_zones(update, futures)
+        return [change_id for change_id in change_ids.values() if change_id is not None]
+
+    def discard(self) -> None:
+        """Cancel or ignore reads which were not used.
+
+        :return:
+        """
+        for future in self.futures.values():
+            future.cancel()
+        if self.futures:
+            metrics.count("PrefetchDiscarded")
+        self.futures = {}
+
+
+def cache_change_info(change_info: dict) -> dict:
+    """Cache the status of a change and return it.
+
+    Changes which reached INSYNC never change again and are cached for
+    longer.
+
+    :type change_info: dict
+    :param change_info:
+    :return:
+    """
+    change_id = change_info["Id"].rsplit("/", 1)[-1]
+    change_status = {
+        "change_id": change_id,
+        "status": change_info["Status"],
+        "submitted_at": str(change_info["SubmittedAt"]),
+    }
+    change_statuses: TTLCache = registry.get("change_statuses")
+    if change_status["status"] == "INSYNC":
+        change_statuses.set(change_id, change_status, max_age=INSYNC_CACHE_TTL)
+    else:
+        change_statuses.set(change_id, change_status)
+    return change_status
+
+
+def get_change_status(change_id: str) -> dict:
+    """Retrieve the propagation status of a change.
+
+    See: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/route53/client/get_change.html
+
+    :type change_id: str
+    :param change_id:
+    :return:
+    """
+    change_statuses: TTLCache = registry.get("change_statuses")
+    change_status = change_statuses.get(change_id)
+    metrics.count(
+        "ChangeStatusCacheMiss" if change_status is None else "ChangeStatusCacheHit"
+    )
+    if change_status is None:
+        response = route_53_client().get_change(Id=change_id)
+        change_status = cache_change_info(response["ChangeInfo"])
+    return change_status
+
+
+def enqueue_update(hosted_zones: dict[str, list[str]], ip_addresses: dict[str, str]):
+    """Send an update to UPDATE_QUEUE_URL for the batch handler.
+
+    See: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/sqs/client/send_message.html
+
+    :type hosted_zones: dict[str, list[str]]
+    :param hosted_zones: domains per hosted zone id
+    :type ip_addresses: dict[str, str]
+    :param ip_addresses: IP address per record type
+    :return:
+    """
+    client: BaseClient = registry.get("sqs")
+    client.send_message(
+        QueueUrl=UPDATE_QUEUE_URL,
+        MessageBody=json.dumps(
+            {"hosted_zones": hosted_zones, "ip_addresses": ip_addresses}
+        ),
+    )
+
+
+def coalesce_updates(
+    records: list[dict],
+) -> tuple[dict[str, dict[tuple[str, str], tuple[str, str]]], list[str]]:
+    """Merge the updates of SQS messages, the last sent update of a record wins.
+
+    :type records: list[dict]
+    :param records: SQS messages
+    :return: (IP address and message id per (domain, record type) per hosted
+        zone id, ids of invalid messages)
+    """
+    updates: dict[str, dict[tuple[str, str], tuple[str, str]]] = {}
+    invalid_message_ids: list[str] = []
+    records = sorted(
+        records, key=lambda record: int(record["attributes"]["SentTimestamp"])
+    )
+    for record in records:
+        message_id = record["messageId"]
+        try:
+            body = json.loads(record["body"])
+            for hosted_zone_id, domains in body["hosted_zones"].items():
+                zone_updates = updates.setdefault(hosted_zone_id, {})
+                for domain in domains:
+                    for record_type, ip in body["ip_addresses"].items():
+                        zone_updates[(normalize_record_name(domain), record_type)] = (
+                            ip,
+                            message_id,
+                        )
+        except (KeyError, TypeError, AttributeError, ValueError):
+            logger.exception("Invalid message %s", message_id)
+            invalid_message_ids.append(message_id)
+    return updates, invalid_message_ids
+
+
+def apply_updates(
+    hosted_zone_id: str, updates: dict[tuple[str, str], str]
+) -> dict[tuple[str, str], dict]:
+    """Apply updates to one hosted zone with as few change batches as possible.
+
+    Records whose IP address this execution environment published recently
+    are not read again.
+
+    :type hosted_zone_id: str
+    :param hosted_zone_id:
+    :type updates: dict[tuple[str, str], str]
+    :param updates: IP address per (domain, record type)
+    :return: result per (domain, record type) with the status "unchanged",
+        "held" if the record flaps, "updated" and the change id or "failed" and
+        the error code
+    """
+    results: dict[tuple[str, str], dict] = {}
+    published_ips: TTLCache = registry.get("published_ips")
+    pending: dict[tuple[str, str], str] = {}
+    for key, ip in updates.items():
+        if published_ips.get(published_ip_key(hosted_zone_id, *key)) == ip:
+            results[key] = {"status": "unchanged"}
+        else:
+            pending[key] = ip
+    if not pending:
+        return results
+
+    domains = sorted({domain for domain, _ in pending})
+    record_types = sorted({record_type for _, record_type in pending})
+    with metrics.phase("ReadRecords"):
+        dns_records = [
+            dns_record
+            for dns_record in get_dns_records(hosted_zone_id, domains, record_types)
+            if (dns_record.domain, dns_record.record_type) in pending
+        ]
+
+    changed_records: dict[tuple[str, str], DnsRecord] = {}
+    ttls: dict[tuple[str, str], int] = {}
+    for dns_record in dns_records:
+        key = (dns_record.domain, dns_record.record_type)
+        ip = pending[key]
+        changed = (dns_record.ip != ip) or (len(dns_record.values) > 1)
+        report_ip_address(hosted_zone_id, dns_record, ip)
+        if changed and is_held(hosted_zone_id, *key, ip):
+            results[key] = {"status": "held"}
+            continue
+        ttl = record_ttl(hosted_zone_id, dns_record, ip, changed)
+        if ttl is not None:
+            changed_records[key] = dns_record
+            ttls[key] = ttl
+        else:
+            record_dns_records(hosted_zone_id, [dns_record], {key[1]: ip})
+            results[key] = {"status": "unchanged"}
+
+    client = route_53_client()
+    zone_snapshots: ZoneSnapshotCache = registry.get("zone_snapshots")
+    changes = (build_change(*key, pending[key], ttls[key]) for key in changed_records)
+    for chunk in chunk_changes(changes):
+        keys = [
+            (
+                change["ResourceRecordSet"]["Name"],
+                change["ResourceRecordSet"]["Type"],
+            )
+            for change in chunk
+        ]
+        try:
+            with metrics.phase("SubmitChanges"):
+                response = client.change_resource_record_sets(
+                    HostedZoneId=hosted_zone_id, ChangeBatch={"Changes": chunk}
+                )
+        except ClientError as exc:
+            logger.exception("Change batch for hosted zone %s failed", hosted_zone_id)
+            error = exc.response["Error"]["Code"]
+            results.update({key: {"status": "failed", "error": error} for key in keys})
+            continue
+        zone_snapshots.apply_changes(hosted_zone_id, chunk)
+        change_id = cache_change_info(response["ChangeInfo"])["change_id"]
+        logger.info("Changed %d records in hosted zone %s", len(chunk), hosted_zone_id)
+        for key in keys:
+            record_dns_records(
+                hosted_zone_id, [changed_records[key]], {key[1]: pending[key]}
+            )
+            results[key] = {"status": "updated", "change_id": change_id}
+
+    return results
+
+
+def apply_coalesced_updates(
+    hosted_zone_id: str, updates: dict[tuple[str, str], tuple[str, str]]
+) -> set[str]:
+    """Apply merged updates to one hosted zone with as few change batches as possible.
+
+    :type hosted_zone_id: str
+    :param hosted_zone_id:
+    :type updates: dict[tuple[str, str], tuple[str, str]]
+    :param updates: IP address and message id per (domain, record type)
+    :return: ids of the messages whose update failed
+    """
+    results = apply_updates(
+        hosted_zone_id, {key: ip for key, (ip, _) in updates.items()}
+    )
+    return {
+        updates[key][1]
+        for key, result in results.items()
+        if result["status"] == "failed"
+    }
+
+
+def bounded_by_remaining_time(
+    handler: Callable[[dict, Any], dict],
+) -> Callable[[dict, Any], dict]:
+    """Decorate a Lambda handler to bound its AWS API calls by the timeout.
+
+    The deadline is the remaining time of the invocation minus
+    DEADLINE_RESERVE_MS.
+
+    :type handler: Callable[[dict, Any], dict]
+    :param handler:
+    :return:
+    """
+
+    @wraps(handler)
+    def wrapper(event: dict, context: Any) -> dict:
+        invocation_deadline = deadline.Deadline.from_context(context, DEADLINE_RESERVE)
+        with deadline.bounded(invocation_deadline):
+            return handler(event, context)
+
+    return wrapper
+
+
+@metrics.instrumented
+@profiling.profiled
+@bounded_by_remaining_time
+def batch_handler(event: dict, context: dict):
+    """Lambda handler for batches of queued updates from SQS.
+
+    Updates of the same record are deduplicated and all updates of a hosted
+    zone are merged into as few change batches as possible. Failed messages
+    are reported as partial batch response, so only these are retried.
+
+    See: https://docs.aws.amazon.com/lambda/latest/dg/services-sqs-errorhandling.html#services-sqs-batchfailurereporting
+
+    :type: event: dict
+    :param event:
+    :type: context: dict
+    :param context:
+    :return:
+    """
+    updates, failed_message_ids = coalesce_updates(event["Records"])
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(
+            "Merged %d messages into %d updates",
+            len(event["Records"]),
+            sum(len(zone_updates) for zone_updates in updates.values()),
         )
+    for hosted_zone_id, zone_updates in updates.items():
+        try:
+            failed_message_ids.extend(
+                apply_coalesced_updates(hosted_zone_id, zone_updates)
+            )
+        except Exception:
+            logger.exception("Updating hosted zone %s failed", hosted_zone_id)
+            failed_message_ids.extend(
+                message_id for _, message_id in zone_updates.values()
+            )
+    return {
+        "batchItemFailures": [
+            {"itemIdentifier": message_id}
+            for message_id in dict.fromkeys(failed_message_ids)
+        ]
+    }
+
+
+def deadline_exceeded_response(exc: deadline.DeadlineExceeded) -> dict:
+    """Build the response for a request which ran out of time.
+
+    :type exc: deadline.DeadlineExceeded
+    :param exc:
+    :return:
+    """
+    logger.error("Deadline exceeded: %s", exc)
+    metrics.count("DeadlineExceeded")
+    return {
+        "statusCode": 503,
+        "headers": {"Retry-After": "1"},
+        "body": json.dumps("Request timed out, please retry"),
+    }
+
+
+def client_error_response(exc: ClientError) -> dict:
+    """Build the response for a failed AWS API call.
+
+    :type exc: ClientError
+    :param exc:
+    :return:
+    """
+    if is_retriable_error(exc):
+        logger.exception("AWS API is temporarily unavailable")
+        return {
+            "statusCode": 503,
+            "headers": {"Retry-After": "1"},
+            "body": json.dumps("Service temporarily unavailable"),
+        }
+    message = str(exc)
+    logger.exception("%s", message)
+    return {"statusCode": 500, "body": json.dumps(message)}
+
+
+def is_bulk_request(event: dict) -> bool:
+    """Check if the event is a bulk update request.
+
+    POST requests carrying the update in the query string are handled like GET
+    requests, so only a POST request without any of the update query parameters
+    is a bulk update request.
+
+    :type event: dict
+    :param event:
+    :return:
+    """
+    if event.get("requestContext", {}).get("http", {}).get("method") != "POST":
+        return False
+    query_parameters: dict = event.get("queryStringParameters") or {}
+    return not any(
+        name in query_parameters for name in ("client_id", "token", "domain")
+    )
+
+
+def parse_bulk_request(event: dict) -> tuple[str, str, list]:
+    """Parse the JSON body of a bulk update request.
+
+    :type event: dict
+    :param event:
+    :return: client id, token and entries
+    """
+    body = event.get("body") or ""
+    if event.get("isBase64Encoded"):
+        body = base64.b64decode(body).decode()
+    request = json.loads(body)
+    if not isinstance(request, dict):
+        raise ValueError("Request body must be a JSON object")
+    client_id = request["client_id"]
+    token = request["token"]
+    entries = request["updates"]
+    if not isinstance(entries, list):
+        raise ValueError("updates must be a list")
+    if len(entries) > BULK_UPDATE_MAX_ENTRIES:
+        raise ValueError(f"More than {BULK_UPDATE_MAX_ENTRIES} updates")
+    return client_id, token, entries
+
+
+def parse_bulk_entry(entry: Any) -> tuple[str, str, str]:
+    """Validate one entry of a bulk update request.
+
+    The record type is derived from the IP address if it is not given.
+
+    :param entry:
+    :return: normalized domain, record type and IP address
+    """
+    if not isinstance(entry, dict):
+        raise ValueError("Entry must be a JSON object")
+    domain = entry.get("domain")
+    if not isinstance(domain, str) or not domain.strip("."):
+        raise ValueError("Missing domain")
+    try:
+        ip_address = ipaddress.ip_address(str(entry["ip"]))
+    except (KeyError, ValueError):
+        raise ValueError("Invalid IP address") from None
+    record_type = RECORD_TYPES[ip_address.version]
+    if entry.get("type", record_type) != record_type:
+        raise ValueError(f"IP address does not match record type {entry['type']}")
+    return normalize_record_name(domain), record_type, ip_address.compressed
+
 
+def bulk_update(client_id: str, entries: list) -> list[dict]:
+    """Validate and apply the entries of a bulk update request.
 
+    The records of every hosted zone are read in one pass and all changes of a
+    hosted zone are submitted in as few change batches as the Route 53 limits
+    allow. Entries for domains the client may not update are forbidden.
+
+    :type client_id: str
+    :param client_id:
+    :type entries: list
+    :param entries:
+    :return: result per entry in the order of the entries
+    """
+    results: list[dict] = []
+    updates: dict[str, dict[tuple[str, str], str]] = {}
+    keys: list[tuple[str, tuple[str, str]] | None] = []
+    for entry in entries:
+        result: dict = {
+            key: entry[key]
+            for key in ("domain", "ip", "type")
+            if isinstance(entry, dict) and key in entry
+        }
+        results.append(result)
+        keys.append(None)
+        try:
+            domain, record_type, ip = parse_bulk_entry(entry)
+            hosted_zone_id = resolve_hosted_zone(domain)
+        except (ValueError, HostedZoneNotFound) as exc:
+            result.update(status="invalid", error=str(exc))
+            continue
+        if not authorize(client_id, [domain]):
+            result.update(status="forbidden", error="Domain not allowed")
+            continue
+        zone_updates = updates.setdefault(hosted_zone_id, {})
+        if (domain, record_type) in zone_updates:
+            result.update(status="invalid", error="Duplicate entry")
+            continue
+        zone_updates[(domain, record_type)] = ip
+        result["type"] = record_type
+        keys[-1] = (hosted_zone_id, (domain, record_type))
+
+    def apply_zone_updates(
+        hosted_zone_id: str, zone_updates: dict[tuple[str, str], str]
+    ) -> dict[tuple[str, str], dict]:
+        try:
+            return apply_updates(hosted_zone_id, zone_updates)
+        except ClientError as exc:
+            logger.exception("Updating hosted zone %s failed", hosted_zone_id)
+            error = exc.response["Error"]["Code"]
+            return {key: {"status": "failed", "error": error} for key in zone_updates}
+
+    zone_results = map_hosted_zones(apply_zone_updates, updates) if updates else {}
+    for result, key in zip(results, keys, strict=True):
+        if key is not None:
+            hosted_zone_id, record_key = key
+            result.update(zone_results[hosted_zone_id][record_key])
+    return results
+
+
+def handle_bulk_update(event: dict) -> dict:
+    """Handle a bulk update request.
+
+    The request body is a JSON object with client_id, token and updates, a
+    list of objects with domain, ip and optionally type. The response lists
+    the result of every update, its status code is 207 if any update was
+    invalid or failed.
+
+    :type event: dict
+    :param event:
+    :return:
+    """
+    with metrics.phase("Parse"):
+        try:
+            client_id, token, entries = parse_bulk_request(event)
+        except (KeyError, TypeError):
+            logger.error("Missing request parameters")
+            return {
+                "statusCode": 400,
+                "body": json.dumps("Missing request parameters"),
+            }
+        except ValueError as exc:
+            logger.error("Invalid request body: %s", exc)
+            return {"statusCode": 400, "body": json.dumps("Invalid request body")}
+
+    try:
+        response = rate_limit_response(client_id)
+        if response is not None:
+            return response
+
+        if not authenticate(client_id, token):
+            logger.error("Invalid token")
+            return {"statusCode": 401, "body": json.dumps("Invalid token")}
+        results = bulk_update(client_id, entries)
+    except deadline.DeadlineExceeded as exc:
+        return deadline_exceeded_response(exc)
+    except ClientError as exc:
+        return client_error_response(exc)
+    except Exception:
+        logger.exception("Unexpected error")
+        return {"statusCode": 500, "body": json.dumps("Something went wrong")}
+    metrics.count("BulkUpdateEntries", len(results))
+    succeeded = all(result["status"] in ("updated", "unchanged") for result in results)
+    logger.info("Bulk update with %d entries was applied", len(results))
+    return {
+        "statusCode": 200 if succeeded else 207,
+        "headers": {"Content-Type": "application/json"},
+        "body": json.dumps({"results": results}),
+    }
+
+
+@metrics.instrumented
+@profiling.profiled
+@bounded_by_remaining_time
 def lambda_handler(event: dict, context: dict):
     """Lambda handler.
 
@@ -158,36 +1762,119 @@ def lambda_handler(event: dict, context: dict):
     :param context:
     :return:
     """
-    logger.info(f"ROUTE_53_HOSTED_ZONE_ID: {ROUTE_53_HOSTED_ZONE_ID}")
+    if is_bulk_request(event):
+        return handle_bulk_update(event)
+
     # Checking if all request parameters are present
-    query_parameters: dict = event["queryStringParameters"]
-    try:
-        client_id: str = query_parameters["client_id"]
-        domains: list[str] = query_parameters["domain"].split(",")
-        ip: str = query_parameters["ip"]
-        token: str = query_parameters["token"]
-    except KeyError:
-        logger.error("Missing query parameters")
-        return {"statusCode": 400, "body": json.dumps("Missing request parameters")}
-
-    # Check if token is valid
-    expected_token = get_secret(client_id)
-    if token != expected_token:
-        logger.error("Invalid token")
-        return {"statusCode": 401, "body": json.dumps("Invalid token")}
+    query_parameters: dict = event.get("queryStringParameters") or {}
+    change_id: str | None = query_parameters.get("change_id")
+    with metrics.phase("Parse"):
+        try:
+            client_id: str = query_parameters["client_id"]
+            if change_id is None:
+                domains: list[str] = query_parameters["domain"].split(",")
+                ip_addresses: dict[str, str] = parse_ip_addresses(
+                    query_parameters, event
+                )
+            token: str = query_parameters["token"]
+        except KeyError:
+            logger.error("Missing query parameters")
+            return {
+                "statusCode": 400,
+                "body": json.dumps("Missing request parameters"),
+            }
+        except ValueError as exc:
+            logger.error("Invalid IP address: %s", exc)
+            return {"statusCode": 400, "body": json.dumps("Invalid IP address")}
 
+    # The DNS records are read while the token is checked, so a cold request
+    # waits for the slower of both instead of their sum.
+    prefetch: RecordPrefetch | None = None
     try:
-        dns_records = get_dns_records(domains)
-        set_dns_records(dns_records, ip)
+        response = rate_limit_response(client_id)
+        if response is not None:
+            return response
+
+        if (
+            change_id is None
+            and PREFETCH_RECORDS
+            and not UPDATE_QUEUE_URL
+            and should_prefetch(client_id, token)
+        ):
+            prefetch = RecordPrefetch.start(domains, ip_addresses)
+
+        # Check if token is valid
+        if not authenticate(client_id, token):
+            logger.error("Invalid token")
+            return {"statusCode": 401, "body": json.dumps("Invalid token")}
+
+        if change_id is not None:
+            return {
+                "statusCode": 200,
+                "body": json.dumps(get_change_status(change_id)),
+            }
+
+        if not authorize(client_id, domains):
+            logger.error("Client %s may not update %s", client_id, domains)
+            return {"statusCode": 403, "body": json.dumps("Domain not allowed")}
+
+        if prefetch is not None:
+            hosted_zones = prefetch.hosted_zones
+            published = prefetch.published
+        else:
+            hosted_zones = group_domains_by_hosted_zone(domains)
+            published = is_published(hosted_zones, ip_addresses)
+        if published:
+            logger.info("DNS record is up to date")
+            return {
+                "statusCode": 200,
+                "body": json.dumps("DNS record was updated"),
+            }
+
+        if UPDATE_QUEUE_URL:
+            enqueue_update(hosted_zones, ip_addresses)
+            logger.info("DNS record update was queued")
+            return {
+                "statusCode": 202,
+                "body": json.dumps("DNS record update was queued"),
+            }
+
+        if prefetch is not None:
+            change_ids = prefetch.apply(ip_addresses)
+        else:
+            change_ids = update_hosted_zones(hosted_zones, ip_addresses)
+        if change_ids and query_parameters.get("mode", UPDATE_MODE) == "async":
+            logger.info("DNS record update was submitted: %s", change_ids)
+            return {
+                "statusCode": 202,
+                "body": json.dumps(
+                    {
+                        "message": "DNS record update was submitted",
+                        "change_ids": change_ids,
+                    }
+                ),
+            }
         logger.info("DNS record was updated")
         return {
             "statusCode": 200,
             "body": json.dumps("DNS record was updated"),
         }
+    except HostedZoneNotFound as exc:
+        logger.error("%s", exc)
+        return {"statusCode": 400, "body": json.dumps(str(exc))}
+    except deadline.DeadlineExceeded as exc:
+        return deadline_exceeded_response(exc)
     except ClientError as exc:
-        message = str(exc)
-        logger.exception(message)
-        return {"statusCode": 500, "body": json.dumps(message)}
+        if exc.response["Error"]["Code"] == "NoSuchChange":
+            logger.error("Unknown change %s", change_id)
+            return {"statusCode": 404, "body": json.dumps("Unknown change")}
+        return client_error_response(exc)
     except Exception:
         logger.exception("Unexpected error")
         return {"statusCode": 500, "body": json.dumps("Something went wrong")}
+    finally:
+        if prefetch is not None:
+            prefetch.discard()
+
+
+startup.initialize()
@@ -0,0 +1,324 @@
+"""Per-invocation metrics in CloudWatch Embedded Metric Format.
+
+Every invocation of a handler writes one JSON record to stdout. CloudWatch
+Logs extracts the metrics from it, while the record stays searchable with
+Logs Insights.
+
+See: https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html
+"""
+
+import copy
+import functools
+import json
+import os
+import sys
+from collections import Counter
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter, time
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
+
+METRICS_ENABLED: bool = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+METRICS_NAMESPACE: str = os.environ.get("METRICS_NAMESPACE", "SimpleDynamicDns")
+
+_current_invocation: ContextVar["InvocationMetrics | None"] = ContextVar(
+    "current_invocation", default=None
+)
+_cold_start: bool = True
+
+
+class InvocationMetrics:
+    """Phase durations, counters and properties of one invocation.
+
+    Instances are shared with the threads updating hosted zones concurrently,
+    so all updates are locked.
+    """
+
+    def __init__(self, handler: str, cold_start: bool):
+        """Initialize empty metrics.
+
+        :type handler: str
+        :param handler: name of the handler, used as dimension
+        :type cold_start: bool
+        :param cold_start: True for the first invocation of the execution environment
+        """
+        self.handler = handler
+        self.cold_start = cold_start
+        self.durations: dict[str, float] = {}
+        self.counters: Counter[str] = Counter()
+        self.values: dict[str, tuple[float, str]] = {}
+        self.properties: dict[str, Any] = {}
+        self._lock = Lock()
+
+    def add_duration(self, name: str, seconds: float) -> None:
+        """Add to the duration of a phase.
+
+        :type name: str
+        :param name:
+        :type seconds: float
+        :param seconds:
+        :return:
+        """
+        with self._lock:
+            self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def count(self, name: str, value: int = 1) -> None:
+        """Add to a counter.
+
+        :type name: str
+        :param name:
+        :type value: int
+        :param value:
+        :return:
+        """
+        with self._lock:
+            self.counters[name] += value
+
+    def set_value(self, name: str, value: float, unit: str) -> None:
+        """Set a metric which is measured rather than counted.
+
+        :type name: str
+        :param name:
+        :type value: float
+        :param value:
+        :type unit: str
+        :param unit: CloudWatch unit, e.g. "Kilobytes"
+        :return:
+        """
+        with self._lock:
+            self.values[name] = (value, unit)
+
+    def count_api_call(self, service: str, operation: str) -> None:
+        """Count an AWS API call in total and per operation.
+
+        :type service: str
+        :param service:
+        :type operation: str
+        :param operation:
+        :return:
+        """
+        key = f"{service}.{operation}"
+        with self._lock:
+            self.counters["ApiCalls"] += 1
+            api_calls = self.properties.setdefault("ApiCallsByOperation", {})
+            api_calls[key] = api_calls.get(key, 0) + 1
+
+    def set_property(self, name: str, value: Any) -> None:
+        """Set a property which is logged, but not extracted as metric.
+
+        :type name: str
+        :param name:
+        :param value:
+        :return:
+        """
+        with self._lock:
+            self.properties[name] = value
+
+    def to_emf(self, namespace: str, timestamp: float) -> dict:
+        """Build the Embedded Metric Format record.
+
+        :type namespace: str
+        :param namespace:
+        :type timestamp: float
+        :param timestamp: seconds since the epoch
+        :return:
+        """
+        with self._lock:
+            values: dict[str, float] = {
+                f"{name}Duration": round(seconds * 1000, 3)
+                for name, seconds in self.durations.items()
+            }
+            units = dict.fromkeys(values, "Milliseconds")
+            for name, value in self.counters.items():
+                values[name] = value
+                units[name] = "Count"
+            for name, (value, unit) in self.values.items():
+                values[name] = value
+                units[name] = unit
+            values["ColdStart"] = int(self.cold_start)
+            units["ColdStart"] = "Count"
+            properties = copy.deepcopy(self.properties)
+
+        return {
+            "_aws": {
+                "Timestamp": int(timestamp * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": namespace,
+                        "Dimensions": [["Handler"]],
+                        "Metrics": [
+                            {"Name": name, "Unit": unit} for name, unit in units.items()
+                        ],
+                    }
+                ],
+            },
+            "Handler": self.handler,
+            **properties,
+            **values,
+        }
+
+
+def current() -> InvocationMetrics | None:
+    """Return the metrics of the running invocation.
+
+    :return:
+    """
+    return _current_invocation.get()
+
+
+def mark_cold_start() -> None:
+    """Report the next invocation as cold start, e.g. after a snapshot restore.
+
+    :return:
+    """
+    global _cold_start
+    _cold_start = True
+
+
+def emit(record: dict) -> None:
+    """Write a record to stdout, where CloudWatch Logs picks it up.
+
+    :type record: dict
+    :param record:
+    :return:
+    """
+    sys.stdout.write(json.dumps(record, default=str) + "\n")
+    sys.stdout.flush()
+
+
+@contextmanager
+def invocation(handler: str, context: Any = None) -> Iterator[InvocationMetrics]:
+    """Collect the metrics of an invocation and emit them at its end.
+
+    :type handler: str
+    :param handler:
+    :param context: Lambda context
+    :return:
+    """
+    global _cold_start
+    invocation_metrics = InvocationMetrics(handler, cold_start=_cold_start)
+    _cold_start = False
+    request_id = getattr(context, "aws_request_id", None)
+    if request_id is not None:
+        invocation_metrics.set_property("RequestId", request_id)
+    token = _current_invocation.set(invocation_metrics)
+    started = perf_counter()
+    try:
+        yield invocation_metrics
+    finally:
+        invocation_metrics.add_duration("Invocation", perf_counter() - started)
+        _current_invocation.reset(token)
+        if METRICS_ENABLED:
+            emit(invocation_metrics.to_emf(METRICS_NAMESPACE, time()))
+
+
+def instrumented(handler: Callable[[dict, Any], dict]) -> Callable[[dict, Any], dict]:
+    """Decorate a Lambda handler to emit its metrics.
+
+    The status code of the response is logged as property.
+
+    :type handler: Callable[[dict, Any], dict]
+    :param handler:
+    :return:
+    """
+
+    @functools.wraps(handler)
+    def wrapper(event: dict, context: Any) -> dict:
+        with invocation(handler.__name__, context) as invocation_metrics:
+            response = handler(event, context)
+            if isinstance(response, dict) and "statusCode" in response:
+                invocation_metrics.set_property("StatusCode", response["statusCode"])
+            return response
+
+    return wrapper
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Time a phase of the running invocation.
+
+    :type name: str
+    :param name:
+    :return:
+    """
+    invocation_metrics = _current_invocation.get()
+    if invocation_metrics is None:
+        yield
+        return
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        invocation_metrics.add_duration(name, perf_counter() - started)
+
+
+def count(name: str, value: int = 1) -> None:
+    """Add to a counter of the running invocation.
+
+    :type name: str
+    :param name:
+    :type value: int
+    :param value:
+    :return:
+    """
+    invocation_metrics = _current_invocation.get()
+    if invocation_metrics is not None:
+        invocation_metrics.count(name, value)
+
+
+def add_duration(name: str, seconds: float) -> None:
+    """Add to the duration of a phase of the running invocation.
+
+    :type name: str
+    :param name:
+    :type seconds: float
+    :param seconds:
+    :return:
+    """
+    invocation_metrics = _current_invocation.get()
+    if invocation_metrics is not None:
+        invocation_metrics.add_duration(name, seconds)
+
+
+def set_value(name: str, value: float, unit: str) -> None:
+    """Set a measured metric of the running invocation.
+
+    :type name: str
+    :param name:
+    :type value: float
+    :param value:
+    :type unit: str
+    :param unit: CloudWatch unit
+    :return:
+    """
+    invocation_metrics = _current_invocation.get()
+    if invocation_metrics is not None:
+        invocation_metrics.set_value(name, value, unit)
+
+
+def count_api_call(model: Any, **kwargs: Any) -> None:
+    """Count an AWS API call, botocore calls it before every attempt.
+
+    :param model: botocore operation model
+    :param kwargs:
+    :return:
+    """
+    invocation_metrics = _current_invocation.get()
+    if invocation_metrics is not None:
+        invocation_metrics.count_api_call(model.service_model.service_name, model.name)
+
+
+def instrument_client(client: "BaseClient") -> "BaseClient":
+    """Count the API calls of a boto3 client, including retried attempts.
+
+    :type client: BaseClient
+    :param client:
+    :return:
+    """
+    client.meta.events.register_first("before-call.*.*", count_api_call)
+    return client
@@ -0,0 +1,155 @@
+"""Opt-in memory profiling of invocations.
+
+On Lambda the memory size also decides the CPU share and the price of an
+invocation. With PROFILING_ENABLED every invocation adds its memory usage to
+the metrics record it emits:
+
+* AllocatedPeak, the peak of memory allocated by Python during the invocation
+* AllocatedRetained, memory allocated during the invocation and still in use
+  at its end, e.g. by caches
+* MaxRss, the peak resident set size of the execution environment, which
+  Lambda reports as "Max Memory Used"
+* ColdStartRss, the resident set size at the start of the first invocation
+* AllocationHotSpots, the source lines which allocated most of the retained
+  memory
+
+Allocations are traced with tracemalloc, which slows down invocations
+considerably, so profiling is meant for short measurements only. Concurrent
+requests of the self-hosted server are attributed to each other.
+
+See: https://docs.python.org/3/library/tracemalloc.html
+"""
+
+import os
+import tracemalloc
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any
+
+from aws import metrics
+
+PROFILING_ENABLED: bool = os.environ.get("PROFILING_ENABLED", "false").lower() == "true"
+PROFILING_TOP_ALLOCATIONS: int = int(os.environ.get("PROFILING_TOP_ALLOCATIONS", "10"))
+
+TRACE_FILTERS: tuple[tracemalloc.Filter, ...] = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def memory_usage() -> dict[str, int]:
+    """Return the current and the peak resident set size of the process.
+
+    :return: KiB by "VmRSS" and "VmHWM", empty where /proc is not available
+    """
+    usage = {}
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                name, _, value = line.partition(":")
+                if name in ("VmRSS", "VmHWM"):
+                    usage[name] = int(value.split()[0])
+    except OSError:
+        pass
+    return usage
+
+
+def hot_spots(
+    snapshot: tracemalloc.Snapshot, before: tracemalloc.Snapshot, top: int
+) -> list[dict]:
+    """Return the source lines whose allocations grew most between snapshots.
+
+    :type snapshot: tracemalloc.Snapshot
+    :param snapshot:
+    :type before: tracemalloc.Snapshot
+    :param before:
+    :type top: int
+    :param top: number of lines
+    :return:
+    """
+    statistics = snapshot.filter_traces(TRACE_FILTERS).compare_to(
+        before.filter_traces(TRACE_FILTERS), "lineno"
+    )
+    growing = sorted(
+        (statistic for statistic in statistics if statistic.size_diff > 0),
+        key=lambda statistic: statistic.size_diff,
+        reverse=True,
+    )
+    return [
+        {
+            "Location": f"{statistic.traceback[0].filename}:"
+            f"{statistic.traceback[0].lineno}",
+            "SizeKiB": round(statistic.size_diff / 1024, 1),
+            "Count": statistic.count_diff,
+        }
+        for statistic in growing[:top]
+    ]
+
+
+@contextmanager
+def profile(top: int | None = None) -> Iterator[None]:
+    """Add the memory usage of the block to the running invocation's metrics.
+
+    Tracing starts with the first profiled invocation and continues, so later
+    invocations do not pay for starting it.
+
+    :type top: int | None
+    :param top: number of hot spots, defaults to PROFILING_TOP_ALLOCATIONS
+    :return:
+    """
+    invocation_metrics = metrics.current()
+    if invocation_metrics is not None and invocation_metrics.cold_start:
+        rss = memory_usage().get("VmRSS")
+        if rss is not None:
+            metrics.set_value("ColdStartRss", rss, "Kilobytes")
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    allocated_before, _ = tracemalloc.get_traced_memory()
+    try:
+        yield
+    finally:
+        allocated, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        metrics.set_value(
+            "AllocatedPeak", round((peak - allocated_before) / 1024, 1), "Kilobytes"
+        )
+        metrics.set_value(
+            "AllocatedRetained",
+            round((allocated - allocated_before) / 1024, 1),
+            "Kilobytes",
+        )
+        max_rss = memory_usage().get("VmHWM")
+        if max_rss is not None:
+            metrics.set_value("MaxRss", max_rss, "Kilobytes")
+        if invocation_metrics is not None:
+            invocation_metrics.set_property(
+                "AllocationHotSpots",
+                hot_spots(
+                    snapshot,
+                    before,
+                    PROFILING_TOP_ALLOCATIONS if top is None else top,
+                ),
+            )
+
+
+def profiled(handler: Callable[[dict, Any], dict]) -> Callable[[dict, Any], dict]:
+    """Decorate a Lambda handler to profile its invocations if enabled.
+
+    :type handler: Callable[[dict, Any], dict]
+    :param handler:
+    :return:
+    """
+
+    @wraps(handler)
+    def wrapper(event: dict, context: Any) -> dict:
+        if not PROFILING_ENABLED:
+            return handler(event, context)
+        with profile():
+            return handler(event, context)
+
+    return wrapper
@@ -0,0 +1,367 @@
+"""Rate limiting of outbound AWS API calls and inbound client requests."""
+
+import logging
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Callable
+from threading import Lock
+from time import monotonic, sleep, time
+from typing import TYPE_CHECKING
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from aws.deadline import DeadlineExceeded
+
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
+
+logger = logging.getLogger()
+
+
+class TokenBucket:
+    """Token bucket which refills with a fixed rate up to its capacity."""
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: float,
+        clock: Callable[[], float] = monotonic,
+    ):
+        """Initialize a full bucket.
+
+        :type rate: float
+        :param rate: tokens per second
+        :type capacity: float
+        :param capacity: maximum number of tokens
+        :type clock: Callable[[], float]
+        :param clock:
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated_at = clock()
+        self._lock = Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = max(now - self._updated_at, 0.0)
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated_at = now
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        """Take tokens and return the seconds to wait until they are available.
+
+        The tokens are taken right away, so concurrent callers queue up
+        behind each other.
+
+        :type tokens: float
+        :param tokens:
+        :return:
+        """
+        with self._lock:
+            self._refill(self._clock())
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def release(self, tokens: float = 1.0) -> None:
+        """Give back reserved tokens which were not used.
+
+        :type tokens: float
+        :param tokens:
+        :return:
+        """
+        with self._lock:
+            self._refill(self._clock())
+            self._tokens = min(self.capacity, self._tokens + tokens)
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        """Take tokens if they are available.
+
+        :type tokens: float
+        :param tokens:
+        :return: 0 if the tokens were taken, otherwise the seconds until they
+            are available
+        """
+        with self._lock:
+            self._refill(self._clock())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def set_rate(self, rate: float) -> None:
+        """Change the refill rate.
+
+        :type rate: float
+        :param rate:
+        :return:
+        """
+        with self._lock:
+            self._refill(self._clock())
+            self.rate = rate
+
+
+class AdaptiveRateLimiter:
+    """Token bucket whose rate adapts to throttling of the API.
+
+    The rate is halved whenever the API throttles a request and recovers
+    additively with every successful request, like TCP congestion control.
+    """
+
+    def __init__(
+        self,
+        max_rate: float,
+        min_rate: float = 0.5,
+        recovery: float = 0.1,
+        clock: Callable[[], float] = monotonic,
+        sleep: Callable[[float], None] = sleep,
+    ):
+        """Initialize the rate limiter with its maximum rate.
+
+        :type max_rate: float
+        :param max_rate: requests per second
+        :type min_rate: float
+        :param min_rate: requests per second the rate never drops below
+        :type recovery: float
+        :param recovery: requests per second added after each success
+        :type clock: Callable[[], float]
+        :param clock:
+        :type sleep: Callable[[float], None]
+        :param sleep:
+        """
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.recovery = recovery
+        self._bucket = TokenBucket(rate=max_rate, capacity=max_rate, clock=clock)
+        self._sleep = sleep
+
+    @property
+    def rate(self) -> float:
+        """Return the current rate.
+
+        :return:
+        """
+        return self._bucket.rate
+
+    def reserve(self) -> float:
+        """Reserve the next request without waiting for it.
+
+        Wait the returned time before sending the request, or cancel the
+        reservation if it is not sent.
+
+        :return: seconds to wait
+        """
+        return self._bucket.reserve()
+
+    def cancel(self) -> None:
+        """Cancel a reservation whose request is not sent.
+
+        :return:
+        """
+        self._bucket.release()
+
+    def wait(self, wait_time: float) -> None:
+        """Wait the time of a reservation.
+
+        :type wait_time: float
+        :param wait_time:
+        :return:
+        """
+        if wait_time > 0:
+            self._sleep(wait_time)
+
+    def acquire(self) -> float:
+        """Wait until the next request may be sent.
+
+        :return: seconds waited
+        """
+        wait_time = self.reserve()
+        self.wait(wait_time)
+        return wait_time
+
+    def on_success(self) -> None:
+        """Increase the rate after a successful request.
+
+        :return:
+        """
+        if self.rate < self.max_rate:
+            self._bucket.set_rate(min(self.max_rate, self.rate + self.recovery))
+
+    def on_throttle(self) -> None:
+        """Decrease the rate after a throttled request.
+
+        :return:
+        """
+        self._bucket.set_rate(max(self.min_rate, self.rate / 2))
+
+
+class ClientRateLimiter(ABC):
+    """Interface of the rate limiters for requests per client id."""
+
+    def __init__(self, rate: float, burst: float):
+        """Initialize the rate limiter.
+
+        :type rate: float
+        :param rate: requests per second and client
+        :type burst: float
+        :param burst: requests a client may send at once
+        """
+        self.rate = rate
+        self.burst = burst
+
+    @abstractmethod
+    def acquire(self, client_id: str) -> float:
+        """Take a token from the bucket of the client if one is available.
+
+        :type client_id: str
+        :param client_id:
+        :return: 0 if the request is allowed, otherwise the seconds until it is
+        """
+
+
+class MemoryClientRateLimiter(ClientRateLimiter):
+    """Token bucket per client id in memory of the execution environment.
+
+    The least recently used buckets are dropped beyond max_clients. A dropped
+    bucket is full again when it is recreated.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        max_clients: int = 10000,
+        clock: Callable[[], float] = monotonic,
+    ):
+        """Initialize the rate limiter without buckets.
+
+        :type rate: float
+        :param rate: requests per second and client
+        :type burst: float
+        :param burst: requests a client may send at once
+        :type max_clients: int
+        :param max_clients:
+        :type clock: Callable[[], float]
+        :param clock:
+        """
+        super().__init__(rate, burst)
+        self.max_clients = max_clients
+        self._clock = clock
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+        self._lock = Lock()
+
+    def acquire(self, client_id: str) -> float:
+        """Take a token from the bucket of the client if one is available.
+
+        :type client_id: str
+        :param client_id:
+        :return: 0 if the request is allowed, otherwise the seconds until it is
+        """
+        with self._lock:
+            bucket = self._buckets.get(client_id)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.burst, clock=self._clock)
+                self._buckets[client_id] = bucket
+                while len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            self._buckets.move_to_end(client_id)
+        return bucket.try_acquire()
+
+
+class DynamoDbClientRateLimiter(ClientRateLimiter):
+    """Token bucket per client id in a DynamoDB table.
+
+    All execution environments share the buckets, so the limit holds for the
+    whole function. Buckets are updated with conditional writes on the time of
+    the last update. If DynamoDB fails, requests are allowed.
+
+    The table needs a string partition key "pk". Enable TTL on "expires_at" to
+    remove buckets of inactive clients.
+    """
+
+    max_attempts: int = 3
+
+    def __init__(
+        self,
+        client: "BaseClient",
+        table_name: str,
+        rate: float,
+        burst: float,
+        clock: Callable[[], float] = time,
+    ):
+        """Initialize the rate limiter.
+
+        :type client: BaseClient
+        :param client:
+        :type table_name: str
+        :param table_name:
+        :type rate: float
+        :param rate: requests per second and client
+        :type burst: float
+        :param burst: requests a client may send at once
+        :type clock: Callable[[], float]
+        :param clock: wall clock shared by all execution environments
+        """
+        super().__init__(rate, burst)
+        self.client = client
+        self.table_name = table_name
+        self._clock = clock
+
+    def acquire(self, client_id: str) -> float:
+        """Take a token from the bucket of the client if one is available.
+
+        :type client_id: str
+        :param client_id:
+        :return: 0 if the request is allowed, otherwise the seconds until it is
+        """
+        key = {"pk": {"S": f"rate#{client_id}"}}
+        try:
+            for _ in range(self.max_attempts):
+                response = self.client.get_item(
+                    TableName=self.table_name, Key=key, ConsistentRead=True
+                )
+                item = response.get("Item")
+                now = self._clock()
+                if item is None:
+                    tokens = self.burst
+                else:
+                    elapsed = max(now - float(item["updated_at"]["N"]), 0.0)
+                    tokens = min(
+                        self.burst, float(item["tokens"]["N"]) + elapsed * self.rate
+                    )
+                if tokens < 1:
+                    return (1 - tokens) / self.rate
+
+                kwargs: dict = {
+                    "TableName": self.table_name,
+                    "Item": {
+                        **key,
+                        "tokens": {"N": repr(tokens - 1)},
+                        "updated_at": {"N": repr(now)},
+                        "expires_at": {"N": str(int(now + self.burst / self.rate) + 1)},
+                    },
+                }
+                if item is None:
+                    kwargs["ConditionExpression"] = "attribute_not_exists(pk)"
+                else:
+                    kwargs["ConditionExpression"] = "updated_at = :updated_at"
+                    kwargs["ExpressionAttributeValues"] = {
+                        ":updated_at": item["updated_at"]
+                    }
+                try:
+                    self.client.put_item(**kwargs)
+                except ClientError as exc:
+                    if (
+                        exc.response["Error"]["Code"]
+                        != "ConditionalCheckFailedException"
+                    ):
+                        raise
+                    continue
+                return 0.0
+        except (BotoCoreError, ClientError, DeadlineExceeded):
+            logger.warning("Rate limiting client %s failed", client_id, exc_info=True)
+            return 0.0
+        # Other requests of the client took the tokens in the meantime.
+        return 1 / self.rate
@@ -0,0 +1,451 @@
+"""Reconcile a hosted zone with a desired state file.
+
+The desired state lists resource record sets, one JSON object per line
+(JSONL) or as YAML list:
+
+    {"name": "a.example.com", "type": "A", "ttl": 300, "values": ["192.0.2.1"]}
+
+The file is indexed by record name and type while it is read. The hosted zone
+is then paged through once and compared against the index, so only record
+sets which differ are changed. Re-applying an unchanged file costs the read
+pass only:
+
+    python -m aws.reconcile desired.jsonl --hosted-zone-id Z123 --dry-run
+
+Live record sets missing in the file are kept, unless --prune is given.
+Alias records, record sets with a routing policy and the SOA record are
+never changed. Entries of the file with the name and type of an alias record
+or of record sets with a routing policy are reported as conflicts and skipped.
+"""
+
+import argparse
+import ipaddress
+import json
+import logging
+import os
+import sys
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass, field
+from typing import IO, TYPE_CHECKING
+
+from botocore.exceptions import ClientError
+
+from aws import lambda_function
+from aws.changes import chunk_changes
+from aws.zone import RecordKey, iter_record_sets, normalize_record_name
+
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
+
+logger = logging.getLogger()
+
+RECORD_TYPES: frozenset[str] = frozenset(
+    {"A", "AAAA", "CAA", "CNAME", "DS", "MX", "NAPTR", "NS", "PTR", "SPF", "SRV", "TXT"}
+)
+IP_VERSIONS: dict[str, int] = {"A": 4, "AAAA": 6}
+MAX_TTL: int = 2147483647
+
+
+@dataclass(frozen=True)
+class DesiredRecordSet:
+    """Resource record set of the desired state."""
+
+    name: str
+    type: str
+    ttl: int
+    values: tuple[str, ...]
+
+    @property
+    def key(self) -> RecordKey:
+        """Return the key to look up the record set in the hosted zone.
+
+        :return:
+        """
+        return normalize_record_name(self.name), self.type
+
+    @classmethod
+    def from_dict(cls, entry: dict, default_ttl: int) -> "DesiredRecordSet":
+        """Validate an entry of the desired state file.
+
+        :type entry: dict
+        :param entry:
+        :type default_ttl: int
+        :param default_ttl: used if the entry has no ttl
+        :return:
+        """
+        if not isinstance(entry, dict):
+            raise ValueError("Entry is not an object")
+        name = entry.get("name")
+        if not isinstance(name, str) or not name.strip("."):
+            raise ValueError("Missing record name")
+        record_type = entry.get("type")
+        if record_type not in RECORD_TYPES:
+            raise ValueError(f"Unsupported record type {record_type!r}")
+        ttl = entry.get("ttl", default_ttl)
+        if not isinstance(ttl, int) or isinstance(ttl, bool) or not 0 <= ttl <= MAX_TTL:
+            raise ValueError(f"Invalid TTL {ttl!r}")
+        values = entry["values"] if "values" in entry else [entry.get("value")]
+        if (
+            not isinstance(values, list)
+            or not values
+            or not all(isinstance(value, str) and value for value in values)
+        ):
+            raise ValueError("Missing record values")
+        return cls(
+            name=normalize_record_name(name),
+            type=record_type,
+            ttl=ttl,
+            values=normalize_values(record_type, values),
+        )
+
+    def to_record_set(self) -> dict:
+        """Build the Route 53 resource record set.
+
+        :return:
+        """
+        return {
+            "Name": self.name,
+            "Type": self.type,
+            "TTL": self.ttl,
+            "ResourceRecords": [{"Value": value} for value in self.values],
+        }
+
+
+@dataclass
+class Plan:
+    """Changes which reconcile the hosted zone with the desired state."""
+
+    changes: list[dict] = field(default_factory=list)
+    desired: int = 0
+    live: int = 0
+    created: int = 0
+    updated: int = 0
+    deleted: int = 0
+    unchanged: int = 0
+    conflicts: list[RecordKey] = field(default_factory=list)
+
+    def summary(self) -> dict[str, int]:
+        """Return the counts of the plan.
+
+        :return:
+        """
+        return {
+            "desired": self.desired,
+            "live": self.live,
+            "created": self.created,
+            "updated": self.updated,
+            "deleted": self.deleted,
+            "unchanged": self.unchanged,
+            "conflicting": len(self.conflicts),
+        }
+
+
+def normalize_values(record_type: str, values: Iterable[str]) -> tuple[str, ...]:
+    """Normalize record values, so equal values compare equal.
+
+    :type record_type: str
+    :param record_type:
+    :type values: Iterable[str]
+    :param values:
+    :return: sorted, unique values
+    """
+    version = IP_VERSIONS.get(record_type)
+    if version is None:
+        return tuple(sorted(set(values)))
+    normalized = set()
+    for value in values:
+        ip_address = ipaddress.ip_address(value)
+        if ip_address.version != version:
+            raise ValueError(f"IP address {value} does not match record type")
+        normalized.add(ip_address.compressed)
+    return tuple(sorted(normalized))
+
+
+def read_jsonl(stream: IO[str]) -> Iterator[tuple[int, dict]]:
+    """Read a JSONL file line by line.
+
+    :type stream: IO[str]
+    :param stream:
+    :return: line number and entry
+    """
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except json.JSONDecodeError as exc:
+            raise ValueError(f"Line {line_number}: {exc.msg}") from None
+
+
+def read_yaml(stream: IO[str]) -> Iterator[tuple[int, dict]]:
+    """Read a YAML file with a list of record sets or a records key.
+
+    PyYAML is an optional dependency, install it to read YAML files.
+
+    :type stream: IO[str]
+    :param stream:
+    :return: position in the list and entry
+    """
+    try:
+        import yaml
+    except ImportError:
+        raise ValueError("Reading YAML files requires PyYAML") from None
+    try:
+        document = yaml.safe_load(stream)
+    except yaml.YAMLError as exc:
+        raise ValueError(f"Invalid YAML: {exc}") from None
+    if isinstance(document, dict):
+        document = document.get("records")
+    if not isinstance(document, list):
+        raise ValueError("YAML file must contain a list of record sets")
+    yield from enumerate(document, start=1)
+
+
+def index_desired_state(
+    entries: Iterable[tuple[int, dict]], default_ttl: int
+) -> dict[RecordKey, DesiredRecordSet]:
+    """Validate the entries and index them by record name and type.
+
+    :type entries: Iterable[tuple[int, dict]]
+    :param entries: position and entry
+    :type default_ttl: int
+    :param default_ttl:
+    :return:
+    """
+    desired: dict[RecordKey, DesiredRecordSet] = {}
+    for position, entry in entries:
+        try:
+            record_set = DesiredRecordSet.from_dict(entry, default_ttl)
+        except ValueError as exc:
+            raise ValueError(f"Entry {position}: {exc}") from None
+        if record_set.key in desired:
+            raise ValueError(
+                f"Entry {position}: Duplicate {record_set.type} record set for "
+                f"{record_set.name}"
+            )
+        desired[record_set.key] = record_set
+    return desired
+
+
+def plan_changes(
+    desired: dict[RecordKey, DesiredRecordSet],
+    live_record_sets: Iterable[dict],
+    prune_types: frozenset[str] = frozenset(),
+    skipped: set[RecordKey] | None = None,
+) -> Plan:
+    """Compute the minimal changes from the live record sets to the desired state.
+
+    :type desired: dict[RecordKey, DesiredRecordSet]
+    :param desired: desired record sets by record name and type
+    :type live_record_sets: Iterable[dict]
+    :param live_record_sets: simple resource record sets of the hosted zone
+    :type prune_types: frozenset[str]
+    :param prune_types: delete live record sets of these types which are not
+        desired
+    :type skipped: set[RecordKey] | None
+    :param skipped: keys of the alias records and record sets with a routing
+        policy, complete once live_record_sets is exhausted
+    :return:
+    """
+    plan = Plan(desired=len(desired))
+    seen: set[RecordKey] = set()
+    for live in live_record_sets:
+        plan.live += 1
+        key = (normalize_record_name(live["Name"]), live["Type"])
+        record_set = desired.get(key)
+        if record_set is None:
+            if live["Type"] in prune_types:
+                plan.changes.append({"Action": "DELETE", "ResourceRecordSet": live})
+                plan.deleted += 1
+            continue
+        seen.add(key)
+        values = [record["Value"] for record in live["ResourceRecords"]]
+        try:
+            live_values = normalize_values(live["Type"], values)
+        except ValueError:
+            live_values = ()
+        if live.get("TTL") == record_set.ttl and live_values == record_set.values:
+            plan.unchanged += 1
+            continue
+        plan.changes.append(
+            {"Action": "UPSERT", "ResourceRecordSet": record_set.to_record_set()}
+        )
+        plan.updated += 1
+
+    for key, record_set in desired.items():
+        if skipped is not None and key in skipped:
+            plan.conflicts.append(key)
+            continue
+        if key not in seen:
+            plan.changes.append(
+                {"Action": "UPSERT", "ResourceRecordSet": record_set.to_record_set()}
+            )
+            plan.created += 1
+    return plan
+
+
+def apply_changes(
+    client: "BaseClient",
+    hosted_zone_id: str,
+    changes: list[dict],
+    progress: Callable[[str], None] = logger.info,
+) -> list[str]:
+    """Submit the changes in as few change batches as the limits allow.
+
+    Batches are submitted one after the other. If a batch fails, the earlier
+    batches stay applied and running the reconciliation again continues.
+
+    :type client: BaseClient
+    :param client:
+    :type hosted_zone_id: str
+    :param hosted_zone_id:
+    :type changes: list[dict]
+    :param changes:
+    :type progress: Callable[[str], None]
+    :param progress: reports every submitted batch
+    :return: ids of the submitted changes
+    """
+    batches = list(chunk_changes(changes))
+    change_ids = []
+    applied = 0
+    for number, batch in enumerate(batches, start=1):
+        response = client.change_resource_record_sets(
+            HostedZoneId=hosted_zone_id, ChangeBatch={"Changes": batch}
+        )
+        change_ids.append(response["ChangeInfo"]["Id"].rsplit("/", 1)[-1])
+        applied += len(batch)
+        progress(
+            f"Submitted batch {number}/{len(batches)}, {applied}/{len(changes)} changes"
+        )
+    return change_ids
+
+
+def reconcile(
+    client: "BaseClient",
+    hosted_zone_id: str,
+    desired: dict[RecordKey, DesiredRecordSet],
+    prune_types: frozenset[str] = frozenset(),
+    dry_run: bool = False,
+    progress: Callable[[str], None] = logger.info,
+) -> dict:
+    """Reconcile the hosted zone with the desired state.
+
+    :type client: BaseClient
+    :param client:
+    :type hosted_zone_id: str
+    :param hosted_zone_id:
+    :type desired: dict[RecordKey, DesiredRecordSet]
+    :param desired:
+    :type prune_types: frozenset[str]
+    :param prune_types:
+    :type dry_run: bool
+    :param dry_run: compute the changes without submitting them
+    :type progress: Callable[[str], None]
+    :param progress:
+    :return: report with the summary, the conflicts, the changes for a dry run
+        or the change ids
+    """
+    skipped: set[RecordKey] = set()
+    plan = plan_changes(
+        desired,
+        iter_record_sets(client, hosted_zone_id, skipped),
+        prune_types=prune_types,
+        skipped=skipped,
+    )
+    progress(
+        f"Read {plan.live} record sets: {plan.created} to create, "
+        f"{plan.updated} to update, {plan.deleted} to delete, "
+        f"{plan.unchanged} unchanged"
+    )
+    for name, record_type in plan.conflicts:
+        progress(
+            f"Skipped {record_type} record set for {name}, an alias record or "
+            "record sets with a routing policy exist"
+        )
+    report: dict = {"summary": plan.summary()}
+    if plan.conflicts:
+        report["conflicts"] = [
+            {"name": name, "type": record_type} for name, record_type in plan.conflicts
+        ]
+    if dry_run:
+        report["changes"] = plan.changes
+    elif plan.changes:
+        report["change_ids"] = apply_changes(
+            client, hosted_zone_id, plan.changes, progress
+        )
+    return report
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Reconcile a hosted zone with a desired state file and print a report.
+
+    :type argv: list[str] | None
+    :param argv:
+    :return: exit code
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("file", help="desired state file, - reads JSONL from stdin")
+    parser.add_argument(
+        "--hosted-zone-id", default=os.environ.get("ROUTE_53_HOSTED_ZONE_ID")
+    )
+    parser.add_argument(
+        "--format",
+        choices=["jsonl", "yaml"],
+        help="format of the file, detected from the extension by default",
+    )
+    parser.add_argument(
+        "--default-ttl", type=int, default=lambda_function.ROUTE_53_RECORD_TTL
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="delete record sets of the prune types which are not in the file",
+    )
+    parser.add_argument("--prune-types", default="A,AAAA")
+    parser.add_argument("--dry-run", action="store_true")
+    arguments = parser.parse_args(argv)
+    if not arguments.hosted_zone_id:
+        parser.error("--hosted-zone-id or ROUTE_53_HOSTED_ZONE_ID is required")
+
+    prune_types: frozenset[str] = frozenset()
+    if arguments.prune:
+        prune_types = frozenset(arguments.prune_types.upper().split(","))
+        if not prune_types <= RECORD_TYPES - {"NS"}:
+            parser.error(f"Cannot prune record types {arguments.prune_types}")
+
+    file_format = arguments.format or (
+        "yaml" if arguments.file.endswith((".yaml", ".yml")) else "jsonl"
+    )
+    read = read_yaml if file_format == "yaml" else read_jsonl
+
+    def progress(message: str) -> None:
+        print(message, file=sys.stderr, flush=True)
+
+    try:
+        if arguments.file == "-":
+            desired = index_desired_state(read(sys.stdin), arguments.default_ttl)
+        else:
+            with open(arguments.file, encoding="utf-8") as stream:
+                desired = index_desired_state(read(stream), arguments.default_ttl)
+    except (OSError, ValueError) as exc:
+        progress(f"Invalid desired state: {exc}")
+        return 2
+
+    try:
+        report = reconcile(
+            lambda_function.route_53_client(),
+            arguments.hosted_zone_id,
+            desired,
+            prune_types=prune_types,
+            dry_run=arguments.dry_run,
+            progress=progress,
+        )
+    except ClientError as exc:
+        progress(f"Reconciliation failed: {exc}")
+        return 1
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
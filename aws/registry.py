@@ -0,0 +1,116 @@
+"""Process-wide registry for AWS clients and caches.
+
+AWS Lambda keeps the Python process alive between invocations of the same
+execution environment. Everything that is expensive to create (boto3 clients,
+the Secrets Manager cache, ...) is therefore created once through this registry
+and reused by all following invocations.
+"""
+
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import RLock
+from typing import Any
+
+_factories: dict[str, Callable[[], Any]] = {}
+
+
+def register(name: str, factory: Callable[[], Any]) -> None:
+    """Register a factory for a named instance.
+
+    :type name: str
+    :param name:
+    :type factory: Callable[[], Any]
+    :param factory:
+    :return:
+    """
+    _factories[name] = factory
+
+
+class Registry:
+    """Lazily created, named instances which live as long as the registry."""
+
+    def __init__(self):
+        """Initialize an empty registry."""
+        self._instances: dict[str, Any] = {}
+        self._lock = RLock()
+
+    def get(self, name: str) -> Any:
+        """Return the instance for name, create it on first use.
+
+        :type name: str
+        :param name:
+        :return:
+        """
+        try:
+            return self._instances[name]
+        except KeyError:
+            pass
+        with self._lock:
+            if name not in self._instances:
+                self._instances[name] = _factories[name]()
+            return self._instances[name]
+
+    def set(self, name: str, instance: Any) -> None:
+        """Override the instance for name.
+
+        :type name: str
+        :param name:
+        :param instance:
+        :return:
+        """
+        with self._lock:
+            self._instances[name] = instance
+
+    def reset(self, *names: str) -> None:
+        """Drop the given instances or all instances if no name is given.
+
+        :type names: str
+        :param names:
+        :return:
+        """
+        with self._lock:
+            if names:
+                for name in names:
+                    self._instances.pop(name, None)
+            else:
+                self._instances.clear()
+
+
+_default_registry = Registry()
+_current_registry: ContextVar[Registry] = ContextVar(
+    "current_registry", default=_default_registry
+)
+
+
+def get_registry() -> Registry:
+    """Return the registry of the current context.
+
+    :return:
+    """
+    return _current_registry.get()
+
+
+@contextmanager
+def use_registry(registry: Registry) -> Iterator[Registry]:
+    """Use another registry within the context, e.g. for tests or simulations.
+
+    :type registry: Registry
+    :param registry:
+    :return:
+    """
+    token = _current_registry.set(registry)
+    try:
+        yield registry
+    finally:
+        _current_registry.reset(token)
+
+
+def get(name: str) -> Any:
+    """Return the named instance from the current registry.
+
+    :type name: str
+    :param name:
+    :return:
+    """
+    return get_registry().get(name)
@@ -0,0 +1,290 @@
+"""Retries for AWS API calls.
+
+Retriable errors are retried with jittered exponential backoff, throttling
+errors additionally slow down the adaptive rate limiter of the service which
+is shared by all calls of the execution environment. Within the deadline of an
+invocation an attempt is only started while time remains. Retries, throttles,
+failures and the time waited are also added to the metrics of the running
+invocation.
+"""
+
+import logging
+import random
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import TYPE_CHECKING, Any
+
+from botocore.exceptions import ClientError, HTTPClientError
+from botocore.exceptions import ConnectionError as BotocoreConnectionError
+
+from aws import deadline, metrics
+from aws.ratelimit import AdaptiveRateLimiter
+
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
+
+logger = logging.getLogger()
+
+THROTTLING_ERROR_CODES: frozenset[str] = frozenset(
+    {
+        "Throttling",
+        "ThrottlingException",
+        "ThrottledException",
+        "RequestThrottledException",
+        "TooManyRequestsException",
+        "RequestLimitExceeded",
+        "PriorRequestNotComplete",
+    }
+)
+TRANSIENT_ERROR_CODES: frozenset[str] = frozenset(
+    {
+        "InternalError",
+        "InternalFailure",
+        "InternalServiceError",
+        "InternalServiceErrorException",
+        "ServiceUnavailable",
+        "RequestTimeout",
+        "RequestTimeoutException",
+    }
+)
+
+
+def is_throttling_error(exc: Exception) -> bool:
+    """Check if the API throttled the request.
+
+    :type exc: Exception
+    :param exc:
+    :return:
+    """
+    return (
+        isinstance(exc, ClientError)
+        and exc.response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+    )
+
+
+def is_retriable_error(exc: Exception) -> bool:
+    """Check if a request which failed with exc may succeed when it is retried.
+
+    :type exc: Exception
+    :param exc:
+    :return:
+    """
+    if isinstance(exc, BotocoreConnectionError | HTTPClientError):
+        return True
+    if not isinstance(exc, ClientError):
+        return False
+    if is_throttling_error(exc):
+        return True
+    code = exc.response.get("Error", {}).get("Code")
+    status_code = exc.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+    return code in TRANSIENT_ERROR_CODES or status_code >= 500
+
+
+INVOCATION_COUNTERS: dict[str, str] = {
+    "retries": "Retries",
+    "throttles": "Throttles",
+    "failures": "ApiCallFailures",
+}
+INVOCATION_DURATIONS: dict[str, str] = {"wait_time": "RetryWait"}
+
+
+@dataclass
+class RetryMetrics:
+    """Counters for the calls of an execution environment.
+
+    The counters add up over all invocations, the running invocation's
+    metrics only receive its own share.
+    """
+
+    calls: int = 0
+    retries: int = 0
+    throttles: int = 0
+    failures: int = 0
+    wait_time: float = 0.0
+    _lock: Lock = field(default_factory=Lock, repr=False, compare=False)
+
+    def add(self, **counters: float) -> None:
+        """Add to the counters and to the metrics of the running invocation.
+
+        :type counters: float
+        :param counters:
+        :return:
+        """
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+        for name, value in counters.items():
+            if name in INVOCATION_COUNTERS:
+                metrics.count(INVOCATION_COUNTERS[name], int(value))
+            elif name in INVOCATION_DURATIONS and value > 0:
+                metrics.add_duration(INVOCATION_DURATIONS[name], value)
+
+    def snapshot(self) -> dict[str, float]:
+        """Return the current counters.
+
+        :return:
+        """
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "throttles": self.throttles,
+                "failures": self.failures,
+                "wait_time": self.wait_time,
+            }
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """How often and how long to retry."""
+
+    max_attempts: int = 4
+    base_delay: float = 0.1
+    max_delay: float = 1.0
+
+    def backoff(self, attempt: int) -> float:
+        """Return the full jitter backoff before the next attempt.
+
+        :type attempt: int
+        :param attempt: number of the failed attempt, starting with 1
+        :return:
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+
+def call_with_retry(
+    operation: Callable[..., Any],
+    *args: Any,
+    policy: RetryPolicy,
+    rate_limiter: AdaptiveRateLimiter | None = None,
+    metrics: RetryMetrics | None = None,
+    sleep: Callable[[float], None] | None = None,
+    **kwargs: Any,
+) -> Any:
+    """Call operation and retry it on retriable errors.
+
+    Within a deadline an attempt is only started while time remains, and the
+    wait for the rate limiter and the backoff before a retry must leave time
+    for it. Otherwise DeadlineExceeded is raised.
+
+    :type operation: Callable[..., Any]
+    :param operation:
+    :type args: Any
+    :param args:
+    :type policy: RetryPolicy
+    :param policy:
+    :type rate_limiter: AdaptiveRateLimiter | None
+    :param rate_limiter:
+    :type metrics: RetryMetrics | None
+    :param metrics:
+    :type sleep: Callable[[float], None] | None
+    :param sleep: defaults to time.sleep
+    :type kwargs: Any
+    :param kwargs:
+    :return:
+    """
+    metrics = metrics or RetryMetrics()
+    sleep = sleep or time.sleep
+    name = getattr(operation, "__name__", str(operation))
+    invocation_deadline = deadline.current()
+    attempt = 0
+    while True:
+        attempt += 1
+        # The wait of the rate limiter is known before sleeping, so it is not
+        # slept past the deadline
+        wait_time = rate_limiter.reserve() if rate_limiter is not None else 0.0
+        if invocation_deadline is not None:
+            try:
+                invocation_deadline.check(wait_time, name)
+            except deadline.DeadlineExceeded:
+                if rate_limiter is not None:
+                    rate_limiter.cancel()
+                raise
+        if rate_limiter is not None:
+            rate_limiter.wait(wait_time)
+            metrics.add(wait_time=wait_time)
+        metrics.add(calls=1)
+        try:
+            result = operation(*args, **kwargs)
+        except Exception as exc:
+            throttled = is_throttling_error(exc)
+            if throttled:
+                metrics.add(throttles=1)
+                if rate_limiter is not None:
+                    rate_limiter.on_throttle()
+            if attempt >= policy.max_attempts or not is_retriable_error(exc):
+                metrics.add(failures=1)
+                raise
+            delay = policy.backoff(attempt)
+            if invocation_deadline is not None:
+                try:
+                    invocation_deadline.check(delay, name)
+                except deadline.DeadlineExceeded:
+                    metrics.add(failures=1)
+                    raise
+            logger.warning(
+                "Retrying %s after %s in %.3fs (attempt %d)",
+                name,
+                exc,
+                delay,
+                attempt,
+            )
+            metrics.add(retries=1, wait_time=delay)
+            sleep(delay)
+            continue
+        if rate_limiter is not None:
+            rate_limiter.on_success()
+        return result
+
+
+class RetryingClient:
+    """Proxy for a boto3 client which retries its API operations."""
+
+    def __init__(
+        self,
+        client: "BaseClient",
+        policy: RetryPolicy,
+        rate_limiter: AdaptiveRateLimiter | None = None,
+        metrics: RetryMetrics | None = None,
+    ):
+        """Wrap the client.
+
+        :type client: BaseClient
+        :param client:
+        :type policy: RetryPolicy
+        :param policy:
+        :type rate_limiter: AdaptiveRateLimiter | None
+        :param rate_limiter:
+        :type metrics: RetryMetrics | None
+        :param metrics:
+        """
+        self.client = client
+        self.policy = policy
+        self.rate_limiter = rate_limiter
+        self.metrics = metrics or RetryMetrics()
+
+    def __getattr__(self, name: str) -> Any:
+        """Return the attribute of the client, API operations are retried.
+
+        :type name: str
+        :param name:
+        :return:
+        """
+        attribute = getattr(self.client, name)
+        if name not in self.client.meta.method_to_api_mapping:
+            return attribute
+
+        def operation(*args: Any, **kwargs: Any) -> Any:
+            return call_with_retry(
+                attribute,
+                *args,
+                policy=self.policy,
+                rate_limiter=self.rate_limiter,
+                metrics=self.metrics,
+                **kwargs,
+            )
+
+        operation.__name__ = name
+        return operation
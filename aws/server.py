@@ -0,0 +1,514 @@
+"""Self-hosted HTTP server running the Lambda handler.
+
+Every request is turned into a Lambda function URL event and handled by
+lambda_handler() on a thread pool, so the event loop keeps accepting and
+reading requests of other routers while AWS calls are in flight:
+
+    python -m aws.server --host 0.0.0.0 --port 8080 --workers 32
+
+GET /health reports if the server accepts requests. On SIGTERM or SIGINT the
+server stops listening, answers the requests in flight and closes idle
+connections.
+
+See: https://docs.aws.amazon.com/lambda/latest/dg/urls-invocation.html#urls-payloads
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import signal
+import time
+import uuid
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Any
+from urllib.parse import parse_qsl, unquote
+
+from aws import lambda_function, startup
+from aws.lambda_function import lambda_handler
+
+logger = logging.getLogger()
+
+HEALTH_PATH: str = "/health"
+MAX_HEADER_SIZE: int = 16 * 1024
+MAX_BODY_SIZE: int = 1024 * 1024
+
+
+class HttpError(Exception):
+    """Request which cannot be passed to the handler."""
+
+    def __init__(self, status: HTTPStatus):
+        """Initialize the error.
+
+        :type status: HTTPStatus
+        :param status: status code of the response
+        """
+        super().__init__(status.phrase)
+        self.status = status
+
+
+@dataclass
+class Request:
+    """Parsed HTTP request."""
+
+    method: str
+    target: str
+    version: str
+    headers: dict[str, str]
+    body: bytes = b""
+
+    @property
+    def path(self) -> str:
+        """Return the path without query string.
+
+        :return:
+        """
+        return unquote(self.target.partition("?")[0]) or "/"
+
+    @property
+    def query_string(self) -> str:
+        """Return the raw query string.
+
+        :return:
+        """
+        return self.target.partition("?")[2]
+
+    @property
+    def keep_alive(self) -> bool:
+        """Check if the client wants to send further requests on the connection.
+
+        :return:
+        """
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+
+@dataclass
+class InvocationContext:
+    """Subset of the Lambda context object which the handler uses."""
+
+    timeout: float
+    function_name: str = "simple-dynamic-dns"
+    aws_request_id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    started: float = field(default_factory=time.monotonic)
+
+    def get_remaining_time_in_millis(self) -> int:
+        """Return the time left until the request times out.
+
+        :return:
+        """
+        remaining = self.timeout - (time.monotonic() - self.started)
+        return max(0, int(remaining * 1000))
+
+
+async def read_request(reader: asyncio.StreamReader) -> Request | None:
+    """Read the next request of a connection.
+
+    :type reader: asyncio.StreamReader
+    :param reader:
+    :return: None if the client closed the connection
+    """
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as exc:
+        if exc.partial.strip():
+            raise HttpError(HTTPStatus.BAD_REQUEST) from None
+        return None
+    except asyncio.LimitOverrunError:
+        raise HttpError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE) from None
+
+    request_line, *header_lines = head.decode("latin-1").rstrip("\r\n").split("\r\n")
+    try:
+        method, target, version = request_line.split(" ")
+    except ValueError:
+        raise HttpError(HTTPStatus.BAD_REQUEST) from None
+    if version not in ("HTTP/1.0", "HTTP/1.1"):
+        raise HttpError(HTTPStatus.HTTP_VERSION_NOT_SUPPORTED)
+
+    headers: dict[str, str] = {}
+    for line in header_lines:
+        name, separator, value = line.partition(":")
+        if not separator or not name or name != name.strip():
+            raise HttpError(HTTPStatus.BAD_REQUEST)
+        name = name.lower()
+        value = value.strip()
+        # Function URLs join repeated headers with commas as well
+        headers[name] = f"{headers[name]},{value}" if name in headers else value
+
+    if "transfer-encoding" in headers:
+        raise HttpError(HTTPStatus.NOT_IMPLEMENTED)
+    try:
+        content_length = int(headers.get("content-length", "0"))
+    except ValueError:
+        raise HttpError(HTTPStatus.BAD_REQUEST) from None
+    if content_length < 0:
+        raise HttpError(HTTPStatus.BAD_REQUEST)
+    if content_length > MAX_BODY_SIZE:
+        raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+    try:
+        body = await reader.readexactly(content_length) if content_length else b""
+    except asyncio.IncompleteReadError:
+        raise HttpError(HTTPStatus.BAD_REQUEST) from None
+    return Request(method.upper(), target, version, headers, body)
+
+
+def build_event(request: Request, source_ip: str, request_id: str) -> dict:
+    """Build the Lambda function URL event of a request.
+
+    :type request: Request
+    :param request:
+    :type source_ip: str
+    :param source_ip:
+    :type request_id: str
+    :param request_id:
+    :return:
+    """
+    event: dict[str, Any] = {
+        "version": "2.0",
+        "routeKey": "$default",
+        "rawPath": request.path,
+        "rawQueryString": request.query_string,
+        "headers": request.headers,
+        "requestContext": {
+            "http": {
+                "method": request.method,
+                "path": request.path,
+                "protocol": request.version,
+                "sourceIp": source_ip,
+                "userAgent": request.headers.get("user-agent", ""),
+            },
+            "requestId": request_id,
+            "timeEpoch": int(time.time() * 1000),
+        },
+        "isBase64Encoded": False,
+    }
+    query_parameters: dict[str, str] = {}
+    for name, value in parse_qsl(request.query_string, keep_blank_values=True):
+        # Function URLs join repeated query parameters with commas
+        query_parameters[name] = (
+            f"{query_parameters[name]},{value}" if name in query_parameters else value
+        )
+    if query_parameters:
+        event["queryStringParameters"] = query_parameters
+    if request.body:
+        try:
+            event["body"] = request.body.decode()
+        except UnicodeDecodeError:
+            event["body"] = base64.b64encode(request.body).decode()
+            event["isBase64Encoded"] = True
+    return event
+
+
+def encode_response(
+    status_code: int,
+    headers: dict[str, str],
+    body: bytes,
+    keep_alive: bool,
+) -> bytes:
+    """Serialize an HTTP response.
+
+    :type status_code: int
+    :param status_code:
+    :type headers: dict[str, str]
+    :param headers:
+    :type body: bytes
+    :param body:
+    :type keep_alive: bool
+    :param keep_alive:
+    :return:
+    """
+    try:
+        reason = HTTPStatus(status_code).phrase
+    except ValueError:
+        reason = ""
+    headers = {name.lower(): str(value) for name, value in headers.items()}
+    headers.setdefault("content-type", "application/json")
+    headers["content-length"] = str(len(body))
+    headers["connection"] = "keep-alive" if keep_alive else "close"
+    lines = [f"HTTP/1.1 {status_code} {reason}"]
+    lines.extend(f"{name}: {value}" for name, value in headers.items())
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+
+def encode_handler_response(response: Any, keep_alive: bool) -> bytes:
+    """Serialize the response of the handler like a function URL does.
+
+    :param response:
+    :type keep_alive: bool
+    :param keep_alive:
+    :return:
+    """
+    if not isinstance(response, dict) or "statusCode" not in response:
+        return encode_response(200, {}, json.dumps(response).encode(), keep_alive)
+    body = response.get("body") or ""
+    if not isinstance(body, str):
+        body = json.dumps(body)
+    if response.get("isBase64Encoded"):
+        encoded_body = base64.b64decode(body)
+    else:
+        encoded_body = body.encode()
+    return encode_response(
+        response["statusCode"],
+        response.get("headers") or {},
+        encoded_body,
+        keep_alive,
+    )
+
+
+def encode_error(status: HTTPStatus) -> bytes:
+    """Serialize an error response and close the connection.
+
+    :type status: HTTPStatus
+    :param status:
+    :return:
+    """
+    return encode_response(
+        status.value, {}, json.dumps(status.phrase).encode(), keep_alive=False
+    )
+
+
+class Server:
+    """HTTP server passing requests to a Lambda handler."""
+
+    def __init__(
+        self,
+        handler: Callable[[dict, Any], dict],
+        host: str = "127.0.0.1",
+        port: int = 8080,
+        workers: int = 32,
+        request_timeout: float = 30.0,
+        idle_timeout: float = 5.0,
+    ):
+        """Initialize the server.
+
+        :type handler: Callable[[dict, Any], dict]
+        :param handler: Lambda handler
+        :type host: str
+        :param host:
+        :type port: int
+        :param port: 0 picks a free port
+        :type workers: int
+        :param workers: threads running the handler concurrently
+        :type request_timeout: float
+        :param request_timeout: seconds reported as remaining time to the handler
+        :type idle_timeout: float
+        :param idle_timeout: seconds before idle connections are closed
+        """
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self.request_timeout = request_timeout
+        self.idle_timeout = idle_timeout
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="handler"
+        )
+        self.draining = False
+        self._server: asyncio.Server | None = None
+        self._connections: set[asyncio.Task] = set()
+        self._idle: set[asyncio.Task] = set()
+        self._in_flight = 0
+        self._drained = asyncio.Event()
+        self._drained.set()
+
+    @property
+    def address(self) -> tuple[str, int]:
+        """Return host and port the server listens on.
+
+        :return:
+        """
+        if self._server is None:
+            return self.host, self.port
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def start(self) -> None:
+        """Start listening.
+
+        :return:
+        """
+        self._server = await asyncio.start_server(
+            self.handle_connection, self.host, self.port, limit=MAX_HEADER_SIZE
+        )
+        logger.info("Listening on %s:%d", *self.address)
+
+    async def shutdown(self, grace_period: float = 10.0) -> None:
+        """Stop listening and wait for the requests in flight.
+
+        :type grace_period: float
+        :param grace_period: seconds to wait for requests in flight
+        :return:
+        """
+        self.draining = True
+        if self._server is not None:
+            self._server.close()
+        for task in self._idle:
+            task.cancel()
+        try:
+            await asyncio.wait_for(self._drained.wait(), grace_period)
+        except TimeoutError:
+            logger.warning("%d requests were still in flight", self._in_flight)
+        for task in self._connections:
+            task.cancel()
+        if self._connections:
+            await asyncio.wait(self._connections)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        logger.info("Server was shut down")
+
+    async def serve(self, shutdown_timeout: float = 10.0) -> None:
+        """Serve until SIGTERM or SIGINT, then shut down gracefully.
+
+        :type shutdown_timeout: float
+        :param shutdown_timeout:
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for signal_number in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signal_number, stop.set)
+        await self.start()
+        await stop.wait()
+        logger.info("Shutting down")
+        await self.shutdown(shutdown_timeout)
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Serve the requests of one connection.
+
+        :type reader: asyncio.StreamReader
+        :param reader:
+        :type writer: asyncio.StreamWriter
+        :param writer:
+        :return:
+        """
+        task = asyncio.current_task()
+        self._connections.add(task)
+        peer = writer.get_extra_info("peername")
+        source_ip = peer[0] if peer else ""
+        try:
+            while not self.draining:
+                self._idle.add(task)
+                try:
+                    request = await asyncio.wait_for(
+                        read_request(reader), self.idle_timeout
+                    )
+                except HttpError as exc:
+                    writer.write(encode_error(exc.status))
+                    await writer.drain()
+                    break
+                finally:
+                    self._idle.discard(task)
+                if request is None:
+                    break
+                writer.write(await self.respond(request, source_ip))
+                await writer.drain()
+                if not request.keep_alive:
+                    break
+        except (TimeoutError, asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def respond(self, request: Request, source_ip: str) -> bytes:
+        """Answer a request.
+
+        Connections are closed after the response once the server is draining.
+
+        :type request: Request
+        :param request:
+        :type source_ip: str
+        :param source_ip:
+        :return:
+        """
+        keep_alive = request.keep_alive and not self.draining
+        if request.path == HEALTH_PATH and request.method == "GET":
+            status = "draining" if self.draining else "ok"
+            return encode_response(
+                503 if self.draining else 200,
+                {},
+                json.dumps({"status": status}).encode(),
+                keep_alive,
+            )
+        if request.method not in ("GET", "POST"):
+            return encode_response(
+                405,
+                {"Allow": "GET, POST"},
+                json.dumps("Method not allowed").encode(),
+                keep_alive,
+            )
+
+        context = InvocationContext(timeout=self.request_timeout)
+        event = build_event(request, source_ip, context.aws_request_id)
+        self._in_flight += 1
+        self._drained.clear()
+        try:
+            # Contexts are not passed to executor threads, the registry and the
+            # metrics of the invocation live in context variables.
+            response = await asyncio.get_running_loop().run_in_executor(
+                self.executor, copy_context().run, self.handler, event, context
+            )
+        except Exception:
+            logger.exception("Unexpected error")
+            response = {
+                "statusCode": 500,
+                "body": json.dumps("Something went wrong"),
+            }
+        finally:
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self._drained.set()
+        return encode_handler_response(
+            response, request.keep_alive and not self.draining
+        )
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Run the server until it is stopped.
+
+    :type argv: list[str] | None
+    :param argv:
+    :return: exit code
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default=os.environ.get("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8080")))
+    parser.add_argument(
+        "--workers", type=int, default=32, help="requests handled concurrently"
+    )
+    parser.add_argument("--request-timeout", type=float, default=30.0)
+    parser.add_argument("--idle-timeout", type=float, default=5.0)
+    parser.add_argument("--shutdown-timeout", type=float, default=10.0)
+    parser.add_argument(
+        "--no-prewarm",
+        action="store_true",
+        help="create the AWS clients on the first request",
+    )
+    arguments = parser.parse_args(argv)
+
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(message)s")
+    # The connection pools of the AWS clients are sized for all workers
+    lambda_function.HANDLER_CONCURRENCY = arguments.workers
+    if not arguments.no_prewarm:
+        startup.prewarm(open_connections=startup.open_connections_enabled())
+    server = Server(
+        lambda_handler,
+        host=arguments.host,
+        port=arguments.port,
+        workers=arguments.workers,
+        request_timeout=arguments.request_timeout,
+        idle_timeout=arguments.idle_timeout,
+    )
+    asyncio.run(server.serve(arguments.shutdown_timeout))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
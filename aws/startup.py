@@ -0,0 +1,114 @@
+"""Execution environment startup.
+
+Lambda runs the module level code of the handler during the INIT phase,
+before the first invocation is timed. Creating the AWS clients and opening
+their TLS connections there takes this work off the first request.
+
+With SnapStart the INIT phase runs once before a snapshot is taken. The
+snapshot hooks pre-warm the environment before the snapshot and replace the
+clients, whose connections do not survive the restore, afterwards. SnapStart
+is only available for functions deployed as .zip archive, the container image
+of this repository always runs the regular INIT phase.
+
+See: https://docs.aws.amazon.com/lambda/latest/dg/snapstart-runtime-hooks-python.html
+"""
+
+import logging
+import os
+
+from aws import metrics, registry
+
+logger = logging.getLogger()
+
+CLIENTS: tuple[str, ...] = ("route53", "secretsmanager", "secret_cache")
+
+
+def running_on_lambda() -> bool:
+    """Check if running in an AWS Lambda execution environment.
+
+    :return:
+    """
+    return "AWS_LAMBDA_FUNCTION_NAME" in os.environ
+
+
+def open_connections_enabled() -> bool:
+    """Check if pre-warming opens the connections of the clients.
+
+    :return:
+    """
+    return os.environ.get("PREWARM_CONNECTIONS", "false").lower() == "true"
+
+
+def prewarm(open_connections: bool = False) -> None:
+    """Create the AWS clients and optionally open their connections.
+
+    Opening the connections makes one cheap read-only call per client. The
+    Route 53 call counts against the API quota of the account, which cold
+    starts during a burst of updates need most, so it is opt-in.
+
+    :type open_connections: bool
+    :param open_connections:
+    :return:
+    """
+    for name in CLIENTS:
+        registry.get(name)
+    if not open_connections:
+        return
+    try:
+        registry.get("route53").get_hosted_zone_count()
+        registry.get("secretsmanager").list_secrets(MaxResults=1)
+    except Exception:
+        logger.warning("Opening connections during INIT failed", exc_info=True)
+
+
+def before_snapshot() -> None:
+    """Pre-warm the execution environment before the snapshot is taken.
+
+    The connections are not opened as they would not survive the restore.
+
+    :return:
+    """
+    prewarm(open_connections=False)
+
+
+def after_restore() -> None:
+    """Replace all clients and caches after the snapshot was restored.
+
+    Connections of the clients are dead and the clock of the caches jumped.
+
+    :return:
+    """
+    registry.get_registry().reset()
+    metrics.mark_cold_start()
+    prewarm(open_connections=open_connections_enabled())
+
+
+def register_snapshot_hooks() -> bool:
+    """Register the snapshot hooks if the SnapStart runtime hooks are installed.
+
+    :return: True if the hooks were registered
+    """
+    try:
+        from snapshot_restore_py import register_after_restore, register_before_snapshot
+    except ImportError:
+        return False
+    register_before_snapshot(before_snapshot)
+    register_after_restore(after_restore)
+    return True
+
+
+def initialize() -> None:
+    """Initialize the execution environment during the INIT phase.
+
+    Set PREWARM_CLIENTS to false to skip pre-warming and PREWARM_CONNECTIONS
+    to true to also open the connections.
+
+    :return:
+    """
+    if not running_on_lambda():
+        return
+    snap_start = os.environ.get("AWS_LAMBDA_INITIALIZATION_TYPE") == "snap-start"
+    if snap_start and register_snapshot_hooks():
+        return
+    if os.environ.get("PREWARM_CLIENTS", "true").lower() == "true":
+        prewarm(open_connections=open_connections_enabled())
@@ -0,0 +1,302 @@
+"""Shared state stores for the last published record values.
+
+The in-memory caches die with the Lambda execution environment. A state store
+keeps the last value this function wrote per record in a place all execution
+environments share, so a cold start can answer a no-op update with one key
+lookup instead of listing the hosted zone.
+
+Every write is conditional on the version that was read before, so concurrent
+updates of the same record do not clobber each other. The loser of a conflict
+deletes the record, as it cannot tell which value Route 53 ended up with.
+"""
+
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from threading import Lock
+from time import time
+from typing import TYPE_CHECKING
+
+from botocore.exceptions import ClientError
+
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
+
+StateKey = tuple[str, str, str]
+
+
+@dataclass(frozen=True)
+class PublishedRecord:
+    """The last value written for a record."""
+
+    value: str
+    version: int
+    updated_at: float = field(default_factory=time)
+
+
+class StateStore(ABC):
+    """Interface of the state stores."""
+
+    @abstractmethod
+    def get(self, key: StateKey) -> PublishedRecord | None:
+        """Return the published record for (hosted zone id, name, type).
+
+        :type key: StateKey
+        :param key:
+        :return:
+        """
+
+    @abstractmethod
+    def put(self, key: StateKey, value: str, expected_version: int | None) -> bool:
+        """Write value if the stored version still is expected_version.
+
+        :type key: StateKey
+        :param key:
+        :type value: str
+        :param value:
+        :type expected_version: int | None
+        :param expected_version: None if the record must not exist yet
+        :return: False if another writer changed the record in the meantime
+        """
+
+    @abstractmethod
+    def delete(self, key: StateKey) -> None:
+        """Delete the published record for (hosted zone id, name, type).
+
+        :type key: StateKey
+        :param key:
+        :return:
+        """
+
+
+class MemoryStateStore(StateStore):
+    """State store in a dict, mostly for tests."""
+
+    def __init__(self):
+        """Initialize the store."""
+        self._records: dict[StateKey, PublishedRecord] = {}
+        self._lock = Lock()
+
+    def get(self, key: StateKey) -> PublishedRecord | None:
+        """Return the published record for (hosted zone id, name, type).
+
+        :type key: StateKey
+        :param key:
+        :return:
+        """
+        return self._records.get(key)
+
+    def put(self, key: StateKey, value: str, expected_version: int | None) -> bool:
+        """Write value if the stored version still is expected_version.
+
+        :type key: StateKey
+        :param key:
+        :type value: str
+        :param value:
+        :type expected_version: int | None
+        :param expected_version:
+        :return:
+        """
+        with self._lock:
+            current = self._records.get(key)
+            current_version = None if current is None else current.version
+            if current_version != expected_version:
+                return False
+            self._records[key] = PublishedRecord(
+                value=value, version=(expected_version or 0) + 1
+            )
+            return True
+
+    def delete(self, key: StateKey) -> None:
+        """Delete the published record for (hosted zone id, name, type).
+
+        :type key: StateKey
+        :param key:
+        :return:
+        """
+        with self._lock:
+            self._records.pop(key, None)
+
+
+class SqliteStateStore(StateStore):
+    """State store in a local SQLite file for self-hosting and tests."""
+
+    def __init__(self, path: str):
+        """Open the database and create the table if necessary.
+
+        :type path: str
+        :param path:
+        """
+        import sqlite3
+
+        self._connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self._lock = Lock()
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS published_records ("
+            "hosted_zone_id TEXT NOT NULL, "
+            "name TEXT NOT NULL, "
+            "type TEXT NOT NULL, "
+            "value TEXT NOT NULL, "
+            "version INTEGER NOT NULL, "
+            "updated_at REAL NOT NULL, "
+            "PRIMARY KEY (hosted_zone_id, name, type))"
+        )
+
+    def get(self, key: StateKey) -> PublishedRecord | None:
+        """Return the published record for (hosted zone id, name, type).
+
+        :type key: StateKey
+        :param key:
+        :return:
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, version, updated_at FROM published_records "
+                "WHERE hosted_zone_id = ? AND name = ? AND type = ?",
+                key,
+            ).fetchone()
+        if row is None:
+            return None
+        return PublishedRecord(value=row[0], version=row[1], updated_at=row[2])
+
+    def put(self, key: StateKey, value: str, expected_version: int | None) -> bool:
+        """Write value if the stored version still is expected_version.
+
+        :type key: StateKey
+        :param key:
+        :type value: str
+        :param value:
+        :type expected_version: int | None
+        :param expected_version:
+        :return:
+        """
+        with self._lock:
+            if expected_version is None:
+                cursor = self._connection.execute(
+                    "INSERT OR IGNORE INTO published_records "
+                    "(hosted_zone_id, name, type, value, version, updated_at) "
+                    "VALUES (?, ?, ?, ?, 1, ?)",
+                    (*key, value, time()),
+                )
+            else:
+                cursor = self._connection.execute(
+                    "UPDATE published_records "
+                    "SET value = ?, version = version + 1, updated_at = ? "
+                    "WHERE hosted_zone_id = ? AND name = ? AND type = ? "
+                    "AND version = ?",
+                    (value, time(), *key, expected_version),
+                )
+        return cursor.rowcount == 1
+
+    def delete(self, key: StateKey) -> None:
+        """Delete the published record for (hosted zone id, name, type).
+
+        :type key: StateKey
+        :param key:
+        :return:
+        """
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM published_records "
+                "WHERE hosted_zone_id = ? AND name = ? AND type = ?",
+                key,
+            )
+
+
+class DynamoDbStateStore(StateStore):
+    """State store in a DynamoDB table with a string partition key "pk".
+
+    See: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb.html
+    """
+
+    def __init__(self, client: "BaseClient", table_name: str):
+        """Initialize the store.
+
+        :type client: BaseClient
+        :param client:
+        :type table_name: str
+        :param table_name:
+        """
+        self._client = client
+        self.table_name = table_name
+
+    @staticmethod
+    def partition_key(key: StateKey) -> str:
+        """Return the partition key for (hosted zone id, name, type).
+
+        :type key: StateKey
+        :param key:
+        :return:
+        """
+        return "#".join(key)
+
+    def get(self, key: StateKey) -> PublishedRecord | None:
+        """Return the published record for (hosted zone id, name, type).
+
+        :type key: StateKey
+        :param key:
+        :return:
+        """
+        # The version read here is the condition of the next put, so the read
+        # must not be stale
+        response = self._client.get_item(
+            TableName=self.table_name,
+            Key={"pk": {"S": self.partition_key(key)}},
+            ConsistentRead=True,
+        )
+        item = response.get("Item")
+        if item is None:
+            return None
+        return PublishedRecord(
+            value=item["value"]["S"],
+            version=int(item["version"]["N"]),
+            updated_at=float(item["updated_at"]["N"]),
+        )
+
+    def put(self, key: StateKey, value: str, expected_version: int | None) -> bool:
+        """Write value if the stored version still is expected_version.
+
+        :type key: StateKey
+        :param key:
+        :type value: str
+        :param value:
+        :type expected_version: int | None
+        :param expected_version:
+        :return:
+        """
+        kwargs: dict = {
+            "TableName": self.table_name,
+            "Item": {
+                "pk": {"S": self.partition_key(key)},
+                "value": {"S": value},
+                "version": {"N": str((expected_version or 0) + 1)},
+                "updated_at": {"N": str(time())},
+            },
+        }
+        if expected_version is None:
+            kwargs["ConditionExpression"] = "attribute_not_exists(pk)"
+        else:
+            kwargs["ConditionExpression"] = "version = :expected_version"
+            kwargs["ExpressionAttributeValues"] = {
+                ":expected_version": {"N": str(expected_version)}
+            }
+        try:
+            self._client.put_item(**kwargs)
+        except ClientError as exc:
+            if exc.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return False
+            raise
+        return True
+
+    def delete(self, key: StateKey) -> None:
+        """Delete the published record for (hosted zone id, name, type).
+
+        :type key: StateKey
+        :param key:
+        :return:
+        """
+        self._client.delete_item(
+            TableName=self.table_name,
+            Key={"pk": {"S": self.partition_key(key)}},
+        )
@@ -0,0 +1,275 @@
+"""Adaptive TTLs derived from how often a record changes.
+
+A record whose IP address changes daily should be cached for minutes, so
+clients converge quickly, while a record which never changes can be cached for
+a day, so resolvers query Route 53 less often. The interval between changes of
+every record is tracked as a moving average and the TTL is a fraction of it,
+within configured bounds. The longer a record stays unchanged, the longer its
+TTL gets.
+"""
+
+import json
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from aws.cache import TTLCache
+from aws.state import StateKey
+
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
+
+
+@dataclass(frozen=True)
+class ChangeRate:
+    """When a record changed last and the average interval between changes."""
+
+    changed_at: float
+    interval: float | None = None
+
+
+class ChangeRateStore(ABC):
+    """Interface of the stores for the change rates per record."""
+
+    @abstractmethod
+    def get(self, key: StateKey) -> ChangeRate | None:
+        """Return the change rate of (hosted zone id, name, type).
+
+        :type key: StateKey
+        :param key:
+        :return:
+        """
+
+    @abstractmethod
+    def put(self, key: StateKey, change_rate: ChangeRate) -> None:
+        """Store the change rate of (hosted zone id, name, type).
+
+        :type key: StateKey
+        :param key:
+        :type change_rate: ChangeRate
+        :param change_rate:
+        :return:
+        """
+
+
+class MemoryChangeRateStore(ChangeRateStore):
+    """Change rates seen by the execution environment in a size bounded cache.
+
+    Every execution environment starts without change rates, so records get
+    long TTLs only in environments living long enough to see them unchanged.
+    """
+
+    def __init__(self, max_size: int):
+        """Initialize the store.
+
+        :type max_size: int
+        :param max_size: maximum number of records
+        """
+        self._change_rates = TTLCache(max_size=max_size, max_age=float("inf"))
+
+    def get(self, key: StateKey) -> ChangeRate | None:
+        """Return the change rate of (hosted zone id, name, type).
+
+        :type key: StateKey
+        :param key:
+        :return:
+        """
+        return self._change_rates.get(key)
+
+    def put(self, key: StateKey, change_rate: ChangeRate) -> None:
+        """Store the change rate of (hosted zone id, name, type).
+
+        :type key: StateKey
+        :param key:
+        :type change_rate: ChangeRate
+        :param change_rate:
+        :return:
+        """
+        self._change_rates.set(key, change_rate)
+
+
+class DynamoDbChangeRateStore(ChangeRateStore):
+    """Change rates shared by all execution environments in a DynamoDB table.
+
+    The table has a string partition key "pk", so it can be shared with the
+    state store.
+
+    See: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb.html
+    """
+
+    def __init__(self, client: "BaseClient", table_name: str):
+        """Initialize the store.
+
+        :type client: BaseClient
+        :param client:
+        :type table_name: str
+        :param table_name:
+        """
+        self._client = client
+        self.table_name = table_name
+
+    @staticmethod
+    def partition_key(key: StateKey) -> str:
+        """Return the partition key for (hosted zone id, name, type).
+
+        :type key: StateKey
+        :param key:
+        :return:
+        """
+        return "ttl#" + "#".join(key)
+
+    def get(self, key: StateKey) -> ChangeRate | None:
+        """Return the change rate of (hosted zone id, name, type).
+
+        :type key: StateKey
+        :param key:
+        :return:
+        """
+        response = self._client.get_item(
+            TableName=self.table_name,
+            Key={"pk": {"S": self.partition_key(key)}},
+        )
+        item = response.get("Item")
+        if item is None:
+            return None
+        return ChangeRate(**json.loads(item["change_rate"]["S"]))
+
+    def put(self, key: StateKey, change_rate: ChangeRate) -> None:
+        """Store the change rate of (hosted zone id, name, type).
+
+        :type key: StateKey
+        :param key:
+        :type change_rate: ChangeRate
+        :param change_rate:
+        :return:
+        """
+        self._client.put_item(
+            TableName=self.table_name,
+            Item={
+                "pk": {"S": self.partition_key(key)},
+                "change_rate": {
+                    "S": json.dumps(
+                        {
+                            "changed_at": change_rate.changed_at,
+                            "interval": change_rate.interval,
+                        }
+                    )
+                },
+            },
+        )
+
+
+class AdaptiveTtl:
+    """Pick the TTL of a record from its change rate."""
+
+    def __init__(
+        self,
+        store: ChangeRateStore,
+        min_ttl: int = 60,
+        max_ttl: int = 86400,
+        fraction: float = 0.01,
+        default_ttl: int = 3600,
+        change_factor: float = 2.0,
+        smoothing: float = 0.5,
+    ):
+        """Initialize the policy.
+
+        :type store: ChangeRateStore
+        :param store:
+        :type min_ttl: int
+        :param min_ttl:
+        :type max_ttl: int
+        :param max_ttl:
+        :type fraction: float
+        :param fraction: TTL as fraction of the interval between changes
+        :type default_ttl: int
+        :param default_ttl: TTL of records changed for the first time
+        :type change_factor: float
+        :param change_factor: factor the TTL of an unchanged record must be off
+            by before it is changed
+        :type smoothing: float
+        :param smoothing: weight of the latest interval in the moving average
+        """
+        self.store = store
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.fraction = fraction
+        self.default_ttl = default_ttl
+        self.change_factor = change_factor
+        self.smoothing = smoothing
+
+    def clamp(self, ttl: float) -> int:
+        """Limit a TTL to the bounds.
+
+        :type ttl: float
+        :param ttl:
+        :return:
+        """
+        return int(min(max(ttl, self.min_ttl), self.max_ttl))
+
+    def ttl(self, change_rate: ChangeRate | None, now: float) -> int | None:
+        """Return the TTL for a change rate.
+
+        The time since the last change counts as interval once it is longer
+        than the average, so stable records get longer TTLs over time. Records
+        which changed only once keep at least the default TTL.
+
+        :type change_rate: ChangeRate | None
+        :param change_rate:
+        :type now: float
+        :param now:
+        :return: None if the change rate is unknown
+        """
+        if change_rate is None:
+            return None
+        elapsed = max(now - change_rate.changed_at, 0.0)
+        if change_rate.interval is None:
+            return self.clamp(max(self.default_ttl, elapsed * self.fraction))
+        return self.clamp(max(change_rate.interval, elapsed) * self.fraction)
+
+    def record_change(self, key: StateKey, now: float) -> int:
+        """Track a change of the record and return the TTL to write with it.
+
+        :type key: StateKey
+        :param key: (hosted zone id, name, type)
+        :type now: float
+        :param now:
+        :return:
+        """
+        previous = self.store.get(key)
+        interval = None
+        if previous is not None:
+            elapsed = max(now - previous.changed_at, 0.0)
+            interval = (
+                elapsed
+                if previous.interval is None
+                else self.smoothing * elapsed + (1 - self.smoothing) * previous.interval
+            )
+        change_rate = ChangeRate(changed_at=now, interval=interval)
+        self.store.put(key, change_rate)
+        return self.ttl(change_rate, now)
+
+    def ttl_update(self, key: StateKey, current_ttl: int, now: float) -> int | None:
+        """Return a new TTL for an unchanged record if it is worth a write.
+
+        A record without a tracked change is tracked from its first
+        observation, so its TTL grows with the time it is seen unchanged.
+
+        :type key: StateKey
+        :param key: (hosted zone id, name, type)
+        :type current_ttl: int
+        :param current_ttl:
+        :type now: float
+        :param now:
+        :return: None if the current TTL is close enough
+        """
+        change_rate = self.store.get(key)
+        if change_rate is None:
+            self.store.put(key, ChangeRate(changed_at=now))
+            return None
+        ttl = self.ttl(change_rate, now)
+        if ttl == current_ttl:
+            return None
+        if max(ttl, current_ttl) < self.change_factor * min(ttl, current_ttl):
+            return None
+        return ttl
@@ -0,0 +1,359 @@
+"""Route 53 hosted zone snapshots and hosted zone resolution.
+
+A snapshot holds all simple resource record sets of a hosted zone, indexed by
+record name and type. Reading it pages through the whole zone once, every
+following lookup is a dict lookup. Requests for a few names can instead read
+just their record sets into a partial snapshot. The hosted zone index maps
+domains to the hosted zones of the account in the same way.
+"""
+
+from collections.abc import Iterator
+from dataclasses import dataclass, field, replace
+from threading import Lock
+from time import monotonic
+from typing import TYPE_CHECKING
+
+from aws import metrics
+
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
+
+
+RecordKey = tuple[str, str]
+
+
+def normalize_record_name(name: str) -> str:
+    """Normalize a record name for lookups.
+
+    Route 53 returns fully qualified, lower case names and escapes the
+    wildcard character.
+
+    :type name: str
+    :param name:
+    :return:
+    """
+    return name.replace("\\052", "*").rstrip(".").lower()
+
+
+@dataclass(frozen=True)
+class ZoneSnapshot:
+    """All simple resource record sets of a hosted zone at a point in time."""
+
+    hosted_zone_id: str
+    record_sets: dict[RecordKey, dict] = field(default_factory=dict)
+    created_at: float = field(default_factory=monotonic)
+
+    def get(self, name: str, record_type: str) -> dict | None:
+        """Return the resource record set for name and type if it exists.
+
+        :type name: str
+        :param name:
+        :type record_type: str
+        :param record_type:
+        :return:
+        """
+        return self.record_sets.get((normalize_record_name(name), record_type))
+
+    def values(self, name: str, record_type: str) -> list[str]:
+        """Return all values of the resource record set for name and type.
+
+        :type name: str
+        :param name:
+        :type record_type: str
+        :param record_type:
+        :return:
+        """
+        record_set = self.get(name, record_type)
+        if record_set is None:
+            return []
+        return [record["Value"] for record in record_set.get("ResourceRecords", [])]
+
+
+def iter_record_sets(
+    client: "BaseClient",
+    hosted_zone_id: str,
+    skipped: set[RecordKey] | None = None,
+) -> Iterator[dict]:
+    """Page through the hosted zone and yield its simple resource record sets.
+
+    Alias records and record sets with a routing policy (SetIdentifier) are
+    skipped as they cannot be managed by this function.
+
+    See: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/route53/client/list_resource_record_sets.html
+
+    :type client: BaseClient
+    :param client:
+    :type hosted_zone_id: str
+    :param hosted_zone_id:
+    :type skipped: set[RecordKey] | None
+    :param skipped: receives the keys of the skipped record sets
+    :return:
+    """
+    kwargs: dict = {"HostedZoneId": hosted_zone_id}
+    while True:
+        response = client.list_resource_record_sets(**kwargs)
+        for record_set in response["ResourceRecordSets"]:
+            if "SetIdentifier" in record_set or "ResourceRecords" not in record_set:
+                if skipped is not None:
+                    skipped.add(
+                        (normalize_record_name(record_set["Name"]), record_set["Type"])
+                    )
+                continue
+            yield record_set
+        if not response.get("IsTruncated"):
+            break
+        kwargs["StartRecordName"] = response["NextRecordName"]
+        kwargs["StartRecordType"] = response["NextRecordType"]
+        if "NextRecordIdentifier" in response:
+            kwargs["StartRecordIdentifier"] = response["NextRecordIdentifier"]
+        else:
+            kwargs.pop("StartRecordIdentifier", None)
+
+
+def load_zone_snapshot(client: "BaseClient", hosted_zone_id: str) -> ZoneSnapshot:
+    """Page through the hosted zone and index its resource record sets.
+
+    :type client: BaseClient
+    :param client:
+    :type hosted_zone_id: str
+    :param hosted_zone_id:
+    :return:
+    """
+    record_sets: dict[RecordKey, dict] = {
+        (normalize_record_name(record_set["Name"]), record_set["Type"]): record_set
+        for record_set in iter_record_sets(client, hosted_zone_id)
+    }
+    return ZoneSnapshot(hosted_zone_id=hosted_zone_id, record_sets=record_sets)
+
+
+def lookup_record_sets(
+    client: "BaseClient",
+    hosted_zone_id: str,
+    names: list[str],
+    record_types: list[str],
+) -> ZoneSnapshot | None:
+    """Read the simple resource record sets of a few names.
+
+    Every name takes one call starting at the name and its first record type.
+    The page holds one record set more than requested, so a record set which
+    is not on it does not exist, unless all record sets on the page belong to
+    the name.
+
+    :type client: BaseClient
+    :param client:
+    :type hosted_zone_id: str
+    :param hosted_zone_id:
+    :type names: list[str]
+    :param names:
+    :type record_types: list[str]
+    :param record_types:
+    :return: partial snapshot, None if the record sets could not be determined
+    """
+    record_sets: dict[RecordKey, dict] = {}
+    first_type = min(record_types)
+    for name in names:
+        normalized_name = normalize_record_name(name)
+        response = client.list_resource_record_sets(
+            HostedZoneId=hosted_zone_id,
+            StartRecordName=name,
+            StartRecordType=first_type,
+            MaxItems=str(len(record_types) + 1),
+        )
+        passed_name = False
+        for record_set in response["ResourceRecordSets"]:
+            record_name = normalize_record_name(record_set["Name"])
+            if record_name != normalized_name:
+                passed_name = True
+            elif "SetIdentifier" not in record_set and "ResourceRecords" in record_set:
+                record_sets[(record_name, record_set["Type"])] = record_set
+        missing = any(
+            (normalized_name, record_type) not in record_sets
+            for record_type in record_types
+        )
+        if missing and response.get("IsTruncated") and not passed_name:
+            return None
+    return ZoneSnapshot(hosted_zone_id=hosted_zone_id, record_sets=record_sets)
+
+
+class ZoneSnapshotCache:
+    """Keep zone snapshots in memory for a limited time."""
+
+    def __init__(self, ttl: float):
+        """Initialize the cache.
+
+        :type ttl: float
+        :param ttl: seconds a snapshot is reused, 0 disables caching
+        """
+        self.ttl = ttl
+        self._snapshots: dict[str, ZoneSnapshot] = {}
+        self._lock = Lock()
+
+    def get(
+        self,
+        client: "BaseClient",
+        hosted_zone_id: str,
+        names: list[str] | None = None,
+        record_types: list[str] | None = None,
+        loaded: list[ZoneSnapshot] | None = None,
+    ) -> ZoneSnapshot:
+        """Return a fresh enough snapshot, read the zone if there is none.
+
+        Without a cached snapshot, the record sets of names are read one call
+        per name if given. These partial snapshots are not cached. If the
+        record sets could not be determined that way, the whole zone is loaded.
+
+        :type client: BaseClient
+        :param client:
+        :type hosted_zone_id: str
+        :param hosted_zone_id:
+        :type names: list[str] | None
+        :param names: names to read instead of loading the whole zone
+        :type record_types: list[str] | None
+        :param record_types: record types of names, defaults to A
+        :type loaded: list[ZoneSnapshot] | None
+        :param loaded: if given, a loaded snapshot is appended instead of
+            cached, so it can be cached later with put()
+        :return:
+        """
+        snapshot = self.cached(hosted_zone_id)
+        if snapshot is not None:
+            metrics.count("ZoneSnapshotCacheHit")
+            return snapshot
+
+        metrics.count("ZoneSnapshotCacheMiss")
+        if names is not None:
+            snapshot = lookup_record_sets(
+                client, hosted_zone_id, names, sorted(set(record_types or ["A"]))
+            )
+            if snapshot is not None:
+                return snapshot
+        snapshot = load_zone_snapshot(client, hosted_zone_id)
+        if loaded is None:
+            self.put(snapshot)
+        else:
+            loaded.append(snapshot)
+        return snapshot
+
+    def cached(self, hosted_zone_id: str) -> ZoneSnapshot | None:
+        """Return the snapshot of a hosted zone if it is fresh enough.
+
+        :type hosted_zone_id: str
+        :param hosted_zone_id:
+        :return:
+        """
+        with self._lock:
+            snapshot = self._snapshots.get(hosted_zone_id)
+        if snapshot is not None and monotonic() - snapshot.created_at < self.ttl:
+            return snapshot
+        return None
+
+    def put(self, snapshot: ZoneSnapshot) -> None:
+        """Cache a snapshot unless a newer one is cached already.
+
+        :type snapshot: ZoneSnapshot
+        :param snapshot:
+        :return:
+        """
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            cached = self._snapshots.get(snapshot.hosted_zone_id)
+            if cached is None or cached.created_at <= snapshot.created_at:
+                self._snapshots[snapshot.hosted_zone_id] = snapshot
+
+    def apply_changes(self, hosted_zone_id: str, changes: list[dict]) -> None:
+        """Patch the snapshot of a hosted zone with submitted changes.
+
+        The snapshot keeps its age, so it is read again as usual.
+
+        :type hosted_zone_id: str
+        :param hosted_zone_id:
+        :type changes: list[dict]
+        :param changes: UPSERT or DELETE changes of a change batch
+        :return:
+        """
+        with self._lock:
+            snapshot = self._snapshots.get(hosted_zone_id)
+            if snapshot is None:
+                return
+            record_sets = dict(snapshot.record_sets)
+            for change in changes:
+                record_set = change["ResourceRecordSet"]
+                key = (normalize_record_name(record_set["Name"]), record_set["Type"])
+                if change["Action"] == "DELETE":
+                    record_sets.pop(key, None)
+                else:
+                    record_sets[key] = record_set
+            self._snapshots[hosted_zone_id] = replace(snapshot, record_sets=record_sets)
+
+    def invalidate(self, hosted_zone_id: str) -> None:
+        """Drop the snapshot of a hosted zone, e.g. after changing it.
+
+        :type hosted_zone_id: str
+        :param hosted_zone_id:
+        :return:
+        """
+        with self._lock:
+            self._snapshots.pop(hosted_zone_id, None)
+
+
+class HostedZoneNotFound(Exception):
+    """No hosted zone of the account contains a domain."""
+
+
+class HostedZoneIndex:
+    """Map domains to hosted zones by longest suffix match."""
+
+    def __init__(self, hosted_zones: dict[str, str]):
+        """Initialize the index.
+
+        :type hosted_zones: dict[str, str]
+        :param hosted_zones: hosted zone id per zone name
+        """
+        self.hosted_zones = {
+            normalize_record_name(name): hosted_zone_id
+            for name, hosted_zone_id in hosted_zones.items()
+        }
+
+    def resolve(self, domain: str) -> str:
+        """Return the id of the most specific hosted zone containing domain.
+
+        :type domain: str
+        :param domain:
+        :return:
+        :raises HostedZoneNotFound: if no hosted zone contains domain
+        """
+        labels = normalize_record_name(domain).split(".")
+        for index in range(len(labels)):
+            hosted_zone_id = self.hosted_zones.get(".".join(labels[index:]))
+            if hosted_zone_id is not None:
+                return hosted_zone_id
+        raise HostedZoneNotFound(f"No hosted zone found for domain {domain}")
+
+
+def load_hosted_zone_index(client: "BaseClient") -> HostedZoneIndex:
+    """Page through all hosted zones of the account and index them by name.
+
+    Public hosted zones take precedence over private ones with the same name.
+
+    See: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/route53/client/list_hosted_zones.html
+
+    :type client: BaseClient
+    :param client:
+    :return:
+    """
+    public_zones: dict[str, str] = {}
+    private_zones: dict[str, str] = {}
+    kwargs: dict = {}
+    while True:
+        response = client.list_hosted_zones(**kwargs)
+        for hosted_zone in response["HostedZones"]:
+            hosted_zone_id = hosted_zone["Id"].rsplit("/", 1)[-1]
+            if hosted_zone.get("Config", {}).get("PrivateZone"):
+                private_zones[hosted_zone["Name"]] = hosted_zone_id
+            else:
+                public_zones[hosted_zone["Name"]] = hosted_zone_id
+        if not response.get("IsTruncated"):
+            break
+        kwargs["Marker"] = response["NextMarker"]
+    return HostedZoneIndex({**private_zones, **public_zones})
@@ -0,0 +1,156 @@
+"""Measure the import time and the INIT duration of the Lambda function.
+
+Every run starts a fresh interpreter, so nothing is cached in the process:
+
+    python -m benchmarks.cold_start --runs 10
+
+Pass --open-connections to include opening the TLS connections to AWS, which
+needs network access and credentials.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+REPO_ROOT: Path = Path(__file__).parent.parent.resolve()
+
+INIT_SNIPPET: str = """
+import time
+started = time.perf_counter()
+import aws.lambda_function
+imported = time.perf_counter()
+from aws import startup
+startup.prewarm(open_connections={open_connections})
+finished = time.perf_counter()
+print(imported - started, finished - started)
+"""
+
+
+def run_python(arguments: list[str]) -> subprocess.CompletedProcess:
+    """Run a fresh interpreter in the repository root.
+
+    :type arguments: list[str]
+    :param arguments:
+    :return:
+    """
+    env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+    env.setdefault("AWS_DEFAULT_REGION", "eu-central-1")
+    env.pop("AWS_LAMBDA_FUNCTION_NAME", None)
+    return subprocess.run(
+        [sys.executable, *arguments],
+        cwd=REPO_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def measure_import_time() -> tuple[float, dict[str, float]]:
+    """Measure the import time with -X importtime.
+
+    :return: total seconds and self seconds per top-level package
+    """
+    result = run_python(["-X", "importtime", "-c", "import aws.lambda_function"])
+    total = 0.0
+    packages: dict[str, float] = defaultdict(float)
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_time, cumulative, name = line.removeprefix("import time:").split("|")
+        package = name.strip().split(".")[0]
+        packages[package] += int(self_time) / 1_000_000
+        if name.strip() == "aws.lambda_function":
+            total = int(cumulative) / 1_000_000
+    return total, dict(packages)
+
+
+def measure_init(open_connections: bool) -> tuple[float, float]:
+    """Measure importing the handler module and pre-warming the clients.
+
+    :type open_connections: bool
+    :param open_connections:
+    :return: seconds for the import and for the whole INIT phase
+    """
+    result = run_python(["-c", INIT_SNIPPET.format(open_connections=open_connections)])
+    import_duration, init_duration = result.stdout.split()
+    return float(import_duration), float(init_duration)
+
+
+def summarize(values: list[float]) -> dict[str, float]:
+    """Summarize measurements in milliseconds.
+
+    :type values: list[float]
+    :param values:
+    :return:
+    """
+    return {
+        "min_ms": round(min(values) * 1000, 1),
+        "median_ms": round(statistics.median(values) * 1000, 1),
+        "max_ms": round(max(values) * 1000, 1),
+    }
+
+
+def main(argv: list[str] | None = None) -> dict:
+    """Run the measurements and print a report.
+
+    :type argv: list[str] | None
+    :param argv:
+    :return:
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--open-connections", action="store_true")
+    parser.add_argument("--json", action="store_true", help="print JSON only")
+    arguments = parser.parse_args(argv)
+
+    import_times = []
+    packages: dict[str, list[float]] = defaultdict(list)
+    for _ in range(arguments.runs):
+        total, package_times = measure_import_time()
+        import_times.append(total)
+        for package, seconds in package_times.items():
+            packages[package].append(seconds)
+
+    init_measurements = [
+        measure_init(arguments.open_connections) for _ in range(arguments.runs)
+    ]
+    report = {
+        "runs": arguments.runs,
+        "import_time": summarize(import_times),
+        "init_import": summarize([imported for imported, _ in init_measurements]),
+        "init_duration": summarize([init for _, init in init_measurements]),
+        "top_packages_ms": {
+            package: round(statistics.median(seconds) * 1000, 1)
+            for package, seconds in sorted(
+                packages.items(),
+                key=lambda item: statistics.median(item[1]),
+                reverse=True,
+            )[: arguments.top]
+        },
+    }
+
+    if arguments.json:
+        print(json.dumps(report, indent=2))
+        return report
+    print(f"Runs: {report['runs']}")
+    for name in ("import_time", "init_import", "init_duration"):
+        summary = report[name]
+        print(
+            f"{name:15} min {summary['min_ms']:8.1f} ms  "
+            f"median {summary['median_ms']:8.1f} ms  max {summary['max_ms']:8.1f} ms"
+        )
+    print("Import time by top-level package (median):")
+    for package, milliseconds in report["top_packages_ms"].items():
+        print(f"  {package:30} {milliseconds:8.1f} ms")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+"""In-process stand-ins for Route 53 and Secrets Manager.
+
+The fakes answer like the real APIs for the operations used by the function.
+Every call can be delayed to model the network round trip, and a token bucket
+per fake models the request rate limit of the API.
+"""
+
+import time
+from bisect import bisect_left
+from collections import Counter
+from collections.abc import Callable
+from datetime import UTC, datetime
+from threading import Lock
+from types import SimpleNamespace
+from typing import ClassVar
+
+from botocore.exceptions import ClientError
+
+from aws.changes import MAX_CHANGES_PER_BATCH, MAX_CHARACTERS_PER_BATCH, change_size
+from aws.ratelimit import TokenBucket
+
+SECRET_ARN_PREFIX: str = "arn:aws:secretsmanager:eu-central-1:123456789012:secret:"
+
+
+def client_error(code: str, operation_name: str) -> ClientError:
+    """Build a botocore ClientError.
+
+    :type code: str
+    :param code:
+    :type operation_name: str
+    :param operation_name:
+    :return:
+    """
+    return ClientError({"Error": {"Code": code, "Message": code}}, operation_name)
+
+
+def record_sort_key(name: str, record_type: str) -> tuple[tuple[str, ...], str]:
+    """Return the key Route 53 sorts the record sets of a hosted zone by.
+
+    Names are sorted by their labels in reverse order.
+
+    :type name: str
+    :param name:
+    :type record_type: str
+    :param record_type:
+    :return:
+    """
+    return tuple(reversed(name.rstrip(".").lower().split("."))), record_type
+
+
+class FakeBackend:
+    """Call counting, latency and throttling shared by all fakes."""
+
+    operations: ClassVar[dict[str, str]] = {}
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        max_rate: float | None = None,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        """Initialize the backend.
+
+        :type latency: float
+        :param latency: seconds every call takes
+        :type max_rate: float | None
+        :param max_rate: requests per second before calls are throttled,
+            None disables throttling
+        :type sleep: Callable[[float], None]
+        :param sleep:
+        """
+        self.latency = latency
+        self.calls: Counter[str] = Counter()
+        self.throttled: Counter[str] = Counter()
+        self.meta = SimpleNamespace(method_to_api_mapping=self.operations)
+        self._bucket = (
+            None if max_rate is None else TokenBucket(rate=max_rate, capacity=max_rate)
+        )
+        self._sleep = sleep
+        self._lock = Lock()
+
+    def _call(self, method_name: str) -> None:
+        with self._lock:
+            self.calls[method_name] += 1
+        if self.latency > 0:
+            self._sleep(self.latency)
+        if self._bucket is not None and self._bucket.try_acquire() > 0:
+            with self._lock:
+                self.throttled[method_name] += 1
+            raise client_error("Throttling", self.operations[method_name])
+
+    @property
+    def total_calls(self) -> int:
+        """Return the number of calls of all operations.
+
+        :return:
+        """
+        with self._lock:
+            return sum(self.calls.values())
+
+
+class FakeRoute53(FakeBackend):
+    """Route 53 with hosted zones kept in memory."""
+
+    operations: ClassVar[dict[str, str]] = {
+        "change_resource_record_sets": "ChangeResourceRecordSets",
+        "get_change": "GetChange",
+        "get_hosted_zone_count": "GetHostedZoneCount",
+        "list_hosted_zones": "ListHostedZones",
+        "list_resource_record_sets": "ListResourceRecordSets",
+    }
+
+    def __init__(
+        self,
+        page_size: int = 300,
+        propagation_delay: float = 0.0,
+        **kwargs,
+    ):
+        """Initialize Route 53 without hosted zones.
+
+        :type page_size: int
+        :param page_size: maximum record sets per page, 300 like the API
+        :type propagation_delay: float
+        :param propagation_delay: seconds until a change is INSYNC
+        :param kwargs: see FakeBackend
+        """
+        super().__init__(**kwargs)
+        self.page_size = page_size
+        self.propagation_delay = propagation_delay
+        self.hosted_zones: dict[str, str] = {}
+        self.record_sets: dict[str, dict[tuple[str, str], dict]] = {}
+        self.changes: dict[str, float] = {}
+        self._sorted_record_sets: dict[str, list[dict]] = {}
+
+    def add_hosted_zone(self, hosted_zone_id: str, name: str) -> None:
+        """Create an empty hosted zone.
+
+        :type hosted_zone_id: str
+        :param hosted_zone_id:
+        :type name: str
+        :param name:
+        :return:
+        """
+        self.hosted_zones[hosted_zone_id] = name.rstrip(".") + "."
+        self.record_sets[hosted_zone_id] = {}
+        self._sorted_record_sets.pop(hosted_zone_id, None)
+
+    def add_record(
+        self,
+        hosted_zone_id: str,
+        name: str,
+        record_type: str,
+        values: list[str],
+        ttl: int = 300,
+    ) -> None:
+        """Create or replace a simple record set.
+
+        :type hosted_zone_id: str
+        :param hosted_zone_id:
+        :type name: str
+        :param name:
+        :type record_type: str
+        :param record_type:
+        :type values: list[str]
+        :param values:
+        :type ttl: int
+        :param ttl:
+        :return:
+        """
+        name = name.rstrip(".").lower() + "."
+        self.record_sets[hosted_zone_id][(name, record_type)] = {
+            "Name": name,
+            "Type": record_type,
+            "TTL": ttl,
+            "ResourceRecords": [{"Value": value} for value in values],
+        }
+        self._sorted_record_sets.pop(hosted_zone_id, None)
+
+    def _zone(self, hosted_zone_id: str, operation_name: str) -> dict:
+        try:
+            return self.record_sets[hosted_zone_id]
+        except KeyError:
+            raise client_error("NoSuchHostedZone", operation_name) from None
+
+    def _sorted_zone(self, hosted_zone_id: str) -> list[dict]:
+        # Sorting is cached, so the fake does not dominate the measurement of
+        # paging through large zones.
+        record_sets = self._sorted_record_sets.get(hosted_zone_id)
+        if record_sets is None:
+            record_sets = sorted(
+                self._zone(hosted_zone_id, "ListResourceRecordSets").values(),
+                key=lambda record_set: record_sort_key(
+                    record_set["Name"], record_set["Type"]
+                ),
+            )
+            self._sorted_record_sets[hosted_zone_id] = record_sets
+        return record_sets
+
+    def list_resource_record_sets(
+        self,
+        HostedZoneId: str,
+        StartRecordName: str | None = None,
+        StartRecordType: str | None = None,
+        MaxItems: str | None = None,
+        **kwargs,
+    ) -> dict:
+        """Return one page of record sets in the order of the API.
+
+        :return:
+        """
+        self._call("list_resource_record_sets")
+        record_sets = self._sorted_zone(HostedZoneId)
+        page_size = min(int(MaxItems or self.page_size), self.page_size)
+        start = 0
+        if StartRecordName is not None:
+            start = bisect_left(
+                record_sets,
+                record_sort_key(StartRecordName, StartRecordType or ""),
+                key=lambda record_set: record_sort_key(
+                    record_set["Name"], record_set["Type"]
+                ),
+            )
+        page = record_sets[start : start + page_size]
+        response = {
+            "ResourceRecordSets": [dict(record_set) for record_set in page],
+            "IsTruncated": start + page_size < len(record_sets),
+            "MaxItems": str(page_size),
+        }
+        if response["IsTruncated"]:
+            next_record_set = record_sets[start + page_size]
+            response["NextRecordName"] = next_record_set["Name"]
+            response["NextRecordType"] = next_record_set["Type"]
+        return response
+
+    def change_resource_record_sets(
+        self, HostedZoneId: str, ChangeBatch: dict, **kwargs
+    ) -> dict:
+        """Apply a change batch atomically.
+
+        :return:
+        """
+        self._call("change_resource_record_sets")
+        zone = self._zone(HostedZoneId, "ChangeResourceRecordSets")
+        changes = ChangeBatch["Changes"]
+        sizes = [change_size(change) for change in changes]
+        if (
+            sum(records for records, _ in sizes) > MAX_CHANGES_PER_BATCH
+            or sum(characters for _, characters in sizes) > MAX_CHARACTERS_PER_BATCH
+        ):
+            raise client_error("InvalidChangeBatch", "ChangeResourceRecordSets")
+
+        updated = dict(zone)
+        for change in changes:
+            record_set = change["ResourceRecordSet"]
+            name = record_set["Name"].rstrip(".").lower() + "."
+            key = (name, record_set["Type"])
+            action = change["Action"]
+            if (action == "CREATE" and key in updated) or (
+                action == "DELETE" and key not in updated
+            ):
+                raise client_error("InvalidChangeBatch", "ChangeResourceRecordSets")
+            if action == "DELETE":
+                del updated[key]
+            else:
+                updated[key] = {**record_set, "Name": name}
+        self.record_sets[HostedZoneId] = updated
+        self._sorted_record_sets.pop(HostedZoneId, None)
+
+        with self._lock:
+            change_id = f"C{len(self.changes) + 1:012d}"
+            self.changes[change_id] = time.monotonic()
+        return {"ChangeInfo": self._change_info(change_id)}
+
+    def _change_info(self, change_id: str) -> dict:
+        submitted_at = self.changes[change_id]
+        in_sync = time.monotonic() - submitted_at >= self.propagation_delay
+        return {
+            "Id": f"/change/{change_id}",
+            "Status": "INSYNC" if in_sync else "PENDING",
+            "SubmittedAt": datetime.now(UTC),
+        }
+
+    def get_change(self, Id: str, **kwargs) -> dict:
+        """Return the status of a change.
+
+        :return:
+        """
+        self._call("get_change")
+        change_id = Id.rsplit("/", 1)[-1]
+        if change_id not in self.changes:
+            raise client_error("NoSuchChange", "GetChange")
+        return {"ChangeInfo": self._change_info(change_id)}
+
+    def list_hosted_zones(
+        self, Marker: str | None = None, MaxItems: str | None = None, **kwargs
+    ) -> dict:
+        """Return one page of hosted zones.
+
+        :return:
+        """
+        self._call("list_hosted_zones")
+        page_size = int(MaxItems or 100)
+        hosted_zone_ids = sorted(self.hosted_zones)
+        start = hosted_zone_ids.index(Marker) if Marker else 0
+        page = hosted_zone_ids[start : start + page_size]
+        response = {
+            "HostedZones": [
+                {
+                    "Id": f"/hostedzone/{hosted_zone_id}",
+                    "Name": self.hosted_zones[hosted_zone_id],
+                    "Config": {"PrivateZone": False},
+                }
+                for hosted_zone_id in page
+            ],
+            "IsTruncated": start + page_size < len(hosted_zone_ids),
+            "MaxItems": str(page_size),
+        }
+        if response["IsTruncated"]:
+            response["NextMarker"] = hosted_zone_ids[start + page_size]
+        return response
+
+    def get_hosted_zone_count(self, **kwargs) -> dict:
+        """Return the number of hosted zones.
+
+        :return:
+        """
+        self._call("get_hosted_zone_count")
+        return {"HostedZoneCount": len(self.hosted_zones)}
+
+
+class FakeSecretsManager(FakeBackend):
+    """Secrets Manager with one version per secret."""
+
+    operations: ClassVar[dict[str, str]] = {
+        "describe_secret": "DescribeSecret",
+        "get_secret_value": "GetSecretValue",
+        "list_secrets": "ListSecrets",
+    }
+
+    def __init__(self, secrets: dict[str, str] | None = None, **kwargs):
+        """Initialize Secrets Manager with the given secret strings.
+
+        :type secrets: dict[str, str] | None
+        :param secrets: secret string per secret id
+        :param kwargs: see FakeBackend
+        """
+        super().__init__(**kwargs)
+        self.secrets: dict[str, str] = dict(secrets or {})
+
+    def _secret(self, secret_id: str, operation_name: str) -> str:
+        try:
+            return self.secrets[secret_id]
+        except KeyError:
+            raise client_error("ResourceNotFoundException", operation_name) from None
+
+    def describe_secret(self, SecretId: str, **kwargs) -> dict:
+        """Return the metadata of a secret.
+
+        :return:
+        """
+        self._call("describe_secret")
+        self._secret(SecretId, "DescribeSecret")
+        return {
+            "ARN": f"{SECRET_ARN_PREFIX}{SecretId}",
+            "Name": SecretId,
+            "VersionIdsToStages": {"v1": ["AWSCURRENT"]},
+        }
+
+    def get_secret_value(self, SecretId: str, **kwargs) -> dict:
+        """Return the current value of a secret.
+
+        :return:
+        """
+        self._call("get_secret_value")
+        return {
+            "ARN": f"{SECRET_ARN_PREFIX}{SecretId}",
+            "Name": SecretId,
+            "VersionId": "v1",
+            "SecretString": self._secret(SecretId, "GetSecretValue"),
+            "VersionStages": ["AWSCURRENT"],
+        }
+
+    def list_secrets(self, MaxResults: int = 100, **kwargs) -> dict:
+        """Return the names of the secrets.
+
+        :return:
+        """
+        self._call("list_secrets")
+        return {
+            "SecretList": [{"Name": name} for name in sorted(self.secrets)][:MaxResults]
+        }
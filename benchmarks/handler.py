@@ -0,0 +1,525 @@
+"""Benchmark the Lambda handler against fake Route 53 and Secrets Manager.
+
+Runs fully offline. Every scenario simulates one execution environment with
+its own registry, so caches behave like in a warm Lambda function:
+
+    python -m benchmarks.handler --iterations 200 --latency-ms 20
+
+Save a report with --output and compare later runs against it with
+--baseline. The run fails if a scenario exceeds its API call budget or is
+slower than the baseline by more than --tolerance.
+"""
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from collections.abc import Iterator
+from contextlib import contextmanager, redirect_stdout
+from dataclasses import dataclass
+from typing import Any
+
+from aws import lambda_function
+from aws.registry import Registry, use_registry
+from benchmarks.fakes import FakeRoute53, FakeSecretsManager
+
+HOSTED_ZONE_ID: str = "Z0000000000000BENCH"
+ZONE_NAME: str = "bench.example.com"
+CLIENT_ID: str = "bench-client"
+TOKEN: str = "bench-token"
+INITIAL_IP: str = "192.0.2.1"
+
+COMPARED_METRICS: tuple[str, ...] = (
+    "p50_ms",
+    "p90_ms",
+    "api_calls_per_invocation",
+    "peak_kib",
+)
+
+
+@dataclass(frozen=True)
+class Scenario:
+    """A kind of request sent repeatedly to one execution environment."""
+
+    name: str
+    description: str
+    domains: int = 1
+    zone_size: int = 10
+    change_ip: bool = False
+    cold: bool = False
+    max_api_calls: float | None = None
+
+
+SCENARIOS: dict[str, Scenario] = {
+    scenario.name: scenario
+    for scenario in (
+        Scenario(
+            name="warm_noop",
+            description="unchanged IP in a warm execution environment",
+            max_api_calls=0,
+        ),
+        Scenario(
+            name="cold_noop",
+            description="unchanged IP in a new execution environment",
+            cold=True,
+            max_api_calls=3,
+        ),
+        Scenario(
+            name="ip_change",
+            description="new IP for one domain",
+            change_ip=True,
+            max_api_calls=2,
+        ),
+        Scenario(
+            name="multi_domain",
+            description="new IP for 20 domains in one request",
+            domains=20,
+            change_ip=True,
+            max_api_calls=2,
+        ),
+        Scenario(
+            name="large_zone",
+            description="new IP for one domain in a zone with 5000 records",
+            zone_size=5000,
+            change_ip=True,
+            max_api_calls=18,
+        ),
+    )
+}
+
+
+@dataclass(frozen=True)
+class Environment:
+    """Fakes and registry of one simulated execution environment."""
+
+    registry: Registry
+    route_53: FakeRoute53
+    secrets_manager: FakeSecretsManager
+
+    @property
+    def total_calls(self) -> int:
+        """Return the number of API calls made so far.
+
+        :return:
+        """
+        return self.route_53.total_calls + self.secrets_manager.total_calls
+
+    def operations(self) -> Counter[str]:
+        """Return the number of calls per operation.
+
+        :return:
+        """
+        return self.route_53.calls + self.secrets_manager.calls
+
+
+@contextmanager
+def configure(**settings: Any) -> Iterator[None]:
+    """Override module level settings of the Lambda function.
+
+    :type settings: Any
+    :param settings:
+    :return:
+    """
+    previous = {name: getattr(lambda_function, name) for name in settings}
+    for name, value in settings.items():
+        setattr(lambda_function, name, value)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            setattr(lambda_function, name, value)
+
+
+def domain_name(index: int) -> str:
+    """Return the name of a dynamic DNS domain.
+
+    :type index: int
+    :param index:
+    :return:
+    """
+    return f"host-{index}.{ZONE_NAME}"
+
+
+def ip_address(iteration: int) -> str:
+    """Return a distinct IPv4 address per iteration.
+
+    :type iteration: int
+    :param iteration:
+    :return:
+    """
+    return f"10.{iteration // 65536 % 256}.{iteration // 256 % 256}.{iteration % 256}"
+
+
+def create_route_53(
+    scenario: Scenario, latency: float, max_rate: float | None
+) -> FakeRoute53:
+    """Create Route 53 with the hosted zone of the scenario.
+
+    :type scenario: Scenario
+    :param scenario:
+    :type latency: float
+    :param latency:
+    :type max_rate: float | None
+    :param max_rate:
+    :return:
+    """
+    route_53 = FakeRoute53(latency=latency, max_rate=max_rate)
+    route_53.add_hosted_zone(HOSTED_ZONE_ID, ZONE_NAME)
+    for index in range(scenario.zone_size):
+        route_53.add_record(
+            HOSTED_ZONE_ID, f"static-{index}.{ZONE_NAME}", "A", ["198.51.100.1"]
+        )
+    for index in range(scenario.domains):
+        route_53.add_record(HOSTED_ZONE_ID, domain_name(index), "A", [INITIAL_IP])
+    return route_53
+
+
+def create_environment(
+    route_53: FakeRoute53,
+    latency: float,
+    max_rate: float | None,
+    client_rate: float | None,
+) -> Environment:
+    """Create a new execution environment using the given Route 53.
+
+    The fakes are wrapped like the real clients, so retries are part of the
+    measurement. Client side rate limiting paces warm scenarios to the
+    configured rate and is therefore only enabled with client_rate.
+
+    :type route_53: FakeRoute53
+    :param route_53:
+    :type latency: float
+    :param latency:
+    :type max_rate: float | None
+    :param max_rate:
+    :type client_rate: float | None
+    :param client_rate:
+    :return:
+    """
+    secrets_manager = FakeSecretsManager(
+        secrets={CLIENT_ID: TOKEN}, latency=latency, max_rate=max_rate
+    )
+    registry = Registry()
+    with use_registry(registry):
+        registry.set(
+            "route53",
+            lambda_function.create_retrying_client(route_53, client_rate),
+        )
+        registry.set(
+            "secretsmanager",
+            lambda_function.create_retrying_client(secrets_manager, client_rate),
+        )
+    return Environment(
+        registry=registry, route_53=route_53, secrets_manager=secrets_manager
+    )
+
+
+def build_event(scenario: Scenario, ip: str) -> dict:
+    """Build a function URL event for the scenario.
+
+    :type scenario: Scenario
+    :param scenario:
+    :type ip: str
+    :param ip:
+    :return:
+    """
+    return {
+        "queryStringParameters": {
+            "domain": ",".join(domain_name(index) for index in range(scenario.domains)),
+            "ip": ip,
+            "client_id": CLIENT_ID,
+            "token": TOKEN,
+        }
+    }
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Return the percentile of the values with the nearest rank method.
+
+    :type values: list[float]
+    :param values:
+    :type fraction: float
+    :param fraction:
+    :return:
+    """
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def invocations(
+    scenario: Scenario,
+    iterations: int,
+    latency: float,
+    max_rate: float | None,
+    client_rate: float | None,
+) -> Iterator[tuple[Environment, dict]]:
+    """Yield the environment and the event of every invocation.
+
+    Warm scenarios send one request before the first measured invocation.
+
+    :type scenario: Scenario
+    :param scenario:
+    :type iterations: int
+    :param iterations:
+    :type latency: float
+    :param latency:
+    :type max_rate: float | None
+    :param max_rate:
+    :type client_rate: float | None
+    :param client_rate:
+    :return:
+    """
+    route_53 = create_route_53(scenario, latency, max_rate)
+    environment = create_environment(route_53, latency, max_rate, client_rate)
+    if not scenario.cold:
+        with use_registry(environment.registry):
+            lambda_function.lambda_handler(build_event(scenario, INITIAL_IP), None)
+    for iteration in range(1, iterations + 1):
+        if scenario.cold:
+            environment = create_environment(route_53, latency, max_rate, client_rate)
+        ip = ip_address(iteration) if scenario.change_ip else INITIAL_IP
+        yield environment, build_event(scenario, ip)
+
+
+def run_scenario(
+    scenario: Scenario,
+    iterations: int = 100,
+    allocation_iterations: int = 20,
+    latency: float = 0.0,
+    max_rate: float | None = None,
+    client_rate: float | None = None,
+) -> dict:
+    """Run a scenario and summarize its invocations.
+
+    Allocations are traced in a separate pass, as tracing slows down the
+    invocations considerably.
+
+    :type scenario: Scenario
+    :param scenario:
+    :type iterations: int
+    :param iterations:
+    :type allocation_iterations: int
+    :param allocation_iterations:
+    :type latency: float
+    :param latency: seconds every fake API call takes
+    :type max_rate: float | None
+    :param max_rate: requests per second before the fakes throttle
+    :type client_rate: float | None
+    :param client_rate: requests per second of the client side rate limiters
+    :return:
+    """
+    durations: list[float] = []
+    api_calls: list[int] = []
+    operations: Counter[str] = Counter()
+    status_codes: Counter[int] = Counter()
+    retries = 0
+    with configure(ROUTE_53_HOSTED_ZONE_ID=HOSTED_ZONE_ID):
+        for environment, event in invocations(
+            scenario, iterations, latency, max_rate, client_rate
+        ):
+            calls_before = environment.total_calls
+            operations_before = environment.operations()
+            with use_registry(environment.registry):
+                retry_metrics = environment.registry.get("retry_metrics")
+                retries_before = retry_metrics.retries
+                started = time.perf_counter()
+                response = lambda_function.lambda_handler(event, None)
+                durations.append(time.perf_counter() - started)
+                retries += retry_metrics.retries - retries_before
+            api_calls.append(environment.total_calls - calls_before)
+            operations.update(environment.operations() - operations_before)
+            status_codes[response["statusCode"]] += 1
+
+        peaks: list[int] = []
+        retained = 0
+        tracemalloc.start()
+        try:
+            for environment, event in invocations(
+                scenario, allocation_iterations, latency, max_rate, client_rate
+            ):
+                with use_registry(environment.registry):
+                    tracemalloc.reset_peak()
+                    before, _ = tracemalloc.get_traced_memory()
+                    lambda_function.lambda_handler(event, None)
+                    after, peak = tracemalloc.get_traced_memory()
+                peaks.append(peak - before)
+                retained += after - before
+        finally:
+            tracemalloc.stop()
+
+    return {
+        "description": scenario.description,
+        "iterations": iterations,
+        "p50_ms": round(percentile(durations, 0.5) * 1000, 3),
+        "p90_ms": round(percentile(durations, 0.9) * 1000, 3),
+        "p99_ms": round(percentile(durations, 0.99) * 1000, 3),
+        "max_ms": round(max(durations) * 1000, 3),
+        "api_calls_per_invocation": round(statistics.fmean(api_calls), 3),
+        "api_calls_per_operation": {
+            operation: round(count / iterations, 3)
+            for operation, count in sorted(operations.items())
+        },
+        "retries": retries,
+        "status_codes": {
+            str(status_code): count for status_code, count in status_codes.items()
+        },
+        "peak_kib": round(statistics.fmean(peaks) / 1024, 1) if peaks else 0.0,
+        "retained_kib_per_invocation": (
+            round(retained / len(peaks) / 1024, 1) if peaks else 0.0
+        ),
+    }
+
+
+def check_regressions(
+    results: dict[str, dict],
+    baseline: dict[str, dict] | None = None,
+    tolerance: float = 0.25,
+    slack_ms: float = 0.5,
+) -> list[str]:
+    """Compare the results with the API call budgets and a baseline.
+
+    :type results: dict[str, dict]
+    :param results: results per scenario name
+    :type baseline: dict[str, dict] | None
+    :param baseline: results per scenario name of an earlier run
+    :type tolerance: float
+    :param tolerance: allowed relative increase over the baseline
+    :type slack_ms: float
+    :param slack_ms: allowed absolute increase of latencies, so sub-millisecond
+        noise does not count as regression
+    :return: descriptions of the regressions
+    """
+    regressions = []
+    for name, result in results.items():
+        failed = sum(
+            count
+            for status_code, count in result["status_codes"].items()
+            if int(status_code) >= 400
+        )
+        if failed:
+            regressions.append(f"{name}: {failed} invocations failed")
+        budget = SCENARIOS[name].max_api_calls if name in SCENARIOS else None
+        if budget is not None and result["api_calls_per_invocation"] > budget:
+            regressions.append(
+                f"{name}: {result['api_calls_per_invocation']} API calls per "
+                f"invocation exceed the budget of {budget}"
+            )
+        if baseline is None or name not in baseline:
+            continue
+        for metric in COMPARED_METRICS:
+            previous = baseline[name][metric]
+            limit = previous * (1 + tolerance)
+            if metric.endswith("_ms"):
+                limit = max(limit, previous + slack_ms)
+            if result[metric] > limit:
+                regressions.append(
+                    f"{name}: {metric} regressed from {previous} to {result[metric]}"
+                )
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Run the scenarios, print a report and check for regressions.
+
+    :type argv: list[str] | None
+    :param argv:
+    :return: exit code
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=sorted(SCENARIOS),
+        help="run only this scenario, can be repeated",
+    )
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--allocation-iterations", type=int, default=20)
+    parser.add_argument(
+        "--latency-ms", type=float, default=5.0, help="duration of every API call"
+    )
+    parser.add_argument(
+        "--max-rate",
+        type=float,
+        default=None,
+        help="requests per second before the fakes throttle",
+    )
+    parser.add_argument(
+        "--client-rate",
+        type=float,
+        default=None,
+        help="requests per second of the client side rate limiters",
+    )
+    parser.add_argument("--baseline", help="report of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--slack-ms", type=float, default=0.5)
+    parser.add_argument("--output", help="write the report to this file")
+    parser.add_argument("--json", action="store_true", help="print JSON only")
+    arguments = parser.parse_args(argv)
+
+    # Log and metric records are still created, but not written to the console.
+    root_logger = logging.getLogger()
+    handler = logging.NullHandler()
+    root_logger.addHandler(handler)
+    try:
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            results = {
+                name: run_scenario(
+                    SCENARIOS[name],
+                    iterations=arguments.iterations,
+                    allocation_iterations=arguments.allocation_iterations,
+                    latency=arguments.latency_ms / 1000,
+                    max_rate=arguments.max_rate,
+                    client_rate=arguments.client_rate,
+                )
+                for name in arguments.scenario or SCENARIOS
+            }
+    finally:
+        root_logger.removeHandler(handler)
+
+    report = {
+        "settings": {
+            "iterations": arguments.iterations,
+            "latency_ms": arguments.latency_ms,
+            "max_rate": arguments.max_rate,
+            "client_rate": arguments.client_rate,
+        },
+        "scenarios": results,
+    }
+    if arguments.output:
+        with open(arguments.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    baseline = None
+    if arguments.baseline:
+        with open(arguments.baseline) as file:
+            baseline = json.load(file)["scenarios"]
+    regressions = check_regressions(
+        results, baseline, arguments.tolerance, arguments.slack_ms
+    )
+
+    if arguments.json:
+        print(json.dumps({**report, "regressions": regressions}, indent=2))
+    else:
+        print(
+            f"{'scenario':14} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} "
+            f"{'calls':>7} {'retries':>8} {'peak KiB':>9}"
+        )
+        for name, result in results.items():
+            print(
+                f"{name:14} {result['p50_ms']:9.2f} {result['p90_ms']:9.2f} "
+                f"{result['p99_ms']:9.2f} {result['api_calls_per_invocation']:7.2f} "
+                f"{result['retries']:8d} {result['peak_kib']:9.1f}"
+            )
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
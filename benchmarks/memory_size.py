@@ -0,0 +1,231 @@
+"""Recommend the Lambda memory size for a benchmark scenario.
+
+Lambda assigns CPU in proportion to the memory size, a full vCPU at 1769 MB,
+and bills duration times memory. The scenario runs once against the fakes,
+measuring the CPU time and the time spent waiting for the fake APIs of every
+invocation. For every memory size the CPU time is stretched by the CPU share
+of the setting, which gives the simulated latency and cost:
+
+    python -m benchmarks.memory_size --scenario ip_change --target-ms 100
+
+The recommendation is the cheapest memory size whose p99 latency meets the
+target and which fits the peak resident set size of the run plus --headroom.
+The benchmark process is a fair stand-in for the function, as it loads the
+same modules, but the model ignores the INIT phase and network jitter.
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import statistics
+import sys
+import time
+from contextlib import redirect_stdout
+
+from aws import lambda_function
+from aws.profiling import memory_usage
+from aws.registry import use_registry
+from benchmarks.handler import (
+    HOSTED_ZONE_ID,
+    SCENARIOS,
+    Scenario,
+    configure,
+    invocations,
+    percentile,
+)
+
+FULL_VCPU_MB: int = 1769
+MEMORY_SIZES: tuple[int, ...] = (128, 256, 512, 1024, 1769, 3008)
+PRICE_PER_GB_SECOND: dict[str, float] = {
+    "arm64": 0.0000133334,
+    "x86_64": 0.0000166667,
+}
+PRICE_PER_REQUEST: float = 0.0000002
+
+Sample = tuple[float, float]
+
+
+def measure(scenario: Scenario, iterations: int, latency: float) -> list[Sample]:
+    """Run a scenario and measure the wall and CPU time of every invocation.
+
+    :type scenario: Scenario
+    :param scenario:
+    :type iterations: int
+    :param iterations:
+    :type latency: float
+    :param latency: seconds every fake API call takes
+    :return: wall and CPU seconds per invocation
+    """
+    samples = []
+    with configure(ROUTE_53_HOSTED_ZONE_ID=HOSTED_ZONE_ID):
+        for environment, event in invocations(
+            scenario, iterations, latency, None, None
+        ):
+            with use_registry(environment.registry):
+                started = time.perf_counter()
+                cpu_started = time.process_time()
+                lambda_function.lambda_handler(event, None)
+                cpu = time.process_time() - cpu_started
+                wall = time.perf_counter() - started
+            samples.append((wall, min(cpu, wall)))
+    return samples
+
+
+def simulate(
+    samples: list[Sample], memory_mb: int, architecture: str = "arm64"
+) -> dict:
+    """Estimate latency and cost of the invocations at a memory size.
+
+    The handler runs on one thread, so more than a full vCPU does not make it
+    faster.
+
+    :type samples: list[Sample]
+    :param samples: wall and CPU seconds per invocation at a full vCPU
+    :type memory_mb: int
+    :param memory_mb:
+    :type architecture: str
+    :param architecture: "arm64" or "x86_64"
+    :return:
+    """
+    slowdown = max(1.0, FULL_VCPU_MB / memory_mb)
+    durations = [wall - cpu + cpu * slowdown for wall, cpu in samples]
+    billed_seconds = statistics.fmean(
+        math.ceil(duration * 1000) / 1000 for duration in durations
+    )
+    cost = (
+        billed_seconds * memory_mb / 1024 * PRICE_PER_GB_SECOND[architecture]
+        + PRICE_PER_REQUEST
+    )
+    return {
+        "memory_mb": memory_mb,
+        "p50_ms": round(percentile(durations, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(durations, 0.99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(durations) * 1000, 3),
+        "cost_per_million_usd": round(cost * 1_000_000, 4),
+    }
+
+
+def recommend(
+    settings: list[dict], target_ms: float, required_mb: float = 0.0
+) -> dict | None:
+    """Return the cheapest setting meeting the latency target.
+
+    :type settings: list[dict]
+    :param settings: results of simulate()
+    :type target_ms: float
+    :param target_ms: p99 latency
+    :type required_mb: float
+    :param required_mb: memory the function needs
+    :return: None if no setting meets the target
+    """
+    feasible = [
+        setting
+        for setting in settings
+        if setting["p99_ms"] <= target_ms and setting["memory_mb"] >= required_mb
+    ]
+    if not feasible:
+        return None
+    return min(
+        feasible,
+        key=lambda setting: (setting["cost_per_million_usd"], setting["memory_mb"]),
+    )
+
+
+def memory_sizes(value: str) -> list[int]:
+    """Parse a comma separated list of memory sizes.
+
+    :type value: str
+    :param value:
+    :return:
+    """
+    sizes = sorted({int(size) for size in value.split(",") if size.strip()})
+    if not sizes or sizes[0] < 128 or sizes[-1] > 10240:
+        raise argparse.ArgumentTypeError("memory sizes must be within 128-10240 MB")
+    return sizes
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Simulate the memory sizes and print the recommendation.
+
+    :type argv: list[str] | None
+    :param argv:
+    :return: exit code, 1 if no memory size meets the target
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="ip_change")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument(
+        "--latency-ms", type=float, default=20.0, help="duration of every API call"
+    )
+    parser.add_argument(
+        "--memory-sizes",
+        type=memory_sizes,
+        default=list(MEMORY_SIZES),
+        help="comma separated memory sizes in MB",
+    )
+    parser.add_argument(
+        "--target-ms", type=float, default=100.0, help="p99 latency to meet"
+    )
+    parser.add_argument(
+        "--architecture", choices=sorted(PRICE_PER_GB_SECOND), default="arm64"
+    )
+    parser.add_argument(
+        "--headroom",
+        type=float,
+        default=0.2,
+        help="memory required on top of the peak resident set size",
+    )
+    parser.add_argument("--json", action="store_true", help="print JSON only")
+    arguments = parser.parse_args(argv)
+
+    # Log and metric records are still created, but not written to the console.
+    root_logger = logging.getLogger()
+    handler = logging.NullHandler()
+    root_logger.addHandler(handler)
+    try:
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            samples = measure(
+                SCENARIOS[arguments.scenario],
+                arguments.iterations,
+                arguments.latency_ms / 1000,
+            )
+    finally:
+        root_logger.removeHandler(handler)
+
+    peak_rss_mb = memory_usage().get("VmHWM", 0) / 1024
+    required_mb = peak_rss_mb * (1 + arguments.headroom)
+    settings = [
+        simulate(samples, memory_mb, arguments.architecture)
+        for memory_mb in arguments.memory_sizes
+    ]
+    recommendation = recommend(settings, arguments.target_ms, required_mb)
+
+    if arguments.json:
+        report = {
+            "scenario": arguments.scenario,
+            "target_ms": arguments.target_ms,
+            "peak_rss_mb": round(peak_rss_mb, 1),
+            "required_mb": round(required_mb, 1),
+            "settings": settings,
+            "recommendation": recommendation,
+        }
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{'memory MB':>9} {'p50 ms':>9} {'p99 ms':>9} {'USD/million':>12}")
+        for setting in settings:
+            print(
+                f"{setting['memory_mb']:9d} {setting['p50_ms']:9.2f} "
+                f"{setting['p99_ms']:9.2f} {setting['cost_per_million_usd']:12.4f}"
+            )
+        print(f"Peak RSS {peak_rss_mb:.1f} MB, at least {required_mb:.1f} MB required")
+        if recommendation is None:
+            print(f"No memory size meets the p99 target of {arguments.target_ms} ms")
+        else:
+            print(f"Recommended memory size: {recommendation['memory_mb']} MB")
+    return 1 if recommendation is None else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
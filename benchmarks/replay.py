@@ -0,0 +1,536 @@
+"""Replay recorded requests against fake Route 53 and Secrets Manager.
+
+Reads function URL events, one JSON object per line, or CloudWatch Logs
+exports whose messages are function URL events, e.g. from
+`aws logs filter-log-events --output json`. The requests are sent to
+lambda_handler with their original inter-arrival times, divided by --speed,
+while --routers multiplies every router:
+
+    python -m benchmarks.replay events.jsonl --speed 60 --routers 10
+
+Requests are spread over simulated execution environments like Lambda does:
+an idle environment is reused, otherwise a new one starts cold. Idle
+environments are reclaimed after --idle-timeout seconds of recorded time. All
+environments share the fakes, so the account wide request rate limits of the
+APIs apply to all of them.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from dataclasses import dataclass, field
+from typing import IO, Any
+
+from aws import lambda_function
+from aws.registry import Registry, use_registry
+from benchmarks.fakes import FakeRoute53, FakeSecretsManager
+from benchmarks.handler import configure, percentile
+
+HOSTED_ZONE_ID: str = "Z0000000000000REPLAY"
+ZONE_NAME: str = "replay.example.com"
+
+
+@dataclass(frozen=True)
+class RecordedRequest:
+    """Function URL event and when it arrived."""
+
+    offset: float
+    event: dict
+
+
+@dataclass
+class Environment:
+    """Registry of one simulated execution environment."""
+
+    registry: Registry
+    last_used: float = 0.0
+    invocations: int = 0
+
+
+@dataclass
+class EnvironmentPool:
+    """Reuse idle execution environments and start new ones like Lambda does."""
+
+    route_53: FakeRoute53
+    secrets_manager: FakeSecretsManager
+    idle_timeout: float
+    client_rate: float | None = None
+    idle: list[Environment] = field(default_factory=list)
+    environments: list[Environment] = field(default_factory=list)
+    busy: int = 0
+    peak: int = 0
+    cold_starts: int = 0
+    reclaimed: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def acquire(self, now: float) -> tuple[Environment, bool]:
+        """Return the most recently used idle environment or start a new one.
+
+        :type now: float
+        :param now: recorded time in seconds
+        :return: environment and True for a cold start
+        """
+        with self._lock:
+            while self.idle and now - self.idle[0].last_used > self.idle_timeout:
+                self.idle.pop(0)
+                self.reclaimed += 1
+            self.busy += 1
+            self.peak = max(self.peak, self.busy)
+            if self.idle:
+                return self.idle.pop(), False
+            self.cold_starts += 1
+        environment = Environment(registry=Registry())
+        with use_registry(environment.registry):
+            environment.registry.set(
+                "route53",
+                lambda_function.create_retrying_client(self.route_53, self.client_rate),
+            )
+            environment.registry.set(
+                "secretsmanager",
+                lambda_function.create_retrying_client(
+                    self.secrets_manager, self.client_rate
+                ),
+            )
+        with self._lock:
+            self.environments.append(environment)
+        return environment, True
+
+    def release(self, environment: Environment, now: float) -> None:
+        """Return an environment to the idle environments.
+
+        :type environment: Environment
+        :param environment:
+        :type now: float
+        :param now: recorded time in seconds
+        :return:
+        """
+        with self._lock:
+            environment.last_used = now
+            environment.invocations += 1
+            self.busy -= 1
+            self.idle.append(environment)
+
+    @property
+    def retries(self) -> int:
+        """Return the retries of all environments.
+
+        :return:
+        """
+        return sum(
+            environment.registry.get("retry_metrics").retries
+            for environment in self.environments
+        )
+
+
+def parse_timestamp(event: dict) -> float | None:
+    """Return the arrival time of a function URL event in seconds.
+
+    :type event: dict
+    :param event:
+    :return:
+    """
+    time_epoch = event.get("requestContext", {}).get("timeEpoch")
+    return None if time_epoch is None else time_epoch / 1000
+
+
+def read_log_events(stream: IO[str]) -> Iterator[tuple[float | None, Any]]:
+    """Read function URL events or CloudWatch Logs events.
+
+    :type stream: IO[str]
+    :param stream:
+    :return: timestamp in seconds and the event or log message
+    """
+    content = stream.read()
+    if content.lstrip().startswith("{") and '"events"' in content[:200]:
+        try:
+            document = json.loads(content)
+        except json.JSONDecodeError:
+            document = None
+        if isinstance(document, dict) and isinstance(document.get("events"), list):
+            for log_event in document["events"]:
+                yield log_event.get("timestamp", 0) / 1000, log_event.get("message")
+            return
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if isinstance(record, dict) and "message" in record and "timestamp" in record:
+            yield record["timestamp"] / 1000, record["message"]
+        else:
+            yield None, record
+
+
+def load_requests(stream: IO[str]) -> tuple[list[RecordedRequest], int]:
+    """Load the recorded requests ordered by arrival.
+
+    Log messages which are no function URL events are skipped. Events without
+    timestamp arrive together with the event before them.
+
+    :type stream: IO[str]
+    :param stream:
+    :return: requests and the number of skipped log messages
+    """
+    requests: list[tuple[float, int, dict]] = []
+    skipped = 0
+    previous = 0.0
+    for timestamp, message in read_log_events(stream):
+        event = message
+        if isinstance(message, str):
+            try:
+                event = json.loads(message)
+            except json.JSONDecodeError:
+                event = None
+        if not isinstance(event, dict) or not (
+            "queryStringParameters" in event or "body" in event
+        ):
+            skipped += 1
+            continue
+        arrival = parse_timestamp(event) or timestamp
+        previous = previous if arrival is None else arrival
+        requests.append((previous, len(requests), event))
+    requests.sort(key=lambda request: request[:2])
+    start = requests[0][0] if requests else 0.0
+    return [
+        RecordedRequest(offset=arrival - start, event=event)
+        for arrival, _, event in requests
+    ], skipped
+
+
+def scale_event(event: dict, copy: int) -> dict:
+    """Turn an event into the event of another router.
+
+    The client id and the domains get a suffix and a prefix per copy.
+
+    :type event: dict
+    :param event:
+    :type copy: int
+    :param copy: 0 returns the event unchanged
+    :return:
+    """
+    if copy == 0:
+        return event
+    event = dict(event)
+    query_parameters = dict(event.get("queryStringParameters") or {})
+    if query_parameters:
+        if "client_id" in query_parameters:
+            query_parameters["client_id"] = f"{query_parameters['client_id']}-{copy}"
+        if "domain" in query_parameters:
+            query_parameters["domain"] = ",".join(
+                f"r{copy}.{domain}" for domain in query_parameters["domain"].split(",")
+            )
+        event["queryStringParameters"] = query_parameters
+    if event.get("body"):
+        try:
+            client_id, token, entries = lambda_function.parse_bulk_request(event)
+        except (KeyError, TypeError, ValueError):
+            return event
+        entries = [
+            {**entry, "domain": f"r{copy}.{entry['domain']}"}
+            if isinstance(entry, dict) and isinstance(entry.get("domain"), str)
+            else entry
+            for entry in entries
+        ]
+        event["body"] = json.dumps(
+            {"client_id": f"{client_id}-{copy}", "token": token, "updates": entries}
+        )
+        event["isBase64Encoded"] = False
+    return event
+
+
+def scale_requests(
+    requests: list[RecordedRequest], routers: int
+) -> list[RecordedRequest]:
+    """Multiply every router of the recording.
+
+    :type requests: list[RecordedRequest]
+    :param requests:
+    :type routers: int
+    :param routers: copies of every router
+    :return:
+    """
+    return [
+        RecordedRequest(offset=request.offset, event=scale_event(request.event, copy))
+        for request in requests
+        for copy in range(routers)
+    ]
+
+
+def recorded_state(
+    requests: Iterable[RecordedRequest],
+) -> tuple[dict[str, str], dict[tuple[str, str], str]]:
+    """Derive the secrets and the records the recording started with.
+
+    Every client is known with the first token it sent, every record exists
+    with the first IP address sent for it.
+
+    :type requests: Iterable[RecordedRequest]
+    :param requests:
+    :return: token per client id and IP address per domain and record type
+    """
+    secrets: dict[str, str] = {}
+    records: dict[tuple[str, str], str] = {}
+    for request in requests:
+        event = request.event
+        query_parameters = event.get("queryStringParameters") or {}
+        try:
+            if event.get("body"):
+                client_id, token, entries = lambda_function.parse_bulk_request(event)
+                updates = []
+                for entry in entries:
+                    try:
+                        updates.append(lambda_function.parse_bulk_entry(entry))
+                    except (KeyError, TypeError, ValueError):
+                        continue
+            else:
+                client_id = query_parameters["client_id"]
+                token = query_parameters["token"]
+                ip_addresses = lambda_function.parse_ip_addresses(
+                    query_parameters, event
+                )
+                updates = [
+                    (domain, record_type, ip)
+                    for domain in query_parameters["domain"].split(",")
+                    for record_type, ip in ip_addresses.items()
+                ]
+        except (KeyError, TypeError, ValueError):
+            continue
+        if isinstance(client_id, str) and isinstance(token, str):
+            secrets.setdefault(client_id, token)
+        for domain, record_type, ip in updates:
+            records.setdefault((domain, record_type), ip)
+    return secrets, records
+
+
+def replay(
+    requests: list[RecordedRequest],
+    speed: float = 1.0,
+    latency: float = 0.0,
+    route_53_rate: float | None = 5.0,
+    secrets_manager_rate: float | None = None,
+    client_rate: float | None = None,
+    max_environments: int = 100,
+    idle_timeout: float = 600.0,
+    zone_size: int = 0,
+) -> dict:
+    """Send the requests to lambda_handler and summarize the replay.
+
+    :type requests: list[RecordedRequest]
+    :param requests:
+    :type speed: float
+    :param speed: factor the recorded inter-arrival times are divided by
+    :type latency: float
+    :param latency: seconds every fake API call takes
+    :type route_53_rate: float | None
+    :param route_53_rate: requests per second before Route 53 throttles
+    :type secrets_manager_rate: float | None
+    :param secrets_manager_rate: requests per second before Secrets Manager
+        throttles
+    :type client_rate: float | None
+    :param client_rate: requests per second of the client side rate limiters
+    :type max_environments: int
+    :param max_environments: concurrent execution environments, further
+        requests wait
+    :type idle_timeout: float
+    :param idle_timeout: recorded seconds until idle environments are reclaimed
+    :type zone_size: int
+    :param zone_size: additional records in the hosted zone
+    :return:
+    """
+    secrets, records = recorded_state(requests)
+    route_53 = FakeRoute53(latency=latency, max_rate=route_53_rate)
+    route_53.add_hosted_zone(HOSTED_ZONE_ID, ZONE_NAME)
+    for index in range(zone_size):
+        route_53.add_record(
+            HOSTED_ZONE_ID, f"static-{index}.{ZONE_NAME}", "A", ["198.51.100.1"]
+        )
+    for (domain, record_type), ip in records.items():
+        route_53.add_record(HOSTED_ZONE_ID, domain, record_type, [ip])
+    secrets_manager = FakeSecretsManager(
+        secrets=secrets, latency=latency, max_rate=secrets_manager_rate
+    )
+    pool = EnvironmentPool(
+        route_53=route_53,
+        secrets_manager=secrets_manager,
+        idle_timeout=idle_timeout,
+        client_rate=client_rate,
+    )
+
+    latencies: list[float] = []
+    cold_latencies: list[float] = []
+    status_codes: Counter[int] = Counter()
+    lag = 0.0
+    lock = threading.Lock()
+    started = time.monotonic()
+
+    def invoke(request: RecordedRequest, scheduled: float) -> None:
+        environment, cold = pool.acquire(request.offset)
+        try:
+            with use_registry(environment.registry):
+                response = lambda_function.lambda_handler(request.event, None)
+        finally:
+            pool.release(environment, request.offset)
+        duration = time.monotonic() - scheduled
+        with lock:
+            latencies.append(duration)
+            if cold:
+                cold_latencies.append(duration)
+            status_codes[response.get("statusCode", 0)] += 1
+
+    with (
+        configure(
+            ROUTE_53_HOSTED_ZONE_ID=HOSTED_ZONE_ID,
+            ROUTE_53_ZONE_DISCOVERY=False,
+            UPDATE_QUEUE_URL="",
+            STATE_STORE="",
+            CREDENTIALS_SECRET_ID="",
+            CLIENT_RATE_LIMIT_STORE="memory",
+        ),
+        ThreadPoolExecutor(
+            max_workers=max_environments, thread_name_prefix="environment"
+        ) as executor,
+    ):
+        for request in requests:
+            scheduled = started + request.offset / speed
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                lag = max(lag, -delay)
+            executor.submit(invoke, request, scheduled)
+    wall_seconds = time.monotonic() - started
+
+    api_calls = route_53.calls + secrets_manager.calls
+    span = requests[-1].offset / speed if requests else 0.0
+    return {
+        "requests": len(requests),
+        "wall_seconds": round(wall_seconds, 3),
+        "offered_rps": round(len(requests) / span, 3) if span > 0 else None,
+        "throughput_rps": (
+            round(len(latencies) / wall_seconds, 3) if wall_seconds > 0 else None
+        ),
+        "latency_ms": summarize_latencies(latencies),
+        "cold_latency_ms": summarize_latencies(cold_latencies),
+        "max_schedule_lag_ms": round(lag * 1000, 3),
+        "status_codes": {
+            str(status_code): count for status_code, count in status_codes.items()
+        },
+        "environments": {
+            "started": pool.cold_starts,
+            "peak_concurrency": pool.peak,
+            "reclaimed": pool.reclaimed,
+        },
+        "api_calls": dict(sorted(api_calls.items())),
+        "api_calls_per_request": (
+            round(sum(api_calls.values()) / len(requests), 3) if requests else 0.0
+        ),
+        "changes_submitted": route_53.calls["change_resource_record_sets"],
+        "throttled": dict(
+            sorted((route_53.throttled + secrets_manager.throttled).items())
+        ),
+        "retries": pool.retries,
+    }
+
+
+def summarize_latencies(latencies: list[float]) -> dict[str, float] | None:
+    """Return the percentiles of the latencies in milliseconds.
+
+    :type latencies: list[float]
+    :param latencies: seconds
+    :return:
+    """
+    if not latencies:
+        return None
+    return {
+        "p50": round(percentile(latencies, 0.5) * 1000, 3),
+        "p90": round(percentile(latencies, 0.9) * 1000, 3),
+        "p99": round(percentile(latencies, 0.99) * 1000, 3),
+        "max": round(max(latencies) * 1000, 3),
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Replay a recording and print the report.
+
+    :type argv: list[str] | None
+    :param argv:
+    :return: exit code
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("file", help="recorded events, - reads from stdin")
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="divide inter-arrival times by this"
+    )
+    parser.add_argument(
+        "--routers", type=int, default=1, help="copies of every recorded router"
+    )
+    parser.add_argument(
+        "--latency-ms", type=float, default=20.0, help="duration of every API call"
+    )
+    parser.add_argument(
+        "--route-53-rate",
+        type=float,
+        default=5.0,
+        help="requests per second before Route 53 throttles, 0 disables",
+    )
+    parser.add_argument(
+        "--secrets-manager-rate",
+        type=float,
+        default=0.0,
+        help="requests per second before Secrets Manager throttles, 0 disables",
+    )
+    parser.add_argument(
+        "--client-rate",
+        type=float,
+        default=None,
+        help="requests per second of the client side rate limiters",
+    )
+    parser.add_argument("--max-environments", type=int, default=100)
+    parser.add_argument("--idle-timeout", type=float, default=600.0)
+    parser.add_argument("--zone-size", type=int, default=0)
+    arguments = parser.parse_args(argv)
+
+    try:
+        if arguments.file == "-":
+            requests, skipped = load_requests(sys.stdin)
+        else:
+            with open(arguments.file, encoding="utf-8") as stream:
+                requests, skipped = load_requests(stream)
+    except (OSError, ValueError) as exc:
+        print(f"Cannot read recording: {exc}", file=sys.stderr)
+        return 2
+    requests = scale_requests(requests, arguments.routers)
+
+    # Log and metric records are still created, but not written to the console.
+    root_logger = logging.getLogger()
+    handler = logging.NullHandler()
+    root_logger.addHandler(handler)
+    try:
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            report = replay(
+                requests,
+                speed=arguments.speed,
+                latency=arguments.latency_ms / 1000,
+                route_53_rate=arguments.route_53_rate or None,
+                secrets_manager_rate=arguments.secrets_manager_rate or None,
+                client_rate=arguments.client_rate,
+                max_environments=arguments.max_environments,
+                idle_timeout=arguments.idle_timeout,
+                zone_size=arguments.zone_size,
+            )
+    finally:
+        root_logger.removeHandler(handler)
+    report["skipped_log_messages"] = skipped
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -28,6 +28,7 @@ module "lambda_function" {
   package_type   = "Image"
   architectures  = ["arm64"]
   timeout        = 5
+  memory_size    = var.memory_size
 
   # Function URL
   create_lambda_function_url = true
@@ -8,3 +8,8 @@ variable "environment_variables" {
   sensitive = false
 }
 
+variable "memory_size" {
+  type      = number
+  sensitive = false
+  default   = 128
+}
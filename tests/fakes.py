@@ -0,0 +1,135 @@
+"""Local stand-ins for AWS services."""
+
+from threading import Lock
+
+from botocore.exceptions import ClientError
+
+
+def client_error(code: str, operation_name: str) -> ClientError:
+    """Build a botocore ClientError.
+
+    :type code: str
+    :param code:
+    :type operation_name: str
+    :param operation_name:
+    :return:
+    """
+    return ClientError({"Error": {"Code": code, "Message": code}}, operation_name)
+
+
+class FakeDynamoDbClient:
+    """In-memory DynamoDB client supporting the operations used by the function.
+
+    Condition expressions are limited to attribute_not_exists() and a
+    comparison of one attribute with one expression value.
+    """
+
+    def __init__(self):
+        """Initialize the tables."""
+        self.tables: dict[str, dict[str, dict]] = {}
+        self._lock = Lock()
+
+    def get_item(self, TableName: str, Key: dict, **kwargs) -> dict:
+        """Return the item for the key.
+
+        :return:
+        """
+        ((_, value),) = Key.items()
+        item = self.tables.get(TableName, {}).get(value["S"])
+        return {} if item is None else {"Item": dict(item)}
+
+    def put_item(
+        self,
+        TableName: str,
+        Item: dict,
+        ConditionExpression: str | None = None,
+        ExpressionAttributeValues: dict | None = None,
+        **kwargs,
+    ) -> dict:
+        """Write the item if the condition is met.
+
+        :return:
+        """
+        with self._lock:
+            table = self.tables.setdefault(TableName, {})
+            key = Item["pk"]["S"]
+            current = table.get(key)
+            if ConditionExpression and not self._matches(
+                ConditionExpression, current, ExpressionAttributeValues or {}
+            ):
+                raise client_error("ConditionalCheckFailedException", "PutItem")
+            table[key] = dict(Item)
+        return {}
+
+    def delete_item(self, TableName: str, Key: dict, **kwargs) -> dict:
+        """Delete the item for the key.
+
+        :return:
+        """
+        ((_, value),) = Key.items()
+        with self._lock:
+            self.tables.get(TableName, {}).pop(value["S"], None)
+        return {}
+
+    @staticmethod
+    def _matches(expression: str, item: dict | None, values: dict) -> bool:
+        conditions = [condition.strip() for condition in expression.split(" OR ")]
+        for condition in conditions:
+            if condition.startswith("attribute_not_exists("):
+                if item is None:
+                    return True
+                continue
+            attribute, operator, placeholder = condition.split()
+            if item is None or attribute not in item:
+                continue
+            current = item[attribute]
+            expected = values[placeholder]
+            if "N" in expected:
+                current, expected = float(current["N"]), float(expected["N"])
+            if operator == "=" and current == expected:
+                return True
+            if operator == "<=" and current <= expected:
+                return True
+            if operator == "<" and current < expected:
+                return True
+        return False
+
+
+class FakeSqsClient:
+    """In-memory SQS client which turns sent messages into Lambda SQS events."""
+
+    def __init__(self):
+        """Initialize the queues."""
+        self.queues: dict[str, list[dict]] = {}
+        self._sequence = 0
+
+    def send_message(self, QueueUrl: str, MessageBody: str, **kwargs) -> dict:
+        """Store the message.
+
+        :return:
+        """
+        self._sequence += 1
+        message_id = f"message-{self._sequence}"
+        self.queues.setdefault(QueueUrl, []).append(
+            {
+                "messageId": message_id,
+                "receiptHandle": f"receipt-{self._sequence}",
+                "body": MessageBody,
+                "attributes": {"SentTimestamp": str(1722882257000 + self._sequence)},
+                "eventSource": "aws:sqs",
+            }
+        )
+        return {"MessageId": message_id}
+
+    def receive_event(self, queue_url: str, max_messages: int = 10) -> dict:
+        """Remove up to max_messages messages and return them as Lambda event.
+
+        :type queue_url: str
+        :param queue_url:
+        :type max_messages: int
+        :param max_messages:
+        :return:
+        """
+        queue = self.queues.get(queue_url, [])
+        records, self.queues[queue_url] = queue[:max_messages], queue[max_messages:]
+        return {"Records": records}
@@ -58,3 +58,4 @@ def test_container(docker_client: DockerClient, docker_image: Image, event: dict
 
         response = requests.post(url, json=event)
         assert response.status_code == 200
+        assert response.json()["statusCode"] == 200
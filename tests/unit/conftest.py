@@ -3,6 +3,18 @@
 import pytest
 from pytest_mock import MockerFixture
 
+from aws.registry import Registry, use_registry
+
+
+@pytest.fixture(scope="function", autouse=True)
+def registry() -> Registry:
+    """Provide an empty registry, so no client or cache leaks between tests.
+
+    :return:
+    """
+    with use_registry(Registry()) as registry:
+        yield registry
+
 
 @pytest.fixture(scope="function")
 def mocked_route_53_client(monkeypatch: pytest.MonkeyPatch, mocker: MockerFixture):
@@ -74,6 +86,14 @@ def route_53_client_response() -> dict:
                 "TTL": 300,
                 "ResourceRecords": [{"Value": "123.134.84.62"}],
             },
+            {
+                "Name": "foo.bar.",
+                "Type": "AAAA",
+                "TTL": 300,
+                "ResourceRecords": [
+                    {"Value": "2001:0db8:0000:0000:0000:0000:0000:0001"}
+                ],
+            },
             {
                 "Name": "boom.bang.",
                 "Type": "A",
@@ -0,0 +1,352 @@
+"""Tests for the authentication of clients."""
+
+import hashlib
+import json
+from unittest.mock import MagicMock
+
+import pytest
+from botocore.exceptions import ClientError
+from pytest_mock import MockerFixture
+
+from aws.auth import (
+    Authenticator,
+    CredentialDocumentAuthenticator,
+    CredentialIndex,
+    tokens_match,
+)
+from aws.cache import TTLCache
+from aws.lambda_function import lambda_handler
+from tests.fakes import client_error
+
+
+@pytest.fixture(scope="function")
+def get_token(mocker: MockerFixture) -> MagicMock:
+    """Provide a token lookup which knows one client.
+
+    :type mocker: MockerFixture
+    :param mocker:
+    :return:
+    """
+
+    def token_of(client_id: str) -> str:
+        if client_id != "client":
+            raise client_error("ResourceNotFoundException", "GetSecretValue")
+        return "token"
+
+    return mocker.MagicMock(side_effect=token_of)
+
+
+@pytest.fixture(scope="function")
+def authenticator(get_token: MagicMock) -> Authenticator:
+    """Provide an authenticator with empty caches.
+
+    :type get_token: MagicMock
+    :param get_token:
+    :return:
+    """
+    return Authenticator(
+        get_token=get_token,
+        verified_tokens=TTLCache(max_size=10, max_age=60),
+        unknown_clients=TTLCache(max_size=10, max_age=60),
+    )
+
+
+def test_authenticate_caches_verified_token(
+    authenticator: Authenticator, get_token: MagicMock
+) -> None:
+    """Test that a verified token is not looked up again.
+
+    :type authenticator: Authenticator
+    :param authenticator:
+    :type get_token: MagicMock
+    :param get_token:
+    :return:
+    """
+    assert not authenticator.is_verified("client", "token")
+    assert authenticator.authenticate("client", "token")
+    assert authenticator.is_verified("client", "token")
+    assert not authenticator.is_verified("client", "other")
+    assert authenticator.authenticate("client", "token")
+
+    get_token.assert_called_once_with("client")
+
+
+def test_authenticate_invalid_token(
+    authenticator: Authenticator, get_token: MagicMock
+) -> None:
+    """Test that an invalid token is rejected every time.
+
+    :type authenticator: Authenticator
+    :param authenticator:
+    :type get_token: MagicMock
+    :param get_token:
+    :return:
+    """
+    assert authenticator.authenticate("client", "token")
+    assert not authenticator.authenticate("client", "invalid")
+    assert not authenticator.authenticate("client", "invalid")
+
+    assert get_token.call_count == 3
+
+
+def test_authenticate_caches_unknown_client(
+    authenticator: Authenticator, get_token: MagicMock
+) -> None:
+    """Test that unknown clients are rejected without looking them up again.
+
+    :type authenticator: Authenticator
+    :param authenticator:
+    :type get_token: MagicMock
+    :param get_token:
+    :return:
+    """
+    assert not authenticator.rejects("scanner")
+    assert not authenticator.authenticate("scanner", "token")
+    assert authenticator.rejects("scanner")
+    assert not authenticator.authenticate("scanner", "token")
+
+    get_token.assert_called_once_with("scanner")
+    assert authenticator.rejects("client id")
+    assert not authenticator.rejects("client")
+    assert not authenticator.rejects(
+        "arn:aws:secretsmanager:eu-central-1:123456789012:secret:router-AbCdEf"
+    )
+
+
+@pytest.mark.parametrize("client_id", ["", "a" * 2049, "client id", "client\n", None])
+def test_authenticate_invalid_client_id(
+    authenticator: Authenticator, get_token: MagicMock, client_id: str
+) -> None:
+    """Test that client ids which cannot be secret names are not looked up.
+
+    :type authenticator: Authenticator
+    :param authenticator:
+    :type get_token: MagicMock
+    :param get_token:
+    :type client_id: str
+    :param client_id:
+    :return:
+    """
+    assert not authenticator.authenticate(client_id, "token")
+
+    get_token.assert_not_called()
+
+
+def test_authenticate_raises_other_errors(
+    authenticator: Authenticator, get_token: MagicMock
+) -> None:
+    """Test that errors other than unknown secrets are not hidden.
+
+    :type authenticator: Authenticator
+    :param authenticator:
+    :type get_token: MagicMock
+    :param get_token:
+    :return:
+    """
+    get_token.side_effect = client_error("ThrottlingException", "GetSecretValue")
+
+    with pytest.raises(ClientError):
+        authenticator.authenticate("client", "token")
+
+
+@pytest.mark.parametrize(
+    "token,expected_token,expected",
+    [
+        ("token", "token", True),
+        ("token", "other", False),
+        ("token", None, False),
+        ("tökén", "tökén", True),
+    ],
+)
+def test_tokens_match(token: str, expected_token: str, expected: bool) -> None:
+    """Test the comparison of tokens.
+
+    :type token: str
+    :param token:
+    :type expected_token: str
+    :param expected_token:
+    :type expected: bool
+    :param expected:
+    :return:
+    """
+    assert tokens_match(token, expected_token) is expected
+
+
+def test_lambda_handler_unknown_client(
+    mocked_route_53_client: MagicMock, mocked_secrets_manager_cache: MagicMock
+) -> None:
+    """Test that unknown clients get 401 and are only looked up once.
+
+    :type mocked_route_53_client: MagicMock
+    :param mocked_route_53_client:
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :return:
+    """
+    mocked_secrets_manager_cache.get_secret_string.side_effect = client_error(
+        "ResourceNotFoundException", "GetSecretValue"
+    )
+    event: dict = {
+        "queryStringParameters": {
+            "client_id": "unknown",
+            "domain": "test_domain",
+            "ip": "127.0.0.1",
+            "token": "token",
+        }
+    }
+
+    first_response: dict = lambda_handler(event, {})
+    second_response: dict = lambda_handler(event, {})
+
+    assert first_response["statusCode"] == 401
+    assert second_response["statusCode"] == 401
+    mocked_secrets_manager_cache.get_secret_string.assert_called_once_with("unknown")
+    mocked_route_53_client.list_resource_record_sets.assert_not_called()
+
+
+def credential_document(clients: dict[str, tuple[str, list[str]]]) -> str:
+    """Build a credential document.
+
+    :type clients: dict[str, tuple[str, list[str]]]
+    :param clients: token and domain patterns per client id
+    :return:
+    """
+    return json.dumps(
+        {
+            "clients": {
+                client_id: {
+                    "token_sha256": hashlib.sha256(token.encode()).hexdigest(),
+                    "domains": domains,
+                }
+                for client_id, (token, domains) in clients.items()
+            }
+        }
+    )
+
+
+@pytest.mark.parametrize(
+    "domain,expected",
+    [
+        ("home.example.com", True),
+        ("HOME.example.com.", True),
+        ("office.example.com", False),
+        ("a.site.example.com", True),
+        ("a.b.site.example.com", True),
+        ("site.example.com", False),
+        ("example.com", False),
+    ],
+)
+def test_credential_index_authorize(domain: str, expected: bool) -> None:
+    """Test matching domains against the domain patterns of a client.
+
+    :type domain: str
+    :param domain:
+    :type expected: bool
+    :param expected:
+    :return:
+    """
+    index = CredentialIndex.from_document(
+        credential_document(
+            {
+                "router": ("token", ["home.example.com", "*.site.example.com"]),
+                "admin": ("token", ["*"]),
+            }
+        )
+    )
+
+    assert index.authorize("router", domain) is expected
+    assert index.authorize("admin", domain)
+    assert not index.authorize("unknown", domain)
+
+
+@pytest.mark.parametrize(
+    "document",
+    [
+        "not json",
+        "[]",
+        '{"clients": []}',
+        '{"clients": {"router": {"domains": []}}}',
+        '{"clients": {"router": {"token_sha256": "xyz"}}}',
+    ],
+)
+def test_credential_index_invalid_document(document: str) -> None:
+    """Test that invalid documents raise a ValueError.
+
+    :type document: str
+    :param document:
+    :return:
+    """
+    with pytest.raises(ValueError):
+        CredentialIndex.from_document(document)
+
+
+def test_credential_document_authenticator_compiles_changed_document(
+    mocker: MockerFixture,
+) -> None:
+    """Test that the document is only compiled again after it changed.
+
+    :type mocker: MockerFixture
+    :param mocker:
+    :return:
+    """
+    first = credential_document({"router": ("token", ["home.example.com"])})
+    second = credential_document({"router": ("rotated", ["home.example.com"])})
+    get_document = mocker.MagicMock(return_value=first)
+    from_document = mocker.spy(CredentialIndex, "from_document")
+    authenticator = CredentialDocumentAuthenticator(get_document)
+
+    assert authenticator.authenticate("router", "token")
+    assert not authenticator.authenticate("router", "invalid")
+    assert not authenticator.authenticate("unknown", "token")
+    assert authenticator.authorize("router", "home.example.com")
+    assert authenticator.rejects("unknown")
+    assert not authenticator.rejects("router")
+    assert from_document.call_count == 1
+
+    get_document.return_value = second
+
+    assert not authenticator.authenticate("router", "token")
+    assert authenticator.authenticate("router", "rotated")
+    assert from_document.call_count == 2
+
+
+def test_lambda_handler_credential_document(
+    mocked_route_53_client: MagicMock,
+    mocked_secrets_manager_cache: MagicMock,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Test that clients of the credential document may only update their domains.
+
+    :type mocked_route_53_client: MagicMock
+    :param mocked_route_53_client:
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :type monkeypatch: pytest.MonkeyPatch
+    :param monkeypatch:
+    :return:
+    """
+    monkeypatch.setattr("aws.lambda_function.CREDENTIALS_SECRET_ID", "credentials")
+    mocked_secrets_manager_cache.get_secret_string.return_value = credential_document(
+        {"router": ("token", ["test_domain"])}
+    )
+    mocked_route_53_client.list_resource_record_sets.return_value = {
+        "ResourceRecordSets": [],
+        "IsTruncated": False,
+    }
+
+    def request(domain: str, token: str = "token") -> dict:
+        event = {
+            "queryStringParameters": {
+                "client_id": "router",
+                "domain": domain,
+                "ip": "127.0.0.1",
+                "token": token,
+            }
+        }
+        return lambda_handler(event, {})
+
+    assert request("test_domain", token="invalid")["statusCode"] == 401
+    assert request("test_domain,other_domain")["statusCode"] == 403
+    mocked_route_53_client.list_resource_record_sets.assert_not_called()
+    assert request("test_domain")["statusCode"] == 200
+    mocked_secrets_manager_cache.get_secret_string.assert_called_with("credentials")
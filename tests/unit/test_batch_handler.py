@@ -0,0 +1,207 @@
+"""Tests for the queued update mode and batch_handler function."""
+
+from unittest.mock import MagicMock
+
+import pytest
+from botocore.exceptions import ClientError
+
+from aws.lambda_function import batch_handler, lambda_handler
+from aws.registry import Registry
+from aws.state import MemoryStateStore
+from tests.fakes import FakeSqsClient
+
+QUEUE_URL = "https://sqs.eu-central-1.amazonaws.com/123456789012/updates"
+
+
+@pytest.fixture(scope="function")
+def sqs_client(registry: Registry, monkeypatch: pytest.MonkeyPatch) -> FakeSqsClient:
+    """Provide a fake SQS client and enable the queued update mode.
+
+    :type registry: Registry
+    :param registry:
+    :type monkeypatch: pytest.MonkeyPatch
+    :param monkeypatch:
+    :return:
+    """
+    monkeypatch.setattr("aws.lambda_function.UPDATE_QUEUE_URL", QUEUE_URL)
+    client = FakeSqsClient()
+    registry.set("sqs", client)
+    return client
+
+
+def send_update(domain: str, ip: str) -> dict:
+    """Send an update to the function URL handler.
+
+    :type domain: str
+    :param domain:
+    :type ip: str
+    :param ip:
+    :return:
+    """
+    event: dict = {
+        "queryStringParameters": {
+            "client_id": "client",
+            "domain": domain,
+            "ip": ip,
+            "token": "token",
+        }
+    }
+    return lambda_handler(event, {})
+
+
+def test_lambda_handler_enqueues_update(
+    mocked_route_53_client: MagicMock,
+    mocked_secrets_manager_cache: MagicMock,
+    sqs_client: FakeSqsClient,
+) -> None:
+    """Test that the function URL handler only enqueues the update.
+
+    :type mocked_route_53_client: MagicMock
+    :param mocked_route_53_client:
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :type sqs_client: FakeSqsClient
+    :param sqs_client:
+    :return:
+    """
+    mocked_secrets_manager_cache.get_secret_string.return_value = "token"
+
+    response: dict = send_update("foo.bar", "123.45.67.89")
+
+    assert response["statusCode"] == 202
+    assert len(sqs_client.queues[QUEUE_URL]) == 1
+    mocked_route_53_client.list_resource_record_sets.assert_not_called()
+    mocked_route_53_client.change_resource_record_sets.assert_not_called()
+
+
+def test_lambda_handler_skips_updates_published_by_batch_handler(
+    mocked_route_53_client: MagicMock,
+    mocked_secrets_manager_cache: MagicMock,
+    route_53_client_response: dict,
+    registry: Registry,
+    sqs_client: FakeSqsClient,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Test that no-op updates are not queued once the batch handler wrote them.
+
+    :type mocked_route_53_client: MagicMock
+    :param mocked_route_53_client:
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :type route_53_client_response: dict
+    :param route_53_client_response:
+    :type registry: Registry
+    :param registry:
+    :type sqs_client: FakeSqsClient
+    :param sqs_client:
+    :type monkeypatch: pytest.MonkeyPatch
+    :param monkeypatch:
+    :return:
+    """
+    monkeypatch.setattr("aws.lambda_function.ROUTE_53_HOSTED_ZONE_ID", "ZONE")
+    mocked_secrets_manager_cache.get_secret_string.return_value = "token"
+    mocked_route_53_client.list_resource_record_sets.return_value = (
+        route_53_client_response
+    )
+    registry.set("state_store", MemoryStateStore())
+
+    assert send_update("foo.bar", "1.1.1.1")["statusCode"] == 202
+    assert batch_handler(sqs_client.receive_event(QUEUE_URL), {}) == {
+        "batchItemFailures": []
+    }
+    mocked_route_53_client.change_resource_record_sets.assert_called_once()
+
+    # The function URL runs in another execution environment
+    registry.reset("published_ips")
+    assert send_update("foo.bar", "1.1.1.1")["statusCode"] == 200
+    assert send_update("foo.bar", "2.2.2.2")["statusCode"] == 202
+    assert len(sqs_client.queues[QUEUE_URL]) == 1
+
+
+def test_batch_handler_coalesces_updates(
+    mocked_route_53_client: MagicMock,
+    mocked_secrets_manager_cache: MagicMock,
+    route_53_client_response: dict,
+    sqs_client: FakeSqsClient,
+) -> None:
+    """Test that a burst of updates results in one change batch.
+
+    :type mocked_route_53_client: MagicMock
+    :param mocked_route_53_client:
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :type route_53_client_response: dict
+    :param route_53_client_response:
+    :type sqs_client: FakeSqsClient
+    :param sqs_client:
+    :return:
+    """
+    mocked_secrets_manager_cache.get_secret_string.return_value = "token"
+    mocked_route_53_client.list_resource_record_sets.return_value = (
+        route_53_client_response
+    )
+    send_update("foo.bar", "1.1.1.1")
+    send_update("boom.bang", "231.134.85.63")
+    send_update("foo.bar,cling.clang", "2.2.2.2")
+    send_update("Foo.Bar", "3.3.3.3")
+    event = sqs_client.receive_event(QUEUE_URL)
+    # SQS does not guarantee the order, the sent timestamp does
+    event["Records"].reverse()
+    event["Records"].append(
+        {
+            "messageId": "invalid",
+            "body": "not json",
+            "attributes": {"SentTimestamp": "0"},
+        }
+    )
+
+    response: dict = batch_handler(event, {})
+
+    assert response == {"batchItemFailures": [{"itemIdentifier": "invalid"}]}
+    mocked_route_53_client.list_resource_record_sets.assert_called_once()
+    mocked_route_53_client.change_resource_record_sets.assert_called_once()
+    changes = mocked_route_53_client.change_resource_record_sets.call_args.kwargs[
+        "ChangeBatch"
+    ]["Changes"]
+    assert sorted(
+        (
+            change["ResourceRecordSet"]["Name"],
+            change["ResourceRecordSet"]["ResourceRecords"][0]["Value"],
+        )
+        for change in changes
+    ) == [("cling.clang", "2.2.2.2"), ("foo.bar", "3.3.3.3")]
+
+
+def test_batch_handler_reports_failed_messages(
+    mocked_route_53_client: MagicMock,
+    mocked_secrets_manager_cache: MagicMock,
+    route_53_client_response: dict,
+    sqs_client: FakeSqsClient,
+) -> None:
+    """Test that messages of a failed change batch are reported.
+
+    :type mocked_route_53_client: MagicMock
+    :param mocked_route_53_client:
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :type route_53_client_response: dict
+    :param route_53_client_response:
+    :type sqs_client: FakeSqsClient
+    :param sqs_client:
+    :return:
+    """
+    mocked_secrets_manager_cache.get_secret_string.return_value = "token"
+    mocked_route_53_client.list_resource_record_sets.return_value = (
+        route_53_client_response
+    )
+    mocked_route_53_client.change_resource_record_sets.side_effect = ClientError(
+        {"Error": {"Code": "InvalidChangeBatch", "Message": "Invalid"}},
+        "ChangeResourceRecordSets",
+    )
+    send_update("boom.bang", "231.134.85.63")
+    send_update("foo.bar", "1.1.1.1")
+    event = sqs_client.receive_event(QUEUE_URL)
+
+    response: dict = batch_handler(event, {})
+
+    assert response == {"batchItemFailures": [{"itemIdentifier": "message-2"}]}
@@ -0,0 +1,209 @@
+"""Tests for the handler benchmark and its fake AWS backends."""
+
+import io
+import json
+
+import pytest
+from botocore.exceptions import ClientError
+
+from aws.zone import load_zone_snapshot
+from benchmarks.fakes import FakeRoute53, FakeSecretsManager
+from benchmarks.handler import SCENARIOS, check_regressions, run_scenario
+from benchmarks.memory_size import measure, recommend, simulate
+from benchmarks.replay import load_requests, replay, scale_requests
+
+
+def test_fake_route_53_pagination() -> None:
+    """Test that paging through a fake hosted zone returns every record set.
+
+    :return:
+    """
+    route_53 = FakeRoute53(page_size=2)
+    route_53.add_hosted_zone("ZONE", "example.com")
+    for index in range(5):
+        route_53.add_record("ZONE", f"host-{index}.example.com", "A", ["192.0.2.1"])
+    route_53.add_record("ZONE", "host-0.example.com", "AAAA", ["2001:db8::1"])
+
+    snapshot = load_zone_snapshot(route_53, "ZONE")
+
+    assert route_53.calls["list_resource_record_sets"] == 3
+    assert len(snapshot.record_sets) == 6
+    assert snapshot.values("host-0.example.com", "AAAA") == ["2001:db8::1"]
+
+
+def test_fake_route_53_throttling() -> None:
+    """Test that the fake throttles calls above its maximum rate.
+
+    :return:
+    """
+    route_53 = FakeRoute53(max_rate=1)
+    route_53.add_hosted_zone("ZONE", "example.com")
+
+    route_53.list_resource_record_sets(HostedZoneId="ZONE")
+    with pytest.raises(ClientError) as exc_info:
+        route_53.list_resource_record_sets(HostedZoneId="ZONE")
+
+    assert exc_info.value.response["Error"]["Code"] == "Throttling"
+    assert route_53.throttled["list_resource_record_sets"] == 1
+
+
+def test_fake_secrets_manager_unknown_secret() -> None:
+    """Test that unknown secrets are reported like Secrets Manager does.
+
+    :return:
+    """
+    secrets_manager = FakeSecretsManager(secrets={"known": "secret"})
+
+    with pytest.raises(ClientError) as exc_info:
+        secrets_manager.describe_secret(SecretId="unknown")
+
+    assert exc_info.value.response["Error"]["Code"] == "ResourceNotFoundException"
+
+
+@pytest.mark.parametrize(
+    "scenario,expected_api_calls",
+    [("warm_noop", 0), ("cold_noop", 3)],
+)
+def test_run_scenario(scenario: str, expected_api_calls: int) -> None:
+    """Test the API calls per invocation of the scenarios without IP change.
+
+    :type scenario: str
+    :param scenario:
+    :type expected_api_calls: int
+    :param expected_api_calls:
+    :return:
+    """
+    result = run_scenario(SCENARIOS[scenario], iterations=5, allocation_iterations=2)
+
+    assert result["status_codes"] == {"200": 5}
+    assert result["api_calls_per_invocation"] == expected_api_calls
+    assert check_regressions({scenario: result}) == []
+
+
+def test_check_regressions() -> None:
+    """Test that exceeding the API call budget and the baseline is reported.
+
+    :return:
+    """
+    result = {
+        "p50_ms": 2.0,
+        "p90_ms": 10.0,
+        "api_calls_per_invocation": 1.0,
+        "peak_kib": 10.0,
+        "status_codes": {"200": 10},
+    }
+    baseline = {
+        "warm_noop": {
+            "p50_ms": 1.8,
+            "p90_ms": 5.0,
+            "api_calls_per_invocation": 0.0,
+            "peak_kib": 10.0,
+        }
+    }
+
+    regressions = check_regressions({"warm_noop": result}, baseline, tolerance=0.25)
+
+    assert regressions == [
+        "warm_noop: 1.0 API calls per invocation exceed the budget of 0",
+        "warm_noop: p90_ms regressed from 5.0 to 10.0",
+        "warm_noop: api_calls_per_invocation regressed from 0.0 to 1.0",
+    ]
+
+
+def function_url_event(time_epoch: int, domain: str, ip: str) -> dict:
+    """Build a recorded function URL event.
+
+    :type time_epoch: int
+    :param time_epoch: milliseconds
+    :type domain: str
+    :param domain:
+    :type ip: str
+    :param ip:
+    :return:
+    """
+    return {
+        "queryStringParameters": {
+            "domain": domain,
+            "ip": ip,
+            "client_id": "router",
+            "token": "secret",
+        },
+        "requestContext": {"timeEpoch": time_epoch},
+    }
+
+
+def test_load_requests_cloudwatch_export() -> None:
+    """Test that CloudWatch Logs exports are ordered and other messages skipped.
+
+    :return:
+    """
+    document = {
+        "events": [
+            {
+                "timestamp": 2000,
+                "message": json.dumps(
+                    function_url_event(1500, "a.example.com", "192.0.2.2")
+                ),
+            },
+            {"timestamp": 1100, "message": "START RequestId: 1"},
+            {
+                "timestamp": 1000,
+                "message": json.dumps(
+                    function_url_event(1000, "a.example.com", "192.0.2.1")
+                ),
+            },
+        ]
+    }
+
+    requests, skipped = load_requests(io.StringIO(json.dumps(document)))
+
+    assert skipped == 1
+    assert [request.offset for request in requests] == [0.0, 0.5]
+    assert requests[0].event["queryStringParameters"]["ip"] == "192.0.2.1"
+
+
+def test_replay() -> None:
+    """Test that a scaled recording is replayed over shared fakes.
+
+    :return:
+    """
+    events = [
+        function_url_event(0, "a.example.com", "192.0.2.1"),
+        function_url_event(10, "a.example.com", "192.0.2.1"),
+        function_url_event(20, "a.example.com", "192.0.2.2"),
+    ]
+    recording = io.StringIO("".join(json.dumps(event) + "\n" for event in events))
+    requests = scale_requests(load_requests(recording)[0], routers=2)
+
+    report = replay(requests, speed=100, route_53_rate=None, max_environments=1)
+
+    assert report["requests"] == 6
+    assert report["status_codes"] == {"200": 6}
+    assert report["environments"]["started"] == 1
+    assert report["changes_submitted"] == 2
+    assert {
+        request.event["queryStringParameters"]["domain"] for request in requests
+    } == {"a.example.com", "r1.a.example.com"}
+    assert report["latency_ms"]["p50"] <= report["latency_ms"]["max"]
+
+
+def test_memory_size_recommendation() -> None:
+    """Test that the cheapest memory size meeting the latency target is picked.
+
+    :return:
+    """
+    # 10ms waiting for APIs and 40ms CPU time at a full vCPU
+    samples = [(0.05, 0.04)] * 10
+    settings = [simulate(samples, memory_mb) for memory_mb in (128, 256, 1024, 1769)]
+
+    assert [setting["p99_ms"] for setting in settings] == pytest.approx(
+        [562.81, 286.41, 79.1, 50.0], abs=0.01
+    )
+    assert recommend(settings, target_ms=100)["memory_mb"] == 1024
+    assert recommend(settings, target_ms=1000)["memory_mb"] == 128
+    assert recommend(settings, target_ms=1000, required_mb=200)["memory_mb"] == 256
+    assert recommend(settings, target_ms=10) is None
+
+    measured = measure(SCENARIOS["warm_noop"], iterations=5, latency=0.0)
+    assert len(measured) == 5
+    assert all(0 <= cpu <= wall for wall, cpu in measured)
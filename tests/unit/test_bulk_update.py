@@ -0,0 +1,277 @@
+"""Tests for bulk updates with a JSON body."""
+
+import base64
+import hashlib
+import json
+from unittest.mock import MagicMock
+
+import pytest
+from botocore.exceptions import ClientError
+
+from aws.lambda_function import lambda_handler
+from aws.registry import Registry
+from benchmarks.fakes import FakeRoute53
+
+HOSTED_ZONE_ID = "ZONE"
+
+
+@pytest.fixture(scope="function")
+def route_53(registry: Registry, monkeypatch: pytest.MonkeyPatch) -> FakeRoute53:
+    """Provide a fake Route 53 with one hosted zone.
+
+    :type registry: Registry
+    :param registry:
+    :type monkeypatch: pytest.MonkeyPatch
+    :param monkeypatch:
+    :return:
+    """
+    monkeypatch.setattr("aws.lambda_function.ROUTE_53_HOSTED_ZONE_ID", HOSTED_ZONE_ID)
+    route_53 = FakeRoute53()
+    route_53.add_hosted_zone(HOSTED_ZONE_ID, "example.com")
+    route_53.add_record(HOSTED_ZONE_ID, "a.example.com", "A", ["192.0.2.1"])
+    route_53.add_record(HOSTED_ZONE_ID, "b.example.com", "A", ["192.0.2.2"])
+    registry.set("route53", route_53)
+    return route_53
+
+
+def bulk_event(body: dict, base64_encoded: bool = False) -> dict:
+    """Build a function URL event for a POST request.
+
+    :type body: dict
+    :param body:
+    :type base64_encoded: bool
+    :param base64_encoded:
+    :return:
+    """
+    encoded_body = json.dumps(body)
+    if base64_encoded:
+        encoded_body = base64.b64encode(encoded_body.encode()).decode()
+    return {
+        "requestContext": {"http": {"method": "POST"}},
+        "body": encoded_body,
+        "isBase64Encoded": base64_encoded,
+    }
+
+
+@pytest.fixture(scope="function")
+def secrets_manager_cache(mocked_secrets_manager_cache: MagicMock) -> MagicMock:
+    """Provide the secrets manager cache with the token of the client.
+
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :return:
+    """
+    mocked_secrets_manager_cache.get_secret_string.return_value = "token"
+    return mocked_secrets_manager_cache
+
+
+@pytest.mark.parametrize("base64_encoded", [False, True])
+def test_bulk_update(
+    route_53: FakeRoute53, secrets_manager_cache: MagicMock, base64_encoded: bool
+) -> None:
+    """Test that valid entries are applied and every entry gets a result.
+
+    :type route_53: FakeRoute53
+    :param route_53:
+    :type secrets_manager_cache: MagicMock
+    :param secrets_manager_cache:
+    :type base64_encoded: bool
+    :param base64_encoded:
+    :return:
+    """
+    event = bulk_event(
+        {
+            "client_id": "controller",
+            "token": "token",
+            "updates": [
+                {"domain": "a.example.com", "ip": "192.0.2.1"},
+                {"domain": "B.example.com.", "ip": "198.51.100.2"},
+                {"domain": "a.example.com", "ip": "2001:db8::1", "type": "AAAA"},
+                {"domain": "c.example.com", "ip": "not an ip"},
+                {"domain": "c.example.com", "ip": "192.0.2.3", "type": "AAAA"},
+                {"domain": "b.example.com", "ip": "198.51.100.3"},
+                "b.example.com",
+            ],
+        },
+        base64_encoded,
+    )
+
+    response: dict = lambda_handler(event, {})
+
+    assert response["statusCode"] == 207
+    results = json.loads(response["body"])["results"]
+    assert [result["status"] for result in results] == [
+        "unchanged",
+        "updated",
+        "updated",
+        "invalid",
+        "invalid",
+        "invalid",
+        "invalid",
+    ]
+    assert results[1]["change_id"] == results[2]["change_id"]
+    assert results[3]["error"] == "Invalid IP address"
+    assert results[5]["error"] == "Duplicate entry"
+    secrets_manager_cache.get_secret_string.assert_called_once_with("controller")
+    assert route_53.calls == {
+        "list_resource_record_sets": 1,
+        "change_resource_record_sets": 1,
+    }
+    records = route_53.record_sets[HOSTED_ZONE_ID]
+    assert records[("b.example.com.", "A")]["ResourceRecords"] == [
+        {"Value": "198.51.100.2"}
+    ]
+    assert ("a.example.com.", "AAAA") in records
+
+
+def test_bulk_update_chunks_change_batches(
+    route_53: FakeRoute53, secrets_manager_cache: MagicMock
+) -> None:
+    """Test that many updates are split into change batches within the limits.
+
+    :type route_53: FakeRoute53
+    :param route_53:
+    :type secrets_manager_cache: MagicMock
+    :param secrets_manager_cache:
+    :return:
+    """
+    updates = [
+        {"domain": f"host-{index}.example.com", "ip": "203.0.113.1"}
+        for index in range(600)
+    ]
+    event = bulk_event(
+        {"client_id": "controller", "token": "token", "updates": updates}
+    )
+
+    response: dict = lambda_handler(event, {})
+
+    assert response["statusCode"] == 200
+    results = json.loads(response["body"])["results"]
+    assert {result["status"] for result in results} == {"updated"}
+    assert len({result["change_id"] for result in results}) == 2
+    assert route_53.calls["change_resource_record_sets"] == 2
+
+    response = lambda_handler(event, {})
+
+    assert response["statusCode"] == 200
+    results = json.loads(response["body"])["results"]
+    assert {result["status"] for result in results} == {"unchanged"}
+    assert route_53.calls["change_resource_record_sets"] == 2
+
+
+def test_bulk_update_reports_failed_change_batch(
+    mocked_route_53_client: MagicMock, secrets_manager_cache: MagicMock
+) -> None:
+    """Test that entries of a failed change batch are reported as failed.
+
+    :type mocked_route_53_client: MagicMock
+    :param mocked_route_53_client:
+    :type secrets_manager_cache: MagicMock
+    :param secrets_manager_cache:
+    :return:
+    """
+    mocked_route_53_client.list_resource_record_sets.return_value = {
+        "ResourceRecordSets": [],
+        "IsTruncated": False,
+    }
+    mocked_route_53_client.change_resource_record_sets.side_effect = ClientError(
+        {"Error": {"Code": "InvalidChangeBatch"}}, "ChangeResourceRecordSets"
+    )
+    event = bulk_event(
+        {
+            "client_id": "controller",
+            "token": "token",
+            "updates": [{"domain": "a.example.com", "ip": "192.0.2.1"}],
+        }
+    )
+
+    response: dict = lambda_handler(event, {})
+
+    assert response["statusCode"] == 207
+    assert json.loads(response["body"])["results"] == [
+        {
+            "domain": "a.example.com",
+            "ip": "192.0.2.1",
+            "type": "A",
+            "status": "failed",
+            "error": "InvalidChangeBatch",
+        }
+    ]
+
+
+@pytest.mark.parametrize(
+    "body,status_code",
+    [
+        ({"client_id": "controller", "token": "invalid", "updates": []}, 401),
+        ({"client_id": "controller", "updates": []}, 400),
+        ({"client_id": "controller", "token": "token", "updates": {}}, 400),
+        (["controller", "token"], 400),
+    ],
+)
+def test_bulk_update_invalid_request(
+    route_53: FakeRoute53,
+    secrets_manager_cache: MagicMock,
+    body: dict,
+    status_code: int,
+) -> None:
+    """Test that invalid requests are rejected before Route 53 is called.
+
+    :type route_53: FakeRoute53
+    :param route_53:
+    :type secrets_manager_cache: MagicMock
+    :param secrets_manager_cache:
+    :type body: dict
+    :param body:
+    :type status_code: int
+    :param status_code:
+    :return:
+    """
+    response: dict = lambda_handler(bulk_event(body), {})
+
+    assert response["statusCode"] == status_code
+    assert route_53.total_calls == 0
+
+
+def test_bulk_update_forbidden_domains(
+    route_53: FakeRoute53,
+    mocked_secrets_manager_cache: MagicMock,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Test that entries for domains the client may not update are forbidden.
+
+    :type route_53: FakeRoute53
+    :param route_53:
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :type monkeypatch: pytest.MonkeyPatch
+    :param monkeypatch:
+    :return:
+    """
+    monkeypatch.setattr("aws.lambda_function.CREDENTIALS_SECRET_ID", "credentials")
+    mocked_secrets_manager_cache.get_secret_string.return_value = json.dumps(
+        {
+            "clients": {
+                "controller": {
+                    "token_sha256": hashlib.sha256(b"token").hexdigest(),
+                    "domains": ["*.example.com"],
+                }
+            }
+        }
+    )
+    event = bulk_event(
+        {
+            "client_id": "controller",
+            "token": "token",
+            "updates": [
+                {"domain": "b.example.com", "ip": "198.51.100.2"},
+                {"domain": "example.com", "ip": "198.51.100.2"},
+            ],
+        }
+    )
+
+    response: dict = lambda_handler(event, {})
+
+    assert response["statusCode"] == 207
+    results = json.loads(response["body"])["results"]
+    assert [result["status"] for result in results] == ["updated", "forbidden"]
+    assert ("example.com.", "A") not in route_53.record_sets[HOSTED_ZONE_ID]
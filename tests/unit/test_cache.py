@@ -0,0 +1,68 @@
+"""Tests for in-memory caches."""
+
+from pytest_mock import MockerFixture
+
+from aws.cache import TTLCache
+
+
+def test_ttl_cache_get_and_set() -> None:
+    """Test storing and retrieving values.
+
+    :return:
+    """
+    cache = TTLCache(max_size=2, max_age=60)
+    cache.set("a", 1)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("b", 2) == 2
+    assert cache.pop("a") == 1
+    assert cache.get("a") is None
+
+
+def test_ttl_cache_lru_eviction() -> None:
+    """Test that the least recently used entry is evicted.
+
+    :return:
+    """
+    cache = TTLCache(max_size=2, max_age=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert len(cache) == 2
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+
+def test_ttl_cache_max_age(mocker: MockerFixture) -> None:
+    """Test that entries expire after their maximum age.
+
+    :type mocker: MockerFixture
+    :param mocker:
+    :return:
+    """
+    monotonic = mocker.patch("aws.cache.monotonic", return_value=100.0)
+    cache = TTLCache(max_size=2, max_age=60)
+    cache.set("a", 1)
+    cache.set("b", 2, max_age=10)
+
+    monotonic.return_value = 115.0
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+
+    monotonic.return_value = 160.0
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_ttl_cache_disabled() -> None:
+    """Test that a cache without size or age stores nothing.
+
+    :return:
+    """
+    for cache in (TTLCache(max_size=0, max_age=60), TTLCache(max_size=2, max_age=0)):
+        cache.set("a", 1)
+        assert cache.get("a") is None
@@ -0,0 +1,59 @@
+"""Tests for Route 53 change batches."""
+
+from aws.changes import build_change, change_size, chunk_changes
+
+
+def test_change_size() -> None:
+    """Test that UPSERT changes count twice.
+
+    :return:
+    """
+    upsert = build_change("foo.bar", "A", "123.134.84.62", 300)
+    delete = {**upsert, "Action": "DELETE"}
+
+    assert change_size(upsert) == (2, 26)
+    assert change_size(delete) == (1, 13)
+
+
+def test_chunk_changes_by_number_of_records() -> None:
+    """Test splitting changes at the record limit.
+
+    :return:
+    """
+    changes = [
+        build_change(f"host{index}.foo.bar", "A", "1.2.3.4", 300)
+        for index in range(1201)
+    ]
+
+    chunks = list(chunk_changes(changes))
+
+    assert [len(chunk) for chunk in chunks] == [500, 500, 201]
+    assert [change for chunk in chunks for change in chunk] == changes
+
+
+def test_chunk_changes_by_number_of_characters() -> None:
+    """Test splitting changes at the character limit.
+
+    :return:
+    """
+    changes = [
+        build_change(
+            f"host{index}.foo.bar",
+            "AAAA",
+            "2001:0db8:0001:0002:0003:0004:0005:0006",
+            300,
+        )
+        for index in range(900)
+    ]
+
+    chunks = list(chunk_changes(changes))
+
+    assert [len(chunk) for chunk in chunks] == [410, 410, 80]
+
+
+def test_chunk_changes_empty() -> None:
+    """Test that no changes result in no change batch.
+
+    :return:
+    """
+    assert list(chunk_changes([])) == []
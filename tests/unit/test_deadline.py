@@ -0,0 +1,252 @@
+"""Tests for the deadlines of AWS API calls."""
+
+import json
+from types import SimpleNamespace
+from typing import Any
+from unittest.mock import MagicMock
+
+import boto3
+import pytest
+from botocore.client import BaseClient
+from botocore.exceptions import ClientError
+from pytest_mock import MockerFixture
+from urllib3.util import Timeout
+
+from aws import deadline
+from aws.deadline import Deadline, DeadlineExceeded, DeadlineTimeout, cap_timeouts
+from aws.lambda_function import create_retrying_client, lambda_handler
+from aws.ratelimit import AdaptiveRateLimiter
+from aws.retry import RetryMetrics, RetryPolicy, call_with_retry
+from benchmarks.fakes import FakeRoute53
+
+
+def lambda_context(remaining_ms: int) -> SimpleNamespace:
+    """Build a Lambda context with the remaining time of an invocation.
+
+    :type remaining_ms: int
+    :param remaining_ms:
+    :return:
+    """
+    return SimpleNamespace(get_remaining_time_in_millis=lambda: remaining_ms)
+
+
+def test_deadline_from_context() -> None:
+    """Test that the deadline is the remaining time minus the reserve.
+
+    :return:
+    """
+    invocation_deadline = Deadline.from_context(lambda_context(5000), reserve=0.5)
+
+    assert 4.4 < invocation_deadline.remaining() <= 4.5
+    invocation_deadline.check(4.0, "GetSecretValue")
+    with pytest.raises(
+        DeadlineExceeded, match=r"GetSecretValue needs more than 4\.600s"
+    ):
+        invocation_deadline.check(4.6, "GetSecretValue")
+    assert Deadline.from_context({}) is None
+
+
+def test_call_with_retry_within_deadline(mocker: MockerFixture) -> None:
+    """Test that calls are only retried if the attempt completes in time.
+
+    :type mocker: MockerFixture
+    :param mocker:
+    :return:
+    """
+    clock = [0.0]
+
+    def sleep(seconds: float) -> None:
+        clock[0] += seconds
+
+    mocker.patch("aws.deadline.monotonic", side_effect=lambda: clock[0])
+    mocker.patch("aws.retry.random.uniform", side_effect=lambda low, high: high)
+    throttling = ClientError({"Error": {"Code": "Throttling"}}, "GetChange")
+    operation = mocker.MagicMock(side_effect=throttling)
+    metrics = RetryMetrics()
+    policy = RetryPolicy(max_attempts=4, base_delay=0.5)
+
+    with deadline.bounded(Deadline.from_context(lambda_context(1500))):
+        with pytest.raises(DeadlineExceeded) as exc_info:
+            call_with_retry(operation, policy=policy, metrics=metrics, sleep=sleep)
+
+    # The backoff of 1s fits into the 1.5s after the first attempt, but not
+    # into the 0.5s left after the second attempt
+    assert operation.call_count == 2
+    assert exc_info.value.__context__ is throttling
+    assert metrics.failures == 1
+
+    clock[0] = 0.0
+    with deadline.bounded(Deadline.from_context(lambda_context(0))):
+        with pytest.raises(DeadlineExceeded):
+            call_with_retry(operation, policy=policy, sleep=sleep)
+
+    assert operation.call_count == 2
+
+
+def test_call_with_retry_rate_limiter_within_deadline(mocker: MockerFixture) -> None:
+    """Test that the rate limiter does not wait past the deadline.
+
+    :type mocker: MockerFixture
+    :param mocker:
+    :return:
+    """
+    clock = [0.0]
+
+    def sleep(seconds: float) -> None:
+        clock[0] += seconds
+
+    mocker.patch("aws.deadline.monotonic", side_effect=lambda: clock[0])
+    rate_limiter = AdaptiveRateLimiter(
+        max_rate=1, min_rate=0.5, recovery=0, clock=lambda: clock[0], sleep=sleep
+    )
+    rate_limiter.on_throttle()
+    operation = mocker.MagicMock(return_value="ok")
+
+    with deadline.bounded(Deadline.from_context(lambda_context(1500))):
+        assert call_with_retry(
+            operation, policy=RetryPolicy(), rate_limiter=rate_limiter
+        ) == "ok"
+        # The next request waits 2s at half the rate, more than remains
+        with pytest.raises(DeadlineExceeded):
+            call_with_retry(operation, policy=RetryPolicy(), rate_limiter=rate_limiter)
+
+    operation.assert_called_once()
+    assert clock[0] == 0.0
+    # The cancelled reservation does not delay the next request
+    assert rate_limiter.reserve() == 2.0
+
+
+def create_client(**kwargs: Any) -> BaseClient:
+    """Create a Route 53 client with short timeouts.
+
+    :type kwargs: Any
+    :param kwargs: further configuration
+    :return:
+    """
+    return boto3.client(
+        "route53",
+        region_name="us-east-1",
+        aws_access_key_id="test",
+        aws_secret_access_key="test",
+        config=boto3.session.Config(connect_timeout=0.5, read_timeout=2, **kwargs),
+    )
+
+
+def test_botocore_http_session_layout() -> None:
+    """Test that botocore still has the attributes cap_timeouts relies on.
+
+    :return:
+    """
+    http_session = create_client()._endpoint.http_session
+
+    assert isinstance(http_session._timeout, Timeout)
+    assert isinstance(http_session._proxy_managers, dict)
+    assert "timeout" in http_session._manager.connection_pool_kw
+
+
+def test_cap_timeouts() -> None:
+    """Test that the timeouts of a client's calls are capped to the deadline.
+
+    :return:
+    """
+    client = cap_timeouts(create_client())
+    pool = client._endpoint.http_session._manager.connection_from_url(
+        "https://route53.amazonaws.com"
+    )
+    assert isinstance(pool.timeout, DeadlineTimeout)
+
+    timeout = pool.timeout.clone()
+    assert (timeout.connect_timeout, timeout.read_timeout) == (0.5, 2)
+
+    with deadline.bounded(Deadline.from_context(lambda_context(1000))):
+        timeout = pool.timeout.clone()
+    assert timeout.connect_timeout == 0.5
+    assert 0.9 < timeout.total <= 1.0
+
+
+def test_cap_timeouts_proxy() -> None:
+    """Test that the timeouts of calls through a proxy are capped to the deadline.
+
+    :return:
+    """
+    proxy_url = "http://proxy.example.com:3128"
+    client = create_client(proxies={"https": proxy_url})
+    http_session = client._endpoint.http_session
+    existing_proxy_manager = http_session._get_proxy_manager(proxy_url)
+
+    cap_timeouts(client)
+
+    assert isinstance(
+        existing_proxy_manager.connection_pool_kw["timeout"], DeadlineTimeout
+    )
+    # Proxy managers are created on the first call through the proxy
+    http_session._proxy_managers.clear()
+    proxy_manager = http_session._get_proxy_manager(proxy_url)
+    assert isinstance(proxy_manager.connection_pool_kw["timeout"], DeadlineTimeout)
+
+
+def test_cap_timeouts_unknown_layout() -> None:
+    """Test that clients are left alone if botocore's attributes changed.
+
+    :return:
+    """
+    client = create_client()
+    http_session = client._endpoint.http_session
+    del http_session._proxy_managers
+    timeout = http_session._timeout
+
+    assert cap_timeouts(client) is client
+    assert http_session._timeout is timeout
+    assert http_session._manager.connection_pool_kw["timeout"] is timeout
+
+
+@pytest.mark.parametrize("remaining_ms, status_code", [(3000, 200), (200, 503)])
+def test_lambda_handler_deadline(
+    mocked_secrets_manager_cache: MagicMock,
+    monkeypatch: pytest.MonkeyPatch,
+    remaining_ms: int,
+    status_code: int,
+) -> None:
+    """Test that requests use the remaining time, but fail fast once it is over.
+
+    Reading the large zone takes many pages, which all start within the time.
+
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :type monkeypatch: pytest.MonkeyPatch
+    :param monkeypatch:
+    :type remaining_ms: int
+    :param remaining_ms:
+    :type status_code: int
+    :param status_code:
+    :return:
+    """
+    monkeypatch.setattr("aws.lambda_function.ROUTE_53_RECORD_LOOKUP_MAX_NAMES", 0)
+    route_53 = FakeRoute53(page_size=10, latency=0.01)
+    route_53.add_hosted_zone("ZONE", "example.com")
+    for index in range(100):
+        route_53.add_record("ZONE", f"static-{index}.example.com", "A", ["192.0.2.9"])
+    client = create_retrying_client(route_53, max_rate=None)
+    monkeypatch.setattr("aws.lambda_function.route_53_client", lambda: client)
+    monkeypatch.setattr("aws.lambda_function.ROUTE_53_HOSTED_ZONE_ID", "ZONE")
+    mocked_secrets_manager_cache.get_secret_string.return_value = "token"
+    event = {
+        "queryStringParameters": {
+            "client_id": "client",
+            "domain": "home.example.com",
+            "token": "token",
+            "ip": "192.0.2.1",
+        }
+    }
+
+    response = lambda_handler(event, lambda_context(remaining_ms))
+
+    assert response["statusCode"] == status_code
+    if status_code == 503:
+        assert response["headers"] == {"Retry-After": "1"}
+        assert json.loads(response["body"]) == "Request timed out, please retry"
+        assert route_53.calls["list_resource_record_sets"] == 0
+    else:
+        assert route_53.calls["list_resource_record_sets"] == 10
+        assert route_53.calls["change_resource_record_sets"] == 1
+    assert deadline.current() is None
@@ -0,0 +1,188 @@
+"""Tests for the flap detection."""
+
+from unittest.mock import MagicMock
+
+import pytest
+from pytest_mock import MockerFixture
+
+from aws import metrics
+from aws.flap import (
+    DynamoDbFlapHistoryStore,
+    FlapDetector,
+    FlapHistoryStore,
+    MemoryFlapHistoryStore,
+)
+from aws.lambda_function import lambda_handler
+from aws.registry import Registry
+from benchmarks.fakes import FakeRoute53
+from tests.fakes import FakeDynamoDbClient
+
+KEY = ("ZONE", "foo.bar", "A")
+
+
+@pytest.fixture(scope="function", params=["memory", "dynamodb"])
+def history_store(request: pytest.FixtureRequest) -> FlapHistoryStore:
+    """Provide each flap history store implementation.
+
+    :type request: pytest.FixtureRequest
+    :param request:
+    :return:
+    """
+    if request.param == "memory":
+        return MemoryFlapHistoryStore(max_size=16, max_age=3600)
+    return DynamoDbFlapHistoryStore(FakeDynamoDbClient(), "flap-history", 3600)
+
+
+def report(detector: FlapDetector, values: str, start: float = 0.0) -> None:
+    """Report one value per minute.
+
+    :type detector: FlapDetector
+    :param detector:
+    :type values: str
+    :param values: one character per report
+    :type start: float
+    :param start:
+    :return:
+    """
+    for index, value in enumerate(values):
+        detector.report(KEY, value, now=start + index * 60)
+
+
+def test_flap_history_store_is_bounded(history_store: FlapHistoryStore) -> None:
+    """Test that only the latest reports are kept.
+
+    :type history_store: FlapHistoryStore
+    :param history_store:
+    :return:
+    """
+    assert history_store.get(KEY) == ()
+
+    for index in range(5):
+        history_store.append(KEY, (float(index), str(index)), max_length=3)
+
+    assert history_store.get(KEY) == ((2.0, "2"), (3.0, "3"), (4.0, "4"))
+
+
+def test_flap_detector_hold(history_store: FlapHistoryStore) -> None:
+    """Test that a flapping record is held until the changes left the window.
+
+    :type history_store: FlapHistoryStore
+    :param history_store:
+    :return:
+    """
+    detector = FlapDetector(history_store, policy="hold", window=600, threshold=3)
+
+    report(detector, "aba")
+    assert not detector.holds(KEY, "b", now=120)
+
+    report(detector, "b", start=180)
+    assert detector.holds(KEY, "b", now=180)
+
+    report(detector, "bbbbbbbbbb", start=240)
+    assert detector.holds(KEY, "b", now=600)
+    assert not detector.holds(KEY, "b", now=700)
+
+
+def test_flap_detector_confirm(history_store: FlapHistoryStore) -> None:
+    """Test that a flapping record is written after enough identical reports.
+
+    :type history_store: FlapHistoryStore
+    :param history_store:
+    :return:
+    """
+    detector = FlapDetector(
+        history_store, policy="confirm", window=600, threshold=3, confirmations=3
+    )
+
+    report(detector, "ababab")
+    assert detector.holds(KEY, "b", now=300)
+
+    report(detector, "b", start=360)
+    assert detector.holds(KEY, "b", now=360)
+
+    report(detector, "b", start=420)
+    assert not detector.holds(KEY, "b", now=420)
+    assert detector.holds(KEY, "a", now=420)
+
+
+def test_flap_detector_skips_published_value(
+    history_store: FlapHistoryStore,
+) -> None:
+    """Test that the published value is only reported after another value.
+
+    :type history_store: FlapHistoryStore
+    :param history_store:
+    :return:
+    """
+    detector = FlapDetector(history_store)
+
+    detector.report(KEY, "a", now=0, published="a")
+    assert history_store.get(KEY) == ()
+
+    detector.report(KEY, "b", now=60, published="a")
+    detector.report(KEY, "b", now=120, published="a")
+    detector.report(KEY, "a", now=180, published="a")
+    detector.report(KEY, "a", now=240, published="a")
+    assert history_store.get(KEY) == ((60, "b"), (120, "b"), (180, "a"))
+
+
+def test_flap_detector_unknown_policy() -> None:
+    """Test that only the known policies can be configured.
+
+    :return:
+    """
+    with pytest.raises(ValueError, match="Unknown flap policy"):
+        FlapDetector(MemoryFlapHistoryStore(max_size=1, max_age=1), policy="drop")
+
+
+def test_lambda_handler_suppresses_flapping_writes(
+    mocked_secrets_manager_cache: MagicMock,
+    mocker: MockerFixture,
+    monkeypatch: pytest.MonkeyPatch,
+    registry: Registry,
+) -> None:
+    """Test that alternating IP addresses are only written until the record flaps.
+
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :type mocker: MockerFixture
+    :param mocker:
+    :type monkeypatch: pytest.MonkeyPatch
+    :param monkeypatch:
+    :type registry: Registry
+    :param registry:
+    :return:
+    """
+    route_53 = FakeRoute53()
+    route_53.add_hosted_zone("ZONE", "example.com")
+    route_53.add_record("ZONE", "home.example.com", "A", ["192.0.2.1"])
+    monkeypatch.setattr("aws.lambda_function.route_53_client", lambda: route_53)
+    monkeypatch.setattr("aws.lambda_function.ROUTE_53_HOSTED_ZONE_ID", "ZONE")
+    monkeypatch.setattr("aws.lambda_function.FLAP_POLICY", "hold")
+    monkeypatch.setattr("aws.lambda_function.FLAP_THRESHOLD", 3)
+    mocked_secrets_manager_cache.get_secret_string.return_value = "token"
+    event: dict = {
+        "queryStringParameters": {
+            "client_id": "client",
+            "domain": "home.example.com",
+            "token": "token",
+        }
+    }
+
+    count = mocker.spy(metrics, "count")
+
+    for ip in ["192.0.2.2", "192.0.2.1"] * 10:
+        event["queryStringParameters"]["ip"] = ip
+        assert lambda_handler(event, {})["statusCode"] == 200
+
+    assert route_53.calls["change_resource_record_sets"] == 3
+    assert count.call_args_list.count(mocker.call("SuppressedWrites")) == 9
+
+    # Reports of the published IP address skip the flap history
+    append = mocker.spy(registry.get("flap_detector").store, "append")
+    event["queryStringParameters"]["ip"] = "192.0.2.2"
+    assert lambda_handler(event, {})["statusCode"] == 200
+    append.assert_not_called()
+    assert route_53.record_sets["ZONE"][("home.example.com.", "A")][
+        "ResourceRecords"
+    ] == [{"Value": "192.0.2.2"}]
@@ -1,12 +1,18 @@
 """Tests for lambda_handler function."""
 
+import ipaddress
+import json
 from secrets import token_hex
+from threading import Barrier, Event
 from unittest.mock import MagicMock
 from uuid import uuid4
 
 import pytest
+from botocore.exceptions import ClientError
+from pytest_mock import MockerFixture
 
-from aws.lambda_function import lambda_handler
+from aws.lambda_function import client_ip_address, lambda_handler, parse_ip_addresses
+from aws.registry import Registry
 
 
 def test_lambda_handler(
@@ -31,6 +37,10 @@ def test_lambda_handler(
         }
     }
     mocked_secrets_manager_cache.get_secret_string.return_value = test_token
+    mocked_route_53_client.list_resource_record_sets.return_value = {
+        "ResourceRecordSets": [],
+        "IsTruncated": False,
+    }
 
     response: dict = lambda_handler(event, {})
 
@@ -39,6 +49,41 @@ def test_lambda_handler(
     mocked_route_53_client.change_resource_record_sets.assert_called_once()
 
 
+def test_lambda_handler_post_with_query_parameters(
+    mocked_route_53_client: MagicMock, mocked_secrets_manager_cache: MagicMock
+) -> None:
+    """Test that a POST request with query parameters is handled like a GET request.
+
+    :type mocked_route_53_client: MagicMock
+    :param mocked_route_53_client:
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :return:
+    """
+    test_token = token_hex()
+    event: dict = {
+        "requestContext": {"http": {"method": "POST"}},
+        "queryStringParameters": {
+            "client_id": str(uuid4()),
+            "domain": "test_domain",
+            "ip": "127.0.0.1",
+            "token": test_token,
+        },
+        "body": "eyJ0ZXN0IjoiYm9keSJ9",
+        "isBase64Encoded": True,
+    }
+    mocked_secrets_manager_cache.get_secret_string.return_value = test_token
+    mocked_route_53_client.list_resource_record_sets.return_value = {
+        "ResourceRecordSets": [],
+        "IsTruncated": False,
+    }
+
+    response: dict = lambda_handler(event, {})
+
+    assert response["statusCode"] == 200
+    mocked_route_53_client.change_resource_record_sets.assert_called_once()
+
+
 def test_lambda_handler_invalid_token(
     mocked_route_53_client: MagicMock, mocked_secrets_manager_cache: MagicMock
 ) -> None:
@@ -231,3 +276,814 @@ def test_lambda_handler_multiple_domains(
     for index, domain in enumerate(sorted(domains.split(","))):
         assert changes[index]["ResourceRecordSet"]["Name"] == domain
         assert changes[index]["ResourceRecordSet"]["ResourceRecords"][0]["Value"] == ip
+
+
+def test_lambda_handler_reuses_zone_snapshot(
+    mocked_route_53_client: MagicMock,
+    mocked_secrets_manager_cache: MagicMock,
+    route_53_client_response: dict,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Test that warm invocations reuse the zone snapshot and patch it on changes.
+
+    :type mocked_route_53_client: MagicMock
+    :param mocked_route_53_client:
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :type route_53_client_response: dict
+    :param route_53_client_response:
+    :type monkeypatch: pytest.MonkeyPatch
+    :param monkeypatch:
+    :return:
+    """
+    monkeypatch.setattr("aws.lambda_function.ROUTE_53_RECORD_LOOKUP_MAX_NAMES", 0)
+    test_token = token_hex()
+    event: dict = {
+        "queryStringParameters": {
+            "client_id": str(uuid4()),
+            "domain": "foo.bar",
+            "ip": "123.134.84.62",
+            "token": test_token,
+        }
+    }
+    mocked_secrets_manager_cache.get_secret_string.return_value = test_token
+    mocked_route_53_client.list_resource_record_sets.return_value = (
+        route_53_client_response
+    )
+
+    assert lambda_handler(event, {})["statusCode"] == 200
+    assert lambda_handler(event, {})["statusCode"] == 200
+    mocked_route_53_client.list_resource_record_sets.assert_called_once()
+    mocked_route_53_client.change_resource_record_sets.assert_not_called()
+
+    event["queryStringParameters"]["ip"] = "123.134.84.63"
+    assert lambda_handler(event, {})["statusCode"] == 200
+    mocked_route_53_client.change_resource_record_sets.assert_called_once()
+
+    event["queryStringParameters"]["domain"] = "boom.bang"
+    event["queryStringParameters"]["ip"] = "231.134.85.63"
+    assert lambda_handler(event, {})["statusCode"] == 200
+    mocked_route_53_client.list_resource_record_sets.assert_called_once()
+    mocked_route_53_client.change_resource_record_sets.assert_called_once()
+
+    # The snapshot holds the changed record
+    event["queryStringParameters"]["domain"] = "foo.bar"
+    event["queryStringParameters"]["ip"] = "123.134.84.62"
+    assert lambda_handler(event, {})["statusCode"] == 200
+    event["queryStringParameters"]["ip"] = "123.134.84.63"
+    assert lambda_handler(event, {})["statusCode"] == 200
+    mocked_route_53_client.list_resource_record_sets.assert_called_once()
+    assert mocked_route_53_client.change_resource_record_sets.call_count == 3
+
+
+def test_lambda_handler_skips_route_53_for_published_ip(
+    mocked_route_53_client: MagicMock,
+    mocked_secrets_manager_cache: MagicMock,
+    route_53_client_response: dict,
+    registry: Registry,
+) -> None:
+    """Test that an unchanged IP is answered without calling Route 53.
+
+    :type mocked_route_53_client: MagicMock
+    :param mocked_route_53_client:
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :type route_53_client_response: dict
+    :param route_53_client_response:
+    :type registry: Registry
+    :param registry:
+    :return:
+    """
+    test_token = token_hex()
+    event: dict = {
+        "queryStringParameters": {
+            "client_id": str(uuid4()),
+            "domain": "foo.bar,cling.clang",
+            "ip": "123.134.84.62",
+            "token": test_token,
+        }
+    }
+    mocked_secrets_manager_cache.get_secret_string.return_value = test_token
+    mocked_route_53_client.list_resource_record_sets.return_value = (
+        route_53_client_response
+    )
+
+    assert lambda_handler(event, {})["statusCode"] == 200
+    mocked_route_53_client.list_resource_record_sets.assert_called_once()
+    mocked_route_53_client.change_resource_record_sets.assert_called_once()
+
+    # Drop the zone snapshot, so any Route 53 read would show up
+    registry.reset("zone_snapshots")
+    for _ in range(3):
+        response: dict = lambda_handler(event, {})
+        assert response["statusCode"] == 200
+        assert "DNS record was updated" in response["body"]
+    mocked_route_53_client.list_resource_record_sets.assert_called_once()
+    mocked_route_53_client.change_resource_record_sets.assert_called_once()
+
+    # A wrong token must still be rejected
+    event["queryStringParameters"]["token"] = "invalid_token"
+    assert lambda_handler(event, {})["statusCode"] == 401
+
+
+@pytest.mark.parametrize(
+    "query_parameters, expected_changes",
+    [
+        (
+            {"ip": "123.134.84.62", "ip6": "2001:db8::1"},
+            [],
+        ),
+        (
+            {"ip": "123.134.84.63", "ip6": "2001:db8::1"},
+            [("foo.bar", "A", "123.134.84.63")],
+        ),
+        (
+            {"ip": "123.134.84.63", "ip6": "2001:db8::2"},
+            [("foo.bar", "A", "123.134.84.63"), ("foo.bar", "AAAA", "2001:db8::2")],
+        ),
+        (
+            {"ip": "2001:DB8:0::2"},
+            [("foo.bar", "AAAA", "2001:db8::2")],
+        ),
+        (
+            {"ip6": "2001:db8::1"},
+            [],
+        ),
+    ],
+)
+def test_lambda_handler_dual_stack(
+    mocked_route_53_client: MagicMock,
+    mocked_secrets_manager_cache: MagicMock,
+    route_53_client_response: dict,
+    query_parameters: dict,
+    expected_changes: list[tuple[str, str, str]],
+) -> None:
+    """Test that A and AAAA records are read and changed together.
+
+    :type mocked_route_53_client: MagicMock
+    :param mocked_route_53_client:
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :type route_53_client_response: dict
+    :param route_53_client_response:
+    :type query_parameters: dict
+    :param query_parameters:
+    :type expected_changes: list[tuple[str, str, str]]
+    :param expected_changes:
+    :return:
+    """
+    test_token = token_hex()
+    event: dict = {
+        "queryStringParameters": {
+            "client_id": str(uuid4()),
+            "domain": "foo.bar",
+            "token": test_token,
+            **query_parameters,
+        }
+    }
+    mocked_secrets_manager_cache.get_secret_string.return_value = test_token
+    mocked_route_53_client.list_resource_record_sets.return_value = (
+        route_53_client_response
+    )
+
+    response: dict = lambda_handler(event, {})
+
+    assert response["statusCode"] == 200
+    mocked_route_53_client.list_resource_record_sets.assert_called_once()
+    if expected_changes:
+        mocked_route_53_client.change_resource_record_sets.assert_called_once()
+        changes = mocked_route_53_client.change_resource_record_sets.call_args.kwargs[
+            "ChangeBatch"
+        ]["Changes"]
+        assert [
+            (
+                change["ResourceRecordSet"]["Name"],
+                change["ResourceRecordSet"]["Type"],
+                change["ResourceRecordSet"]["ResourceRecords"][0]["Value"],
+            )
+            for change in changes
+        ] == expected_changes
+    else:
+        mocked_route_53_client.change_resource_record_sets.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "query_parameters",
+    [
+        {"ip": "not_an_ip"},
+        {"ip": "123.134.84.62", "ip6": "123.134.84.63"},
+        {"ip": "2001:db8::1", "ip6": "2001:db8::2"},
+    ],
+)
+def test_lambda_handler_invalid_ip(
+    mocked_route_53_client: MagicMock,
+    mocked_secrets_manager_cache: MagicMock,
+    query_parameters: dict,
+) -> None:
+    """Test lambda_handler() with invalid IP addresses.
+
+    :type mocked_route_53_client: MagicMock
+    :param mocked_route_53_client:
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :type query_parameters: dict
+    :param query_parameters:
+    :return:
+    """
+    event: dict = {
+        "queryStringParameters": {
+            "client_id": str(uuid4()),
+            "domain": "foo.bar",
+            "token": token_hex(),
+            **query_parameters,
+        }
+    }
+
+    response: dict = lambda_handler(event, {})
+
+    assert response["statusCode"] == 400
+    assert "Invalid IP address" in response["body"]
+    mocked_secrets_manager_cache.get_secret_string.assert_not_called()
+    mocked_route_53_client.list_resource_record_sets.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "query_parameters, source_ip, expected_change",
+    [
+        ({"ip": "auto"}, "123.134.84.63", ("A", "123.134.84.63")),
+        ({}, "2001:db8::2", ("AAAA", "2001:db8::2")),
+        ({"ip6": "auto"}, "::ffff:123.134.84.63", ("A", "123.134.84.63")),
+    ],
+)
+def test_lambda_handler_auto_ip(
+    mocked_route_53_client: MagicMock,
+    mocked_secrets_manager_cache: MagicMock,
+    route_53_client_response: dict,
+    query_parameters: dict,
+    source_ip: str,
+    expected_change: tuple[str, str],
+) -> None:
+    """Test that the source IP of the request is used for ip=auto or without ip.
+
+    :type mocked_route_53_client: MagicMock
+    :param mocked_route_53_client:
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :type route_53_client_response: dict
+    :param route_53_client_response:
+    :type query_parameters: dict
+    :param query_parameters:
+    :type source_ip: str
+    :param source_ip:
+    :type expected_change: tuple[str, str]
+    :param expected_change:
+    :return:
+    """
+    test_token = token_hex()
+    event: dict = {
+        "queryStringParameters": {
+            "client_id": str(uuid4()),
+            "domain": "foo.bar",
+            "token": test_token,
+            **query_parameters,
+        },
+        "requestContext": {"http": {"method": "GET", "sourceIp": source_ip}},
+    }
+    mocked_secrets_manager_cache.get_secret_string.return_value = test_token
+    mocked_route_53_client.list_resource_record_sets.return_value = (
+        route_53_client_response
+    )
+
+    response: dict = lambda_handler(event, {})
+
+    assert response["statusCode"] == 200
+    changes = mocked_route_53_client.change_resource_record_sets.call_args.kwargs[
+        "ChangeBatch"
+    ]["Changes"]
+    assert [
+        (
+            change["ResourceRecordSet"]["Type"],
+            change["ResourceRecordSet"]["ResourceRecords"][0]["Value"],
+        )
+        for change in changes
+    ] == [expected_change]
+
+
+def test_lambda_handler_auto_ip_without_source_ip(
+    mocked_secrets_manager_cache: MagicMock,
+) -> None:
+    """Test that ip=auto needs the source IP of the request.
+
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :return:
+    """
+    event: dict = {
+        "queryStringParameters": {
+            "client_id": str(uuid4()),
+            "domain": "foo.bar",
+            "token": token_hex(),
+            "ip": "auto",
+        }
+    }
+
+    response: dict = lambda_handler(event, {})
+
+    assert response["statusCode"] == 400
+    assert "Missing request parameters" in response["body"]
+    mocked_secrets_manager_cache.get_secret_string.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "source_ip, forwarded_for, expected_ip",
+    [
+        ("198.51.100.7", "", "198.51.100.7"),
+        ("198.51.100.7", "203.0.113.9", "198.51.100.7"),
+        ("10.0.0.2", "192.0.2.1, 203.0.113.9", "203.0.113.9"),
+        ("10.0.0.2", "192.0.2.1, 203.0.113.9, 10.0.0.1", "203.0.113.9"),
+        ("10.0.0.2", "2001:db8::9, 10.0.0.1", "2001:db8::9"),
+        ("10.0.0.2", "unknown, 203.0.113.9", "203.0.113.9"),
+        ("10.0.0.2", "", None),
+        ("10.0.0.2", "10.0.0.1", None),
+        ("10.0.0.2", "203.0.113.9, unknown", None),
+        ("10.0.0.2", "203.0.113.9:4711", None),
+    ],
+)
+def test_client_ip_address(
+    monkeypatch: pytest.MonkeyPatch,
+    source_ip: str,
+    forwarded_for: str,
+    expected_ip: str | None,
+) -> None:
+    """Test that X-Forwarded-For is only read behind trusted proxies.
+
+    :type monkeypatch: pytest.MonkeyPatch
+    :param monkeypatch:
+    :type source_ip: str
+    :param source_ip:
+    :type forwarded_for: str
+    :param forwarded_for:
+    :type expected_ip: str | None
+    :param expected_ip:
+    :return:
+    """
+    monkeypatch.setattr(
+        "aws.lambda_function.TRUSTED_PROXIES", (ipaddress.ip_network("10.0.0.0/8"),)
+    )
+    event: dict = {
+        "headers": {"x-forwarded-for": forwarded_for},
+        "requestContext": {"http": {"sourceIp": source_ip}},
+    }
+
+    assert client_ip_address(event) == expected_ip
+
+
+def test_parse_ip_addresses_explicit_ip(mocker: MockerFixture) -> None:
+    """Test that the client address is only looked up for ip=auto.
+
+    :type mocker: MockerFixture
+    :param mocker:
+    :return:
+    """
+    mocked_client_ip_address = mocker.patch(
+        "aws.lambda_function.client_ip_address", return_value="203.0.113.9"
+    )
+    event: dict = {"requestContext": {"http": {"sourceIp": "10.0.0.2"}}}
+
+    assert parse_ip_addresses({"ip": "192.0.2.1"}, event) == {"A": "192.0.2.1"}
+    mocked_client_ip_address.assert_not_called()
+
+    assert parse_ip_addresses({"ip": "auto"}, event) == {"A": "203.0.113.9"}
+    mocked_client_ip_address.assert_called_once_with(event)
+
+
+def test_lambda_handler_multiple_hosted_zones(
+    mocked_route_53_client: MagicMock,
+    mocked_secrets_manager_cache: MagicMock,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Test that domains of several hosted zones are updated concurrently.
+
+    :type mocked_route_53_client: MagicMock
+    :param mocked_route_53_client:
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :type monkeypatch: pytest.MonkeyPatch
+    :param monkeypatch:
+    :return:
+    """
+    monkeypatch.setattr("aws.lambda_function.ROUTE_53_ZONE_DISCOVERY", True)
+    test_token = token_hex()
+    event: dict = {
+        "queryStringParameters": {
+            "client_id": str(uuid4()),
+            "domain": "a.example.com,b.example.org,c.example.com",
+            "ip": "123.45.67.89",
+            "token": test_token,
+        }
+    }
+    mocked_secrets_manager_cache.get_secret_string.return_value = test_token
+    mocked_route_53_client.list_hosted_zones.return_value = {
+        "HostedZones": [
+            {"Id": "/hostedzone/COM", "Name": "example.com."},
+            {"Id": "/hostedzone/ORG", "Name": "example.org."},
+        ],
+        "IsTruncated": False,
+    }
+    # Both zones must be read at the same time to pass the barrier
+    barrier = Barrier(2, timeout=5)
+
+    def list_resource_record_sets(**kwargs) -> dict:
+        barrier.wait()
+        return {"ResourceRecordSets": [], "IsTruncated": False}
+
+    mocked_route_53_client.list_resource_record_sets.side_effect = (
+        list_resource_record_sets
+    )
+
+    response: dict = lambda_handler(event, {})
+
+    assert response["statusCode"] == 200
+    assert mocked_route_53_client.list_resource_record_sets.call_count == 2
+    changed = {
+        call.kwargs["HostedZoneId"]: [
+            change["ResourceRecordSet"]["Name"]
+            for change in call.kwargs["ChangeBatch"]["Changes"]
+        ]
+        for call in mocked_route_53_client.change_resource_record_sets.call_args_list
+    }
+    assert changed == {
+        "COM": ["a.example.com", "c.example.com"],
+        "ORG": ["b.example.org"],
+    }
+
+    event["queryStringParameters"]["domain"] = "d.example.net"
+    response = lambda_handler(event, {})
+
+    assert response["statusCode"] == 400
+    assert "No hosted zone found" in response["body"]
+    mocked_route_53_client.list_hosted_zones.assert_called_once()
+
+
+def test_lambda_handler_malformed_change_response(
+    mocked_route_53_client: MagicMock,
+    mocked_secrets_manager_cache: MagicMock,
+    route_53_client_response: dict,
+) -> None:
+    """Test that a malformed API response is an internal error, not a bad request.
+
+    :type mocked_route_53_client: MagicMock
+    :param mocked_route_53_client:
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :type route_53_client_response: dict
+    :param route_53_client_response:
+    :return:
+    """
+    test_token = token_hex()
+    event: dict = {
+        "queryStringParameters": {
+            "client_id": str(uuid4()),
+            "domain": "foo.bar",
+            "ip": "123.45.67.89",
+            "token": test_token,
+            "mode": "async",
+        }
+    }
+    mocked_secrets_manager_cache.get_secret_string.return_value = test_token
+    mocked_route_53_client.list_resource_record_sets.return_value = (
+        route_53_client_response
+    )
+    mocked_route_53_client.change_resource_record_sets.return_value = {}
+
+    response: dict = lambda_handler(event, {})
+
+    assert response["statusCode"] == 500
+    assert json.loads(response["body"]) == "Something went wrong"
+
+
+def test_lambda_handler_async_mode(
+    mocked_route_53_client: MagicMock,
+    mocked_secrets_manager_cache: MagicMock,
+    route_53_client_response: dict,
+) -> None:
+    """Test that the async mode returns the change id with status 202.
+
+    :type mocked_route_53_client: MagicMock
+    :param mocked_route_53_client:
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :type route_53_client_response: dict
+    :param route_53_client_response:
+    :return:
+    """
+    test_token = token_hex()
+    event: dict = {
+        "queryStringParameters": {
+            "client_id": str(uuid4()),
+            "domain": "foo.bar",
+            "ip": "123.45.67.89",
+            "token": test_token,
+            "mode": "async",
+        }
+    }
+    mocked_secrets_manager_cache.get_secret_string.return_value = test_token
+    mocked_route_53_client.list_resource_record_sets.return_value = (
+        route_53_client_response
+    )
+    mocked_route_53_client.change_resource_record_sets.return_value = {
+        "ChangeInfo": {
+            "Id": "/change/C2682N5HXP0BZ4",
+            "Status": "PENDING",
+            "SubmittedAt": "2024-08-05T18:24:17Z",
+        }
+    }
+
+    response: dict = lambda_handler(event, {})
+
+    assert response["statusCode"] == 202
+    assert json.loads(response["body"])["change_ids"] == ["C2682N5HXP0BZ4"]
+
+    # Nothing to submit, so there is no change to track
+    response = lambda_handler(event, {})
+
+    assert response["statusCode"] == 200
+    mocked_route_53_client.change_resource_record_sets.assert_called_once()
+
+
+def test_lambda_handler_change_status(
+    mocked_route_53_client: MagicMock,
+    mocked_secrets_manager_cache: MagicMock,
+    mocker: MockerFixture,
+) -> None:
+    """Test querying the status of a change with short-lived caching.
+
+    :type mocked_route_53_client: MagicMock
+    :param mocked_route_53_client:
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :type mocker: MockerFixture
+    :param mocker:
+    :return:
+    """
+    monotonic = mocker.patch("aws.cache.monotonic", return_value=100.0)
+    test_token = token_hex()
+    event: dict = {
+        "queryStringParameters": {
+            "client_id": str(uuid4()),
+            "change_id": "C2682N5HXP0BZ4",
+            "token": test_token,
+        }
+    }
+    mocked_secrets_manager_cache.get_secret_string.return_value = test_token
+    mocked_route_53_client.get_change.side_effect = [
+        {
+            "ChangeInfo": {
+                "Id": "/change/C2682N5HXP0BZ4",
+                "Status": status,
+                "SubmittedAt": "2024-08-05T18:24:17Z",
+            }
+        }
+        for status in ("PENDING", "INSYNC")
+    ]
+
+    response: dict = lambda_handler(event, {})
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"])["status"] == "PENDING"
+    assert json.loads(lambda_handler(event, {})["body"])["status"] == "PENDING"
+    mocked_route_53_client.get_change.assert_called_once_with(Id="C2682N5HXP0BZ4")
+
+    monotonic.return_value = 110.0
+    assert json.loads(lambda_handler(event, {})["body"])["status"] == "INSYNC"
+    monotonic.return_value = 3600.0
+    assert json.loads(lambda_handler(event, {})["body"])["status"] == "INSYNC"
+    assert mocked_route_53_client.get_change.call_count == 2
+
+    event["queryStringParameters"]["token"] = "invalid_token"
+    assert lambda_handler(event, {})["statusCode"] == 401
+    mocked_route_53_client.list_resource_record_sets.assert_not_called()
+
+
+def test_lambda_handler_unknown_change(
+    mocked_route_53_client: MagicMock,
+    mocked_secrets_manager_cache: MagicMock,
+) -> None:
+    """Test querying the status of an unknown change.
+
+    :type mocked_route_53_client: MagicMock
+    :param mocked_route_53_client:
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :return:
+    """
+    test_token = token_hex()
+    event: dict = {
+        "queryStringParameters": {
+            "client_id": str(uuid4()),
+            "change_id": "UNKNOWN",
+            "token": test_token,
+        }
+    }
+    mocked_secrets_manager_cache.get_secret_string.return_value = test_token
+    mocked_route_53_client.get_change.side_effect = ClientError(
+        {"Error": {"Code": "NoSuchChange", "Message": "No such change"}}, "GetChange"
+    )
+
+    response: dict = lambda_handler(event, {})
+
+    assert response["statusCode"] == 404
+
+
+def test_lambda_handler_aws_temporarily_unavailable(
+    mocked_route_53_client: MagicMock,
+    mocked_secrets_manager_cache: MagicMock,
+) -> None:
+    """Test that retriable errors which outlast the retries return 503.
+
+    :type mocked_route_53_client: MagicMock
+    :param mocked_route_53_client:
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :return:
+    """
+    test_token = token_hex()
+    event: dict = {
+        "queryStringParameters": {
+            "client_id": str(uuid4()),
+            "domain": "foo.bar",
+            "ip": "123.45.67.89",
+            "token": test_token,
+        }
+    }
+    mocked_secrets_manager_cache.get_secret_string.return_value = test_token
+    mocked_route_53_client.list_resource_record_sets.side_effect = ClientError(
+        {"Error": {"Code": "Throttling", "Message": "Rate exceeded"}},
+        "ListResourceRecordSets",
+    )
+
+    response: dict = lambda_handler(event, {})
+
+    assert response["statusCode"] == 503
+    assert response["headers"]["Retry-After"] == "1"
+
+
+def test_lambda_handler_prefetch_records(
+    mocked_route_53_client: MagicMock,
+    mocked_secrets_manager_cache: MagicMock,
+    route_53_client_response: dict,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Test that the records are read while the token is checked.
+
+    :type mocked_route_53_client: MagicMock
+    :param mocked_route_53_client:
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :type route_53_client_response: dict
+    :param route_53_client_response:
+    :type monkeypatch: pytest.MonkeyPatch
+    :param monkeypatch:
+    :return:
+    """
+    monkeypatch.setattr("aws.lambda_function.PREFETCH_RECORDS", True)
+    monkeypatch.setattr("aws.lambda_function.ROUTE_53_RECORD_LOOKUP_MAX_NAMES", 0)
+    test_token = token_hex()
+    event: dict = {
+        "queryStringParameters": {
+            "client_id": str(uuid4()),
+            "domain": "foo.bar",
+            "ip": "123.134.84.62",
+            "token": test_token,
+        }
+    }
+    # Secret and records must be read at the same time to pass the barrier
+    barrier = Barrier(2, timeout=5)
+
+    def get_secret_string(secret_id: str) -> str:
+        barrier.wait()
+        return test_token
+
+    def list_resource_record_sets(**kwargs) -> dict:
+        barrier.wait()
+        return route_53_client_response
+
+    mocked_secrets_manager_cache.get_secret_string.side_effect = get_secret_string
+    mocked_route_53_client.list_resource_record_sets.side_effect = (
+        list_resource_record_sets
+    )
+
+    response: dict = lambda_handler(event, {})
+
+    assert response["statusCode"] == 200
+    mocked_route_53_client.change_resource_record_sets.assert_not_called()
+
+    # The snapshot of the prefetch is cached once the client is authenticated
+    event["queryStringParameters"]["domain"] = "boom.bang"
+    event["queryStringParameters"]["ip"] = "231.134.85.64"
+    assert lambda_handler(event, {})["statusCode"] == 200
+    mocked_route_53_client.list_resource_record_sets.assert_called_once()
+    mocked_route_53_client.change_resource_record_sets.assert_called_once()
+
+
+def test_lambda_handler_prefetch_invalid_token(
+    mocked_route_53_client: MagicMock,
+    mocked_secrets_manager_cache: MagicMock,
+    route_53_client_response: dict,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Test that records prefetched for an invalid token are thrown away.
+
+    :type mocked_route_53_client: MagicMock
+    :param mocked_route_53_client:
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :type route_53_client_response: dict
+    :param route_53_client_response:
+    :type monkeypatch: pytest.MonkeyPatch
+    :param monkeypatch:
+    :return:
+    """
+    monkeypatch.setattr("aws.lambda_function.PREFETCH_RECORDS", True)
+    event: dict = {
+        "queryStringParameters": {
+            "client_id": str(uuid4()),
+            "domain": "foo.bar",
+            "ip": "123.134.84.62",
+            "token": "invalid",
+        }
+    }
+    test_token = token_hex()
+    records_read = Event()
+
+    def get_secret_string(secret_id: str) -> str:
+        # Let the prefetch finish before the token is rejected
+        assert records_read.wait(timeout=5)
+        return test_token
+
+    def list_resource_record_sets(**kwargs) -> dict:
+        records_read.set()
+        return route_53_client_response
+
+    mocked_secrets_manager_cache.get_secret_string.side_effect = get_secret_string
+    mocked_route_53_client.list_resource_record_sets.side_effect = (
+        list_resource_record_sets
+    )
+
+    response: dict = lambda_handler(event, {})
+
+    assert response["statusCode"] == 401
+    mocked_route_53_client.list_resource_record_sets.assert_called_once()
+    mocked_route_53_client.change_resource_record_sets.assert_not_called()
+
+    # Nothing read for the invalid token was cached
+    event["queryStringParameters"]["token"] = test_token
+    assert lambda_handler(event, {})["statusCode"] == 200
+    assert mocked_route_53_client.list_resource_record_sets.call_count == 2
+    mocked_route_53_client.change_resource_record_sets.assert_not_called()
+
+
+def test_lambda_handler_prefetch_rejected_client(
+    mocked_route_53_client: MagicMock,
+    mocked_secrets_manager_cache: MagicMock,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Test that rejected client ids do not cause Route 53 calls.
+
+    :type mocked_route_53_client: MagicMock
+    :param mocked_route_53_client:
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :type monkeypatch: pytest.MonkeyPatch
+    :param monkeypatch:
+    :return:
+    """
+    monkeypatch.setattr("aws.lambda_function.PREFETCH_RECORDS", True)
+    event: dict = {
+        "queryStringParameters": {
+            "client_id": str(uuid4()),
+            "domain": "foo.bar",
+            "ip": "123.134.84.62",
+            "token": token_hex(),
+        }
+    }
+    mocked_secrets_manager_cache.get_secret_string.side_effect = ClientError(
+        {"Error": {"Code": "ResourceNotFoundException", "Message": "Not found"}},
+        "GetSecretValue",
+    )
+    mocked_route_53_client.list_resource_record_sets.return_value = {
+        "ResourceRecordSets": [],
+        "IsTruncated": False,
+    }
+    # The first request finds out that the client id is unknown
+    assert lambda_handler(event, {})["statusCode"] == 401
+    mocked_route_53_client.reset_mock()
+
+    for _ in range(4):
+        assert lambda_handler(event, {})["statusCode"] == 401
+    mocked_secrets_manager_cache.get_secret_string.assert_called_once()
+    mocked_route_53_client.list_resource_record_sets.assert_not_called()
+
+    # Malformed client ids are rejected without any call
+    event["queryStringParameters"]["client_id"] = "not a client id"
+    assert lambda_handler(event, {})["statusCode"] == 401
+    mocked_route_53_client.list_resource_record_sets.assert_not_called()
@@ -0,0 +1,152 @@
+"""Tests for the per-invocation metrics."""
+
+import json
+from secrets import token_hex
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+from aws import metrics
+from aws.lambda_function import lambda_handler
+
+
+@pytest.fixture(scope="function", autouse=True)
+def cold_start(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Start every test with a cold execution environment.
+
+    :type monkeypatch: pytest.MonkeyPatch
+    :param monkeypatch:
+    :return:
+    """
+    monkeypatch.setattr(metrics, "_cold_start", True)
+
+
+def emitted_records(capsys: pytest.CaptureFixture) -> list[dict]:
+    """Return the EMF records written to stdout.
+
+    :type capsys: pytest.CaptureFixture
+    :param capsys:
+    :return:
+    """
+    return [
+        json.loads(line)
+        for line in capsys.readouterr().out.splitlines()
+        if line.startswith('{"_aws"')
+    ]
+
+
+def test_invocation_emits_record(capsys: pytest.CaptureFixture) -> None:
+    """Test that an invocation writes one EMF record with all its metrics.
+
+    :type capsys: pytest.CaptureFixture
+    :param capsys:
+    :return:
+    """
+    context = SimpleNamespace(aws_request_id="request-1")
+    with metrics.invocation("lambda_handler", context):
+        with metrics.phase("Parse"):
+            pass
+        metrics.count("PublishedIpCacheMiss")
+        metrics.count("PublishedIpCacheMiss")
+    with metrics.invocation("lambda_handler"):
+        pass
+
+    first, second = emitted_records(capsys)
+    definition = first["_aws"]["CloudWatchMetrics"][0]
+    assert definition["Namespace"] == metrics.METRICS_NAMESPACE
+    assert definition["Dimensions"] == [["Handler"]]
+    assert {"Name": "ParseDuration", "Unit": "Milliseconds"} in definition["Metrics"]
+    assert {"Name": "PublishedIpCacheMiss", "Unit": "Count"} in definition["Metrics"]
+    assert first["Handler"] == "lambda_handler"
+    assert first["RequestId"] == "request-1"
+    assert first["PublishedIpCacheMiss"] == 2
+    assert first["ParseDuration"] >= 0
+    assert first["InvocationDuration"] >= first["ParseDuration"]
+    assert first["ColdStart"] == 1
+    assert second["ColdStart"] == 0
+
+
+def test_metrics_outside_invocation(capsys: pytest.CaptureFixture) -> None:
+    """Test that metrics outside an invocation are ignored.
+
+    :type capsys: pytest.CaptureFixture
+    :param capsys:
+    :return:
+    """
+    with metrics.phase("Parse"):
+        metrics.count("ApiCalls")
+
+    assert metrics.current() is None
+    assert emitted_records(capsys) == []
+
+
+def test_instrument_client_counts_api_calls() -> None:
+    """Test that every API call of an instrumented client is counted.
+
+    :return:
+    """
+    client = metrics.instrument_client(
+        boto3.client(
+            "route53",
+            region_name="us-east-1",
+            aws_access_key_id="test",
+            aws_secret_access_key="test",
+        )
+    )
+    with Stubber(client) as stubber:
+        stubber.add_response("get_hosted_zone_count", {"HostedZoneCount": 1})
+        stubber.add_response("get_hosted_zone_count", {"HostedZoneCount": 1})
+        with metrics.invocation("lambda_handler") as invocation_metrics:
+            client.get_hosted_zone_count()
+            client.get_hosted_zone_count()
+
+    assert invocation_metrics.counters["ApiCalls"] == 2
+    assert invocation_metrics.properties["ApiCallsByOperation"] == {
+        "route53.GetHostedZoneCount": 2
+    }
+
+
+def test_lambda_handler_emits_phases(
+    capsys: pytest.CaptureFixture,
+    mocked_route_53_client: MagicMock,
+    mocked_secrets_manager_cache: MagicMock,
+) -> None:
+    """Test that lambda_handler() times its phases and reports cache misses.
+
+    :type capsys: pytest.CaptureFixture
+    :param capsys:
+    :type mocked_route_53_client: MagicMock
+    :param mocked_route_53_client:
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :return:
+    """
+    test_token = token_hex()
+    event: dict = {
+        "queryStringParameters": {
+            "client_id": "client",
+            "domain": "test_domain",
+            "ip": "127.0.0.1",
+            "token": test_token,
+        }
+    }
+    mocked_secrets_manager_cache.get_secret_string.return_value = test_token
+    mocked_route_53_client.list_resource_record_sets.return_value = {
+        "ResourceRecordSets": [],
+        "IsTruncated": False,
+    }
+
+    lambda_handler(event, {})
+    lambda_handler(event, {})
+
+    first, second = emitted_records(capsys)
+    for phase in ("Parse", "Secret", "ReadRecords", "SubmitChanges"):
+        assert f"{phase}Duration" in first
+    assert first["StatusCode"] == 200
+    assert first["PublishedIpCacheMiss"] == 1
+    assert first["ZoneSnapshotCacheMiss"] == 1
+    assert second["PublishedIpCacheHit"] == 1
+    assert "ReadRecordsDuration" not in second
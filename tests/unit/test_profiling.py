@@ -0,0 +1,78 @@
+"""Tests for the memory profiling of invocations."""
+
+import json
+import tracemalloc
+from collections.abc import Iterator
+from secrets import token_hex
+from unittest.mock import MagicMock
+
+import pytest
+
+from aws import metrics
+from aws.lambda_function import lambda_handler
+
+
+@pytest.fixture(scope="function")
+def profiling(monkeypatch: pytest.MonkeyPatch) -> Iterator[None]:
+    """Enable profiling and stop tracing allocations afterwards.
+
+    :type monkeypatch: pytest.MonkeyPatch
+    :param monkeypatch:
+    :return:
+    """
+    monkeypatch.setattr("aws.profiling.PROFILING_ENABLED", True)
+    monkeypatch.setattr(metrics, "_cold_start", True)
+    yield
+    tracemalloc.stop()
+
+
+def test_lambda_handler_profiling(
+    capsys: pytest.CaptureFixture,
+    profiling: None,
+    mocked_route_53_client: MagicMock,
+    mocked_secrets_manager_cache: MagicMock,
+) -> None:
+    """Test that profiled invocations report their memory usage.
+
+    :type capsys: pytest.CaptureFixture
+    :param capsys:
+    :type profiling: None
+    :param profiling:
+    :type mocked_route_53_client: MagicMock
+    :param mocked_route_53_client:
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :return:
+    """
+    test_token = token_hex()
+    event: dict = {
+        "queryStringParameters": {
+            "client_id": "client",
+            "domain": "test_domain",
+            "ip": "127.0.0.1",
+            "token": test_token,
+        }
+    }
+    mocked_secrets_manager_cache.get_secret_string.return_value = test_token
+    mocked_route_53_client.list_resource_record_sets.return_value = {
+        "ResourceRecordSets": [],
+        "IsTruncated": False,
+    }
+
+    lambda_handler(event, {})
+    lambda_handler(event, {})
+
+    first, second = (
+        json.loads(line)
+        for line in capsys.readouterr().out.splitlines()
+        if line.startswith('{"_aws"')
+    )
+    definition = first["_aws"]["CloudWatchMetrics"][0]
+    for name in ("AllocatedPeak", "AllocatedRetained", "MaxRss", "ColdStartRss"):
+        assert {"Name": name, "Unit": "Kilobytes"} in definition["Metrics"]
+    assert first["AllocatedPeak"] >= first["AllocatedRetained"]
+    assert first["MaxRss"] >= first["ColdStartRss"] > 0
+    assert first["AllocationHotSpots"]
+    assert {"Location", "SizeKiB", "Count"} == set(first["AllocationHotSpots"][0])
+    assert "ColdStartRss" not in second
+    assert second["AllocatedPeak"] > 0
@@ -0,0 +1,300 @@
+"""Tests for rate limiting of AWS API calls and client requests."""
+
+import json
+from unittest.mock import MagicMock
+
+import pytest
+from botocore.exceptions import EndpointConnectionError, ReadTimeoutError
+
+from aws.deadline import DeadlineExceeded
+from aws.lambda_function import lambda_handler
+from aws.ratelimit import (
+    AdaptiveRateLimiter,
+    ClientRateLimiter,
+    DynamoDbClientRateLimiter,
+    MemoryClientRateLimiter,
+    TokenBucket,
+)
+from aws.registry import Registry
+from tests.fakes import FakeDynamoDbClient, client_error
+
+
+class FakeClock:
+    """Clock which only advances when told to."""
+
+    def __init__(self):
+        """Start at 0."""
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        """Return the current time.
+
+        :return:
+        """
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        """Advance the time.
+
+        :type seconds: float
+        :param seconds:
+        :return:
+        """
+        self.now += seconds
+
+
+def test_token_bucket() -> None:
+    """Test taking tokens and refilling the bucket.
+
+    :return:
+    """
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, capacity=2, clock=clock)
+
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0.5
+
+    clock.sleep(0.5)
+    assert bucket.try_acquire() == 0
+    assert bucket.reserve() == 0.5
+    assert bucket.reserve() == 1.0
+
+
+def test_adaptive_rate_limiter() -> None:
+    """Test that the rate halves on throttling and recovers on success.
+
+    :return:
+    """
+    clock = FakeClock()
+    rate_limiter = AdaptiveRateLimiter(
+        max_rate=4, min_rate=1, recovery=1, clock=clock, sleep=clock.sleep
+    )
+
+    for _ in range(4):
+        assert rate_limiter.acquire() == 0
+    assert rate_limiter.acquire() == 0.25
+    assert clock.now == 0.25
+
+    rate_limiter.on_throttle()
+    assert rate_limiter.rate == 2
+    rate_limiter.on_throttle()
+    rate_limiter.on_throttle()
+    assert rate_limiter.rate == 1
+
+    for _ in range(5):
+        rate_limiter.on_success()
+    assert rate_limiter.rate == 4
+
+
+@pytest.fixture(scope="function", params=["memory", "dynamodb"])
+def client_rate_limiter(
+    request: pytest.FixtureRequest,
+) -> tuple[ClientRateLimiter, FakeClock]:
+    """Provide each client rate limiter with 1 request per second and a burst of 2.
+
+    :type request: pytest.FixtureRequest
+    :param request:
+    :return:
+    """
+    clock = FakeClock()
+    if request.param == "memory":
+        limiter = MemoryClientRateLimiter(rate=1, burst=2, clock=clock)
+    else:
+        limiter = DynamoDbClientRateLimiter(
+            FakeDynamoDbClient(), "rate-limits", rate=1, burst=2, clock=clock
+        )
+    return limiter, clock
+
+
+def test_client_rate_limiter(
+    client_rate_limiter: tuple[ClientRateLimiter, FakeClock],
+) -> None:
+    """Test that every client has its own bucket.
+
+    :type client_rate_limiter: tuple[ClientRateLimiter, FakeClock]
+    :param client_rate_limiter:
+    :return:
+    """
+    limiter, clock = client_rate_limiter
+
+    assert limiter.acquire("router") == 0
+    assert limiter.acquire("router") == 0
+    assert limiter.acquire("router") == pytest.approx(1)
+    assert limiter.acquire("other-router") == 0
+
+    clock.sleep(0.5)
+    assert limiter.acquire("router") == pytest.approx(0.5)
+
+    clock.sleep(0.5)
+    assert limiter.acquire("router") == 0
+
+
+def test_memory_client_rate_limiter_drops_least_recently_used() -> None:
+    """Test that the number of buckets is bounded.
+
+    :return:
+    """
+    limiter = MemoryClientRateLimiter(rate=1, burst=1, max_clients=2)
+
+    for client_id in ("a", "b", "c"):
+        limiter.acquire(client_id)
+
+    assert list(limiter._buckets) == ["b", "c"]
+
+
+@pytest.mark.parametrize(
+    "exc",
+    [
+        client_error("InternalServerError", "GetItem"),
+        EndpointConnectionError(endpoint_url="https://dynamodb"),
+        ReadTimeoutError(endpoint_url="https://dynamodb"),
+        DeadlineExceeded("GetItem needs more than 0.000s, 0.000s remain"),
+    ],
+)
+def test_dynamodb_client_rate_limiter_allows_on_errors(exc: Exception) -> None:
+    """Test that requests are allowed if DynamoDB fails.
+
+    :type exc: Exception
+    :param exc:
+    :return:
+    """
+    client = MagicMock()
+    client.get_item.side_effect = exc
+    limiter = DynamoDbClientRateLimiter(client, "rate-limits", rate=1, burst=1)
+
+    assert limiter.acquire("router") == 0
+
+
+def test_lambda_handler_rate_limited(
+    registry: Registry,
+    mocked_route_53_client: MagicMock,
+    mocked_secrets_manager_cache: MagicMock,
+) -> None:
+    """Test that lambda_handler() answers with 429 above the client rate limit.
+
+    :type registry: Registry
+    :param registry:
+    :type mocked_route_53_client: MagicMock
+    :param mocked_route_53_client:
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :return:
+    """
+    registry.set(
+        "client_rate_limiter",
+        MemoryClientRateLimiter(rate=1 / 60, burst=1, clock=FakeClock()),
+    )
+    mocked_secrets_manager_cache.get_secret_string.return_value = "token"
+    mocked_route_53_client.list_resource_record_sets.return_value = {
+        "ResourceRecordSets": [],
+        "IsTruncated": False,
+    }
+    event: dict = {
+        "queryStringParameters": {
+            "client_id": "router",
+            "domain": "test_domain",
+            "ip": "127.0.0.1",
+            "token": "token",
+        }
+    }
+
+    first_response: dict = lambda_handler(event, {})
+    second_response: dict = lambda_handler(event, {})
+
+    assert first_response["statusCode"] == 200
+    assert second_response["statusCode"] == 429
+    assert second_response["headers"] == {"Retry-After": "60"}
+    mocked_route_53_client.list_resource_record_sets.assert_called_once()
+
+
+def test_lambda_handler_rate_limits_only_plausible_clients(
+    registry: Registry,
+    mocked_secrets_manager_cache: MagicMock,
+) -> None:
+    """Test that made up client ids do not add state to the rate limiter.
+
+    :type registry: Registry
+    :param registry:
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :return:
+    """
+    client_rate_limiter = MemoryClientRateLimiter(
+        rate=1 / 60, burst=1, clock=FakeClock()
+    )
+    registry.set("client_rate_limiter", client_rate_limiter)
+    mocked_secrets_manager_cache.get_secret_string.side_effect = client_error(
+        "ResourceNotFoundException", "GetSecretValue"
+    )
+    event: dict = {
+        "queryStringParameters": {
+            "client_id": "scanner",
+            "domain": "test_domain",
+            "ip": "127.0.0.1",
+            "token": "token",
+        }
+    }
+
+    # The first request finds out that the client is unknown
+    assert lambda_handler(event, {})["statusCode"] == 401
+    assert client_rate_limiter.acquire("scanner") > 0
+    for _ in range(3):
+        assert lambda_handler(event, {})["statusCode"] == 401
+    mocked_secrets_manager_cache.get_secret_string.assert_called_once()
+
+    event["queryStringParameters"]["client_id"] = "not a secret name"
+    assert lambda_handler(event, {})["statusCode"] == 401
+    assert client_rate_limiter.acquire("not a secret name") == 0
+
+
+@pytest.mark.parametrize(
+    "event",
+    [
+        {
+            "queryStringParameters": {
+                "client_id": "router",
+                "domain": "test_domain",
+                "ip": "127.0.0.1",
+                "token": "token",
+            }
+        },
+        {
+            "requestContext": {"http": {"method": "POST"}},
+            "body": json.dumps(
+                {"client_id": "router", "token": "token", "updates": []}
+            ),
+        },
+    ],
+)
+def test_lambda_handler_rate_limit_credential_document_unavailable(
+    registry: Registry,
+    mocked_secrets_manager_cache: MagicMock,
+    monkeypatch: pytest.MonkeyPatch,
+    event: dict,
+) -> None:
+    """Test that failing to read the credential document is answered with 503.
+
+    :type registry: Registry
+    :param registry:
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :type monkeypatch: pytest.MonkeyPatch
+    :param monkeypatch:
+    :type event: dict
+    :param event:
+    :return:
+    """
+    monkeypatch.setattr("aws.lambda_function.CREDENTIALS_SECRET_ID", "credentials")
+    registry.set(
+        "client_rate_limiter",
+        MemoryClientRateLimiter(rate=1 / 60, burst=1, clock=FakeClock()),
+    )
+    mocked_secrets_manager_cache.get_secret_string.side_effect = client_error(
+        "ThrottlingException", "GetSecretValue"
+    )
+
+    response: dict = lambda_handler(event, {})
+
+    assert response["statusCode"] == 503
+    assert response["headers"] == {"Retry-After": "1"}
@@ -0,0 +1,277 @@
+"""Tests for the reconciliation of hosted zones with a desired state."""
+
+import io
+import json
+
+import pytest
+
+from aws.reconcile import (
+    DesiredRecordSet,
+    index_desired_state,
+    plan_changes,
+    read_jsonl,
+    read_yaml,
+    reconcile,
+)
+from benchmarks.fakes import FakeRoute53
+
+HOSTED_ZONE_ID = "ZONE"
+
+
+@pytest.fixture(scope="function")
+def route_53() -> FakeRoute53:
+    """Provide a fake Route 53 with a hosted zone of a few records.
+
+    :return:
+    """
+    route_53 = FakeRoute53(page_size=2)
+    route_53.add_hosted_zone(HOSTED_ZONE_ID, "example.com")
+    route_53.add_record(HOSTED_ZONE_ID, "a.example.com", "A", ["192.0.2.1"])
+    route_53.add_record(HOSTED_ZONE_ID, "b.example.com", "A", ["192.0.2.2"])
+    route_53.add_record(HOSTED_ZONE_ID, "b.example.com", "AAAA", ["2001:db8::2"])
+    route_53.add_record(HOSTED_ZONE_ID, "c.example.com", "TXT", ['"keep"'])
+    return route_53
+
+
+def jsonl(*entries: dict) -> io.StringIO:
+    """Build a JSONL desired state file.
+
+    :type entries: dict
+    :param entries:
+    :return:
+    """
+    return io.StringIO("".join(json.dumps(entry) + "\n" for entry in entries))
+
+
+def test_reconcile(route_53: FakeRoute53) -> None:
+    """Test that only differing record sets are changed and pruned.
+
+    :type route_53: FakeRoute53
+    :param route_53:
+    :return:
+    """
+    desired = index_desired_state(
+        read_jsonl(
+            jsonl(
+                {"name": "A.example.com.", "type": "A", "values": ["192.0.2.1"]},
+                {"name": "b.example.com", "type": "A", "value": "198.51.100.2"},
+                {"name": "d.example.com", "type": "A", "ttl": 60, "value": "192.0.2.4"},
+            )
+        ),
+        default_ttl=300,
+    )
+
+    report = reconcile(
+        route_53, HOSTED_ZONE_ID, desired, prune_types=frozenset({"A", "AAAA"})
+    )
+
+    assert report["summary"] == {
+        "desired": 3,
+        "live": 4,
+        "created": 1,
+        "updated": 1,
+        "deleted": 1,
+        "unchanged": 1,
+        "conflicting": 0,
+    }
+    assert len(report["change_ids"]) == 1
+    records = route_53.record_sets[HOSTED_ZONE_ID]
+    assert records[("b.example.com.", "A")]["ResourceRecords"] == [
+        {"Value": "198.51.100.2"}
+    ]
+    assert records[("d.example.com.", "A")]["TTL"] == 60
+    assert ("b.example.com.", "AAAA") not in records
+    assert ("c.example.com.", "TXT") in records
+
+    route_53.calls.clear()
+    report = reconcile(
+        route_53, HOSTED_ZONE_ID, desired, prune_types=frozenset({"A", "AAAA"})
+    )
+
+    assert report["summary"]["unchanged"] == 3
+    assert "change_ids" not in report
+    assert set(route_53.calls) == {"list_resource_record_sets"}
+
+
+def test_reconcile_dry_run(route_53: FakeRoute53) -> None:
+    """Test that a dry run reports the changes without submitting them.
+
+    :type route_53: FakeRoute53
+    :param route_53:
+    :return:
+    """
+    desired = index_desired_state(
+        read_jsonl(jsonl({"name": "a.example.com", "type": "A", "value": "192.0.2.9"})),
+        default_ttl=300,
+    )
+
+    report = reconcile(route_53, HOSTED_ZONE_ID, desired, dry_run=True)
+
+    assert report["summary"]["updated"] == 1
+    assert report["summary"]["deleted"] == 0
+    assert report["changes"] == [
+        {
+            "Action": "UPSERT",
+            "ResourceRecordSet": {
+                "Name": "a.example.com",
+                "Type": "A",
+                "TTL": 300,
+                "ResourceRecords": [{"Value": "192.0.2.9"}],
+            },
+        }
+    ]
+    assert route_53.calls["change_resource_record_sets"] == 0
+
+
+def test_reconcile_skips_alias_and_routing_policy_conflicts(
+    route_53: FakeRoute53,
+) -> None:
+    """Test that alias records and record sets with a routing policy are kept.
+
+    :type route_53: FakeRoute53
+    :param route_53:
+    :return:
+    """
+    records = route_53.record_sets[HOSTED_ZONE_ID]
+    records[("www.example.com.", "A")] = {
+        "Name": "www.example.com.",
+        "Type": "A",
+        "AliasTarget": {
+            "HostedZoneId": "Z2FDTNDATAQYW2",
+            "DNSName": "d111111abcdef8.cloudfront.net.",
+            "EvaluateTargetHealth": False,
+        },
+    }
+    records[("api.example.com.", "A")] = {
+        "Name": "api.example.com.",
+        "Type": "A",
+        "SetIdentifier": "eu-central-1",
+        "Weight": 100,
+        "TTL": 60,
+        "ResourceRecords": [{"Value": "192.0.2.20"}],
+    }
+    desired = index_desired_state(
+        read_jsonl(
+            jsonl(
+                {"name": "www.example.com", "type": "A", "value": "192.0.2.10"},
+                {"name": "API.example.com", "type": "A", "value": "192.0.2.21"},
+                {"name": "www.example.com", "type": "AAAA", "value": "2001:db8::10"},
+            )
+        ),
+        default_ttl=300,
+    )
+
+    report = reconcile(route_53, HOSTED_ZONE_ID, desired, dry_run=True)
+
+    assert report["summary"]["created"] == 1
+    assert report["summary"]["conflicting"] == 2
+    assert report["conflicts"] == [
+        {"name": "www.example.com", "type": "A"},
+        {"name": "api.example.com", "type": "A"},
+    ]
+    assert [change["ResourceRecordSet"]["Type"] for change in report["changes"]] == [
+        "AAAA"
+    ]
+
+
+def test_reconcile_chunks_change_batches(route_53: FakeRoute53) -> None:
+    """Test that thousands of changes are split into batches within the limits.
+
+    :type route_53: FakeRoute53
+    :param route_53:
+    :return:
+    """
+    desired = index_desired_state(
+        (
+            (index, {"name": f"host-{index}.example.com", "type": "A", "value": ip})
+            for index, ip in enumerate(["203.0.113.1"] * 1200)
+        ),
+        default_ttl=300,
+    )
+    messages: list[str] = []
+
+    report = reconcile(route_53, HOSTED_ZONE_ID, desired, progress=messages.append)
+
+    assert report["summary"]["created"] == 1200
+    assert len(report["change_ids"]) == 3
+    assert messages[-1] == "Submitted batch 3/3, 1200/1200 changes"
+
+
+def test_plan_changes_compares_normalized_values() -> None:
+    """Test that value order and IPv6 notation do not cause changes.
+
+    :return:
+    """
+    desired = index_desired_state(
+        [
+            (
+                1,
+                {
+                    "name": "a.example.com",
+                    "type": "AAAA",
+                    "values": ["2001:db8::2", "2001:db8::1"],
+                },
+            )
+        ],
+        default_ttl=300,
+    )
+    live = {
+        "Name": "a.example.com.",
+        "Type": "AAAA",
+        "TTL": 300,
+        "ResourceRecords": [
+            {"Value": "2001:0db8:0000:0000:0000:0000:0000:0001"},
+            {"Value": "2001:db8::2"},
+        ],
+    }
+
+    assert plan_changes(desired, [live]).changes == []
+    assert len(plan_changes(desired, [{**live, "TTL": 60}]).changes) == 1
+
+
+@pytest.mark.parametrize(
+    "entry",
+    [
+        "a.example.com",
+        {"type": "A", "value": "192.0.2.1"},
+        {"name": "a.example.com", "type": "SOA", "value": "x"},
+        {"name": "a.example.com", "type": "A", "value": "2001:db8::1"},
+        {"name": "a.example.com", "type": "A", "value": "192.0.2.1", "ttl": "60"},
+        {"name": "a.example.com", "type": "A", "values": []},
+    ],
+)
+def test_desired_record_set_invalid(entry: dict) -> None:
+    """Test that invalid entries are rejected.
+
+    :type entry: dict
+    :param entry:
+    :return:
+    """
+    with pytest.raises(ValueError):
+        DesiredRecordSet.from_dict(entry, default_ttl=300)
+
+
+def test_index_desired_state_duplicate() -> None:
+    """Test that a record set may only be listed once.
+
+    :return:
+    """
+    entry = {"name": "a.example.com", "type": "A", "value": "192.0.2.1"}
+
+    with pytest.raises(ValueError, match="Entry 2: Duplicate"):
+        index_desired_state([(1, entry), (2, entry)], default_ttl=300)
+
+
+def test_read_yaml() -> None:
+    """Test reading a YAML desired state file.
+
+    :return:
+    """
+    pytest.importorskip("yaml")
+    stream = io.StringIO(
+        "records:\n  - name: a.example.com\n    type: A\n    values: [192.0.2.1]\n"
+    )
+
+    desired = index_desired_state(read_yaml(stream), default_ttl=300)
+
+    assert desired[("a.example.com", "A")].values == ("192.0.2.1",)
@@ -0,0 +1,85 @@
+"""Tests for the client and cache registry."""
+
+from unittest.mock import MagicMock
+
+import pytest
+from pytest_mock import MockerFixture
+
+from aws import registry as registry_module
+from aws.lambda_function import route_53_client, secrets_manager_cache
+from aws.registry import Registry, use_registry
+
+
+def test_registry_creates_instance_once(mocker: MockerFixture) -> None:
+    """Test that an instance is created once and then reused.
+
+    :type mocker: MockerFixture
+    :param mocker:
+    :return:
+    """
+    factory = mocker.MagicMock(side_effect=lambda: object())
+    registry_module.register("test_instance", factory)
+    registry = Registry()
+
+    first = registry.get("test_instance")
+    second = registry.get("test_instance")
+
+    assert first is second
+    factory.assert_called_once()
+
+
+def test_registry_reset(mocker: MockerFixture) -> None:
+    """Test that resetting the registry creates a new instance.
+
+    :type mocker: MockerFixture
+    :param mocker:
+    :return:
+    """
+    registry_module.register("test_instance", lambda: object())
+    registry = Registry()
+
+    first = registry.get("test_instance")
+    registry.reset("test_instance")
+
+    assert registry.get("test_instance") is not first
+
+
+def test_registry_unknown_name() -> None:
+    """Test that an unknown name raises a KeyError.
+
+    :return:
+    """
+    with pytest.raises(KeyError):
+        Registry().get("unknown_instance")
+
+
+def test_clients_are_reused_across_invocations(registry: Registry) -> None:
+    """Test that the Route53 client and the secrets cache are only created once.
+
+    :type registry: Registry
+    :param registry:
+    :return:
+    """
+    client = MagicMock()
+    registry.set("route53", client)
+    registry.set("secretsmanager", MagicMock())
+
+    assert route_53_client() is client
+    assert route_53_client() is client
+    assert secrets_manager_cache() is secrets_manager_cache()
+
+
+def test_use_registry_isolates_instances() -> None:
+    """Test that instances are scoped to the registry in use.
+
+    :return:
+    """
+    outer = MagicMock()
+    inner = MagicMock()
+    registry_module.get_registry().set("route53", outer)
+
+    with use_registry(Registry()) as registry:
+        registry.set("route53", inner)
+        assert route_53_client() is inner
+
+    assert route_53_client() is outer
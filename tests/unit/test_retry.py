@@ -0,0 +1,191 @@
+"""Tests for retries of AWS API calls."""
+
+from unittest.mock import MagicMock
+
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+from pytest_mock import MockerFixture
+
+from aws import metrics
+from aws.ratelimit import AdaptiveRateLimiter
+from aws.retry import (
+    RetryingClient,
+    RetryMetrics,
+    RetryPolicy,
+    call_with_retry,
+    is_retriable_error,
+    is_throttling_error,
+)
+
+
+def client_error(code: str, status_code: int = 400) -> ClientError:
+    """Build a ClientError.
+
+    :type code: str
+    :param code:
+    :type status_code: int
+    :param status_code:
+    :return:
+    """
+    return ClientError(
+        {
+            "Error": {"Code": code, "Message": code},
+            "ResponseMetadata": {"HTTPStatusCode": status_code},
+        },
+        "ChangeResourceRecordSets",
+    )
+
+
+@pytest.mark.parametrize(
+    "exc, retriable, throttling",
+    [
+        (client_error("Throttling"), True, True),
+        (client_error("PriorRequestNotComplete"), True, True),
+        (client_error("ServiceUnavailable", 503), True, False),
+        (client_error("SomethingNew", 500), True, False),
+        (client_error("InvalidChangeBatch"), False, False),
+        (client_error("ResourceNotFoundException"), False, False),
+        (EndpointConnectionError(endpoint_url="https://route53"), True, False),
+        (ValueError("bug"), False, False),
+    ],
+)
+def test_error_classification(
+    exc: Exception, retriable: bool, throttling: bool
+) -> None:
+    """Test the classification of retriable and fatal errors.
+
+    :type exc: Exception
+    :param exc:
+    :type retriable: bool
+    :param retriable:
+    :type throttling: bool
+    :param throttling:
+    :return:
+    """
+    assert is_retriable_error(exc) is retriable
+    assert is_throttling_error(exc) is throttling
+
+
+def test_call_with_retry(mocker: MockerFixture) -> None:
+    """Test that throttled calls are retried and slow down the rate limiter.
+
+    :type mocker: MockerFixture
+    :param mocker:
+    :return:
+    """
+    operation = mocker.MagicMock(
+        side_effect=[client_error("Throttling"), client_error("Throttling"), "ok"]
+    )
+    sleep = mocker.MagicMock()
+    rate_limiter = AdaptiveRateLimiter(max_rate=100, sleep=sleep)
+    metrics = RetryMetrics()
+
+    result = call_with_retry(
+        operation,
+        policy=RetryPolicy(max_attempts=3),
+        rate_limiter=rate_limiter,
+        metrics=metrics,
+        sleep=sleep,
+    )
+
+    assert result == "ok"
+    assert operation.call_count == 3
+    assert rate_limiter.rate == 25.1
+    snapshot = metrics.snapshot()
+    assert snapshot["calls"] == 3
+    assert snapshot["retries"] == 2
+    assert snapshot["throttles"] == 2
+    assert snapshot["failures"] == 0
+    assert snapshot["wait_time"] == sum(call.args[0] for call in sleep.call_args_list)
+
+
+def test_call_with_retry_gives_up(mocker: MockerFixture) -> None:
+    """Test that calls are retried at most max_attempts times.
+
+    :type mocker: MockerFixture
+    :param mocker:
+    :return:
+    """
+    operation = mocker.MagicMock(side_effect=client_error("Throttling"))
+    metrics = RetryMetrics()
+
+    with pytest.raises(ClientError):
+        call_with_retry(
+            operation,
+            policy=RetryPolicy(max_attempts=3),
+            metrics=metrics,
+            sleep=mocker.MagicMock(),
+        )
+
+    assert operation.call_count == 3
+    assert metrics.failures == 1
+
+
+def test_call_with_retry_invocation_metrics(mocker: MockerFixture) -> None:
+    """Test that each invocation reports its own retries.
+
+    :type mocker: MockerFixture
+    :param mocker:
+    :return:
+    """
+    mocker.patch("aws.metrics.METRICS_ENABLED", False)
+    sleep = mocker.MagicMock()
+    retry_metrics = RetryMetrics()
+
+    with metrics.invocation("lambda_handler") as first:
+        with pytest.raises(ClientError):
+            call_with_retry(
+                mocker.MagicMock(side_effect=client_error("Throttling")),
+                policy=RetryPolicy(max_attempts=2),
+                metrics=retry_metrics,
+                sleep=sleep,
+            )
+    with metrics.invocation("lambda_handler") as second:
+        call_with_retry(
+            mocker.MagicMock(return_value="ok"),
+            policy=RetryPolicy(),
+            metrics=retry_metrics,
+            sleep=sleep,
+        )
+
+    assert first.counters == {"Retries": 1, "Throttles": 2, "ApiCallFailures": 1}
+    assert first.durations["RetryWait"] == sleep.call_args.args[0]
+    assert not second.counters
+    assert "RetryWait" not in second.durations
+    assert retry_metrics.throttles == 2
+
+
+def test_call_with_retry_fatal_error(mocker: MockerFixture) -> None:
+    """Test that fatal errors are not retried.
+
+    :type mocker: MockerFixture
+    :param mocker:
+    :return:
+    """
+    operation = mocker.MagicMock(side_effect=client_error("InvalidChangeBatch"))
+    sleep = mocker.MagicMock()
+
+    with pytest.raises(ClientError):
+        call_with_retry(operation, policy=RetryPolicy(), sleep=sleep)
+
+    operation.assert_called_once()
+    sleep.assert_not_called()
+
+
+def test_retrying_client(mocker: MockerFixture) -> None:
+    """Test that only API operations of the client are retried.
+
+    :type mocker: MockerFixture
+    :param mocker:
+    :return:
+    """
+    mocker.patch("aws.retry.time.sleep")
+    client = MagicMock()
+    client.meta.method_to_api_mapping = {"get_change": "GetChange"}
+    client.get_change.side_effect = [client_error("Throttling"), {"ChangeInfo": {}}]
+    retrying_client = RetryingClient(client, policy=RetryPolicy())
+
+    assert retrying_client.get_change(Id="C1") == {"ChangeInfo": {}}
+    assert client.get_change.call_count == 2
+    assert retrying_client.meta is client.meta
+    assert retrying_client.metrics.retries == 1
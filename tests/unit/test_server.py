@@ -0,0 +1,282 @@
+"""Tests for the self-hosted HTTP server."""
+
+import asyncio
+import json
+import threading
+from collections.abc import Awaitable, Callable
+from http.client import HTTPConnection, HTTPResponse
+from typing import Any
+from unittest.mock import MagicMock
+
+import pytest
+from pytest_mock import MockerFixture
+
+from aws.lambda_function import ZONE_CONCURRENCY, create_client_config, lambda_handler
+from aws.server import Request, Server, build_event, main
+
+
+def serve(
+    handler: Callable[[dict, Any], dict],
+    client: Callable[[tuple[str, int]], Awaitable[Any]],
+    **kwargs: Any,
+) -> Any:
+    """Start a server on a free port, run the client against it and shut down.
+
+    :type handler: Callable[[dict, Any], dict]
+    :param handler:
+    :type client: Callable[[tuple[str, int]], Awaitable[Any]]
+    :param client: coroutine function called with the address of the server
+    :param kwargs: arguments of the server
+    :return: result of the client
+    """
+
+    async def run() -> Any:
+        server = Server(handler, port=0, **kwargs)
+        await server.start()
+        try:
+            return await client(server.address)
+        finally:
+            await server.shutdown(grace_period=1)
+
+    return asyncio.run(run())
+
+
+def request(
+    address: tuple[str, int], method: str, target: str, body: str | None = None
+) -> tuple[HTTPResponse, bytes]:
+    """Send a request with a new connection.
+
+    :type address: tuple[str, int]
+    :param address:
+    :type method: str
+    :param method:
+    :type target: str
+    :param target:
+    :type body: str | None
+    :param body:
+    :return: response and its body
+    """
+    connection = HTTPConnection(*address, timeout=5)
+    try:
+        connection.request(method, target, body=body)
+        response = connection.getresponse()
+        return response, response.read()
+    finally:
+        connection.close()
+
+
+def test_build_event() -> None:
+    """Test that requests are turned into function URL events.
+
+    :return:
+    """
+    event = build_event(
+        Request(
+            method="POST",
+            target="/update?domain=a.example.com&domain=b.example.com&ip=",
+            version="HTTP/1.1",
+            headers={"user-agent": "router"},
+            body=b"\xff",
+        ),
+        source_ip="192.0.2.1",
+        request_id="request",
+    )
+
+    assert event["rawPath"] == "/update"
+    assert event["queryStringParameters"] == {
+        "domain": "a.example.com,b.example.com",
+        "ip": "",
+    }
+    assert event["requestContext"]["http"]["method"] == "POST"
+    assert event["requestContext"]["http"]["sourceIp"] == "192.0.2.1"
+    assert event["requestContext"]["http"]["userAgent"] == "router"
+    assert event["body"] == "/w=="
+    assert event["isBase64Encoded"]
+
+
+def test_server_passes_requests_to_handler() -> None:
+    """Test that GET and POST requests reach the handler and its response is sent.
+
+    :return:
+    """
+    events: list[dict] = []
+
+    def handler(event: dict, context: Any) -> dict:
+        events.append(event)
+        assert context.get_remaining_time_in_millis() > 0
+        return {
+            "statusCode": 202,
+            "headers": {"X-Request-Id": context.aws_request_id},
+            "body": json.dumps("queued"),
+        }
+
+    async def client(address: tuple[str, int]) -> list:
+        return [
+            await asyncio.to_thread(request, address, "GET", "/?client_id=client"),
+            await asyncio.to_thread(request, address, "POST", "/", body='{"a": 1}'),
+        ]
+
+    (get_response, get_body), (post_response, post_body) = serve(handler, client)
+
+    assert get_response.status == 202
+    assert get_response.getheader("Content-Type") == "application/json"
+    assert json.loads(get_body) == "queued"
+    assert post_response.status == 202
+    assert json.loads(post_body) == "queued"
+    assert events[0]["queryStringParameters"] == {"client_id": "client"}
+    assert events[1]["body"] == '{"a": 1}'
+    assert events[1]["requestContext"]["http"]["sourceIp"] == "127.0.0.1"
+    assert (
+        get_response.getheader("X-Request-Id")
+        == events[0]["requestContext"]["requestId"]
+    )
+
+
+def test_server_handles_requests_concurrently() -> None:
+    """Test that slow handler calls do not block other requests.
+
+    :return:
+    """
+    barrier = threading.Barrier(4, timeout=5)
+
+    def handler(event: dict, context: Any) -> dict:
+        barrier.wait()
+        return {"statusCode": 200, "body": json.dumps("ok")}
+
+    async def client(address: tuple[str, int]) -> list:
+        return await asyncio.gather(
+            *(asyncio.to_thread(request, address, "GET", "/") for _ in range(4))
+        )
+
+    responses = serve(handler, client, workers=4)
+
+    assert [response.status for response, _ in responses] == [200] * 4
+
+
+def test_server_health(mocker: MagicMock) -> None:
+    """Test that the health endpoint does not call the handler.
+
+    :type mocker: MagicMock
+    :param mocker:
+    :return:
+    """
+    handler = mocker.MagicMock()
+
+    async def client(address: tuple[str, int]) -> tuple[HTTPResponse, bytes]:
+        return await asyncio.to_thread(request, address, "GET", "/health")
+
+    response, body = serve(handler, client)
+
+    assert response.status == 200
+    assert json.loads(body) == {"status": "ok"}
+    handler.assert_not_called()
+
+
+def test_server_runs_lambda_handler() -> None:
+    """Test that the Lambda handler answers requests of the server.
+
+    :return:
+    """
+
+    async def client(address: tuple[str, int]) -> tuple[HTTPResponse, bytes]:
+        return await asyncio.to_thread(request, address, "GET", "/?client_id=client")
+
+    response, body = serve(lambda_handler, client)
+
+    assert response.status == 400
+    assert json.loads(body) == "Missing request parameters"
+
+
+@pytest.mark.parametrize(
+    "raw_request,status_code",
+    [
+        (b"GARBAGE\r\n\r\n", 400),
+        (b"GET / HTTP/2.0\r\n\r\n", 505),
+        (b"GET / HTTP/1.1\r\nContent-Length: 9999999\r\n\r\n", 413),
+        (b"DELETE / HTTP/1.1\r\n\r\n", 405),
+    ],
+)
+def test_server_rejects_invalid_requests(
+    mocker: MagicMock, raw_request: bytes, status_code: int
+) -> None:
+    """Test that invalid requests are answered without calling the handler.
+
+    :type mocker: MagicMock
+    :param mocker:
+    :type raw_request: bytes
+    :param raw_request:
+    :type status_code: int
+    :param status_code:
+    :return:
+    """
+    handler = mocker.MagicMock()
+
+    async def client(address: tuple[str, int]) -> bytes:
+        reader, writer = await asyncio.open_connection(*address)
+        writer.write(raw_request)
+        await writer.drain()
+        status_line = await reader.readline()
+        writer.close()
+        return status_line
+
+    status_line = serve(handler, client)
+
+    assert status_line.split()[1] == str(status_code).encode()
+    handler.assert_not_called()
+
+
+def test_server_shutdown_waits_for_requests_in_flight() -> None:
+    """Test that a shutdown answers requests in flight and stops accepting new ones.
+
+    :return:
+    """
+    started = threading.Event()
+    release = threading.Event()
+
+    def handler(event: dict, context: Any) -> dict:
+        started.set()
+        release.wait(timeout=5)
+        return {"statusCode": 200, "body": json.dumps("done")}
+
+    async def run() -> tuple:
+        server = Server(handler, port=0)
+        await server.start()
+        address = server.address
+        in_flight = asyncio.create_task(asyncio.to_thread(request, address, "GET", "/"))
+        await asyncio.to_thread(started.wait, 5)
+        shutdown = asyncio.create_task(server.shutdown(grace_period=5))
+        await asyncio.sleep(0.05)
+        draining = server.draining
+        release.set()
+        response, body = await in_flight
+        await shutdown
+        with pytest.raises(ConnectionError):
+            await asyncio.to_thread(request, address, "GET", "/health")
+        return draining, response, body
+
+    draining, response, body = asyncio.run(run())
+
+    assert draining
+    assert response.status == 200
+    assert response.getheader("Connection") == "close"
+    assert json.loads(body) == "done"
+
+
+def test_main_sizes_connection_pools(
+    mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Test that the AWS clients get a connection for every worker.
+
+    :type mocker: MockerFixture
+    :param mocker:
+    :type monkeypatch: pytest.MonkeyPatch
+    :param monkeypatch:
+    :return:
+    """
+    monkeypatch.setattr("aws.lambda_function.HANDLER_CONCURRENCY", 1)
+    mocker.patch("aws.server.asyncio.run", side_effect=lambda serve: serve.close())
+
+    assert main(["--workers", "64", "--no-prewarm"]) == 0
+
+    config = create_client_config()
+    assert config.max_pool_connections == 64 + ZONE_CONCURRENCY
@@ -0,0 +1,157 @@
+"""Tests for the execution environment startup."""
+
+import sys
+from unittest.mock import MagicMock
+
+import pytest
+from pytest_mock import MockerFixture
+
+from aws import startup
+from aws.registry import Registry
+
+
+@pytest.fixture(scope="function")
+def clients(registry: Registry, mocker: MockerFixture) -> dict[str, MagicMock]:
+    """Provide mocked clients in the registry.
+
+    :type registry: Registry
+    :param registry:
+    :type mocker: MockerFixture
+    :param mocker:
+    :return:
+    """
+    clients = {name: mocker.MagicMock() for name in startup.CLIENTS}
+    for name, client in clients.items():
+        registry.set(name, client)
+    return clients
+
+
+def test_prewarm(clients: dict[str, MagicMock]) -> None:
+    """Test that pre-warming does not call the APIs by default.
+
+    :type clients: dict[str, MagicMock]
+    :param clients:
+    :return:
+    """
+    startup.prewarm()
+
+    clients["route53"].get_hosted_zone_count.assert_not_called()
+    clients["secretsmanager"].list_secrets.assert_not_called()
+
+
+def test_prewarm_open_connections(clients: dict[str, MagicMock]) -> None:
+    """Test that pre-warming opens the connections if asked to.
+
+    :type clients: dict[str, MagicMock]
+    :param clients:
+    :return:
+    """
+    startup.prewarm(open_connections=True)
+
+    clients["route53"].get_hosted_zone_count.assert_called_once()
+    clients["secretsmanager"].list_secrets.assert_called_once_with(MaxResults=1)
+
+
+def test_prewarm_failure(clients: dict[str, MagicMock]) -> None:
+    """Test that failing to open connections does not fail the INIT phase.
+
+    :type clients: dict[str, MagicMock]
+    :param clients:
+    :return:
+    """
+    clients["route53"].get_hosted_zone_count.side_effect = RuntimeError()
+
+    startup.prewarm(open_connections=True)
+
+
+def test_initialize_outside_lambda(
+    clients: dict[str, MagicMock], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Test that nothing is pre-warmed outside of Lambda.
+
+    :type clients: dict[str, MagicMock]
+    :param clients:
+    :type monkeypatch: pytest.MonkeyPatch
+    :param monkeypatch:
+    :return:
+    """
+    monkeypatch.delenv("AWS_LAMBDA_FUNCTION_NAME", raising=False)
+
+    startup.initialize()
+
+    clients["route53"].get_hosted_zone_count.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "prewarm_connections,expected_calls", [(None, 0), ("false", 0), ("true", 1)]
+)
+def test_initialize_on_lambda(
+    clients: dict[str, MagicMock],
+    monkeypatch: pytest.MonkeyPatch,
+    prewarm_connections: str | None,
+    expected_calls: int,
+) -> None:
+    """Test pre-warming during the INIT phase.
+
+    :type clients: dict[str, MagicMock]
+    :param clients:
+    :type monkeypatch: pytest.MonkeyPatch
+    :param monkeypatch:
+    :type prewarm_connections: str | None
+    :param prewarm_connections:
+    :type expected_calls: int
+    :param expected_calls:
+    :return:
+    """
+    monkeypatch.setenv("AWS_LAMBDA_FUNCTION_NAME", "simple-dyn-dns")
+    monkeypatch.setenv("AWS_LAMBDA_INITIALIZATION_TYPE", "on-demand")
+    if prewarm_connections is None:
+        monkeypatch.delenv("PREWARM_CONNECTIONS", raising=False)
+    else:
+        monkeypatch.setenv("PREWARM_CONNECTIONS", prewarm_connections)
+
+    startup.initialize()
+
+    assert clients["route53"].get_hosted_zone_count.call_count == expected_calls
+
+
+def test_initialize_with_snap_start(
+    clients: dict[str, MagicMock],
+    monkeypatch: pytest.MonkeyPatch,
+    mocker: MockerFixture,
+    registry: Registry,
+) -> None:
+    """Test that the snapshot hooks are registered with SnapStart.
+
+    :type clients: dict[str, MagicMock]
+    :param clients:
+    :type monkeypatch: pytest.MonkeyPatch
+    :param monkeypatch:
+    :type mocker: MockerFixture
+    :param mocker:
+    :type registry: Registry
+    :param registry:
+    :return:
+    """
+    monkeypatch.setenv("AWS_LAMBDA_FUNCTION_NAME", "simple-dyn-dns")
+    monkeypatch.setenv("AWS_LAMBDA_INITIALIZATION_TYPE", "snap-start")
+    snapshot_restore_py = mocker.MagicMock()
+    monkeypatch.setitem(sys.modules, "snapshot_restore_py", snapshot_restore_py)
+
+    startup.initialize()
+
+    snapshot_restore_py.register_before_snapshot.assert_called_once_with(
+        startup.before_snapshot
+    )
+    snapshot_restore_py.register_after_restore.assert_called_once_with(
+        startup.after_restore
+    )
+    clients["route53"].get_hosted_zone_count.assert_not_called()
+
+    startup.before_snapshot()
+    clients["route53"].get_hosted_zone_count.assert_not_called()
+
+    prewarm = mocker.patch("aws.startup.prewarm")
+    startup.after_restore()
+    prewarm.assert_called_once_with(open_connections=False)
+    assert registry._instances == {}
@@ -0,0 +1,197 @@
+"""Tests for the state stores."""
+
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
+
+from aws.lambda_function import (
+    DnsRecord,
+    lambda_handler,
+    published_ip_key,
+    record_dns_records,
+)
+from aws.registry import Registry
+from aws.state import (
+    DynamoDbStateStore,
+    MemoryStateStore,
+    SqliteStateStore,
+    StateStore,
+)
+from aws.zone import ZoneSnapshot
+from tests.fakes import FakeDynamoDbClient
+
+KEY = ("ZONE", "foo.bar", "A")
+
+
+@pytest.fixture(scope="function", params=["memory", "sqlite", "dynamodb"])
+def state_store(request: pytest.FixtureRequest, tmp_path: Path) -> StateStore:
+    """Provide each state store implementation.
+
+    :type request: pytest.FixtureRequest
+    :param request:
+    :type tmp_path: Path
+    :param tmp_path:
+    :return:
+    """
+    if request.param == "memory":
+        return MemoryStateStore()
+    if request.param == "sqlite":
+        return SqliteStateStore(str(tmp_path / "state.db"))
+    return DynamoDbStateStore(FakeDynamoDbClient(), "published-records")
+
+
+def test_state_store_put_and_get(state_store: StateStore) -> None:
+    """Test writing and reading a record.
+
+    :type state_store: StateStore
+    :param state_store:
+    :return:
+    """
+    assert state_store.get(KEY) is None
+
+    assert state_store.put(KEY, "1.2.3.4", None)
+    record = state_store.get(KEY)
+    assert record.value == "1.2.3.4"
+    assert record.version == 1
+
+    assert state_store.put(KEY, "1.2.3.5", 1)
+    record = state_store.get(KEY)
+    assert record.value == "1.2.3.5"
+    assert record.version == 2
+
+
+def test_state_store_conditional_write(state_store: StateStore) -> None:
+    """Test that a writer with an outdated version does not clobber the record.
+
+    :type state_store: StateStore
+    :param state_store:
+    :return:
+    """
+    assert state_store.put(KEY, "1.2.3.4", None)
+    assert not state_store.put(KEY, "1.2.3.5", None)
+    assert state_store.put(KEY, "1.2.3.6", 1)
+    assert not state_store.put(KEY, "1.2.3.7", 1)
+
+    assert state_store.get(KEY).value == "1.2.3.6"
+
+
+def test_dynamodb_state_store_consistent_read() -> None:
+    """Test that records are read strongly consistent.
+
+    :return:
+    """
+    client = MagicMock()
+    client.get_item.return_value = {}
+    state_store = DynamoDbStateStore(client, "published-records")
+
+    assert state_store.get(KEY) is None
+    client.get_item.assert_called_once_with(
+        TableName="published-records",
+        Key={"pk": {"S": "ZONE#foo.bar#A"}},
+        ConsistentRead=True,
+    )
+
+
+def test_state_store_delete(state_store: StateStore) -> None:
+    """Test that a deleted record can be written as a new record again.
+
+    :type state_store: StateStore
+    :param state_store:
+    :return:
+    """
+    state_store.delete(KEY)
+    assert state_store.put(KEY, "1.2.3.4", None)
+
+    state_store.delete(KEY)
+    assert state_store.get(KEY) is None
+    assert state_store.put(KEY, "1.2.3.5", None)
+    assert state_store.get(KEY).version == 1
+
+
+def test_record_dns_records_conflict(
+    registry: Registry, state_store: StateStore
+) -> None:
+    """Test that a conflicting write makes the next request read Route 53.
+
+    :type registry: Registry
+    :param registry:
+    :type state_store: StateStore
+    :param state_store:
+    :return:
+    """
+    registry.set("state_store", state_store)
+    zone_snapshots = registry.get("zone_snapshots")
+    zone_snapshots.put(ZoneSnapshot(hosted_zone_id="ZONE", record_sets={}))
+    state_store.put(KEY, "1.2.3.4", None)
+    state = state_store.get(KEY)
+    # Another execution environment writes in the meantime
+    state_store.put(KEY, "1.2.3.5", state.version)
+
+    record_dns_records(
+        "ZONE",
+        [DnsRecord(domain="foo.bar", ip="1.2.3.4", values=("1.2.3.4",), state=state)],
+        {"A": "1.2.3.6"},
+    )
+
+    assert state_store.get(KEY) is None
+    assert registry.get("published_ips").get(published_ip_key(*KEY)) is None
+    assert zone_snapshots.cached("ZONE") is None
+
+
+def test_lambda_handler_uses_state_store_on_cold_start(
+    mocked_route_53_client: MagicMock,
+    mocked_secrets_manager_cache: MagicMock,
+    route_53_client_response: dict,
+    registry: Registry,
+    state_store: StateStore,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Test that a cold start answers a no-op update from the state store.
+
+    :type mocked_route_53_client: MagicMock
+    :param mocked_route_53_client:
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :type route_53_client_response: dict
+    :param route_53_client_response:
+    :type registry: Registry
+    :param registry:
+    :type state_store: StateStore
+    :param state_store:
+    :type monkeypatch: pytest.MonkeyPatch
+    :param monkeypatch:
+    :return:
+    """
+    monkeypatch.setattr("aws.lambda_function.ROUTE_53_HOSTED_ZONE_ID", "ZONE")
+    event: dict = {
+        "queryStringParameters": {
+            "client_id": "client",
+            "domain": "foo.bar,cling.clang",
+            "ip": "123.134.84.62",
+            "token": "token",
+        }
+    }
+    mocked_secrets_manager_cache.get_secret_string.return_value = "token"
+    mocked_route_53_client.list_resource_record_sets.return_value = (
+        route_53_client_response
+    )
+    registry.set("state_store", state_store)
+
+    assert lambda_handler(event, {})["statusCode"] == 200
+    mocked_route_53_client.list_resource_record_sets.assert_called_once()
+    mocked_route_53_client.change_resource_record_sets.assert_called_once()
+
+    # Simulate a new execution environment sharing the state store
+    registry.reset("zone_snapshots", "published_ips")
+    assert lambda_handler(event, {})["statusCode"] == 200
+    mocked_route_53_client.list_resource_record_sets.assert_called_once()
+    mocked_route_53_client.change_resource_record_sets.assert_called_once()
+
+    # A changed IP is written without listing the zone
+    registry.reset("zone_snapshots", "published_ips")
+    event["queryStringParameters"]["ip"] = "123.134.84.63"
+    assert lambda_handler(event, {})["statusCode"] == 200
+    mocked_route_53_client.list_resource_record_sets.assert_called_once()
+    assert mocked_route_53_client.change_resource_record_sets.call_count == 2
+    assert state_store.get(("ZONE", "foo.bar", "A")).value == "123.134.84.63"
@@ -0,0 +1,148 @@
+"""Tests for the adaptive TTLs."""
+
+from unittest.mock import MagicMock
+
+import pytest
+
+from aws.lambda_function import lambda_handler
+from aws.ttl import (
+    AdaptiveTtl,
+    ChangeRate,
+    ChangeRateStore,
+    DynamoDbChangeRateStore,
+    MemoryChangeRateStore,
+)
+from benchmarks.fakes import FakeRoute53
+from tests.fakes import FakeDynamoDbClient
+
+KEY = ("ZONE", "foo.bar", "A")
+DAY = 86400
+
+
+@pytest.fixture(scope="function", params=["memory", "dynamodb"])
+def change_rate_store(request: pytest.FixtureRequest) -> ChangeRateStore:
+    """Provide each change rate store implementation.
+
+    :type request: pytest.FixtureRequest
+    :param request:
+    :return:
+    """
+    if request.param == "memory":
+        return MemoryChangeRateStore(max_size=16)
+    return DynamoDbChangeRateStore(FakeDynamoDbClient(), "change-rates")
+
+
+def test_change_rate_store_put_and_get(change_rate_store: ChangeRateStore) -> None:
+    """Test writing and reading a change rate.
+
+    :type change_rate_store: ChangeRateStore
+    :param change_rate_store:
+    :return:
+    """
+    assert change_rate_store.get(KEY) is None
+
+    change_rate_store.put(KEY, ChangeRate(changed_at=10.0))
+    assert change_rate_store.get(KEY) == ChangeRate(changed_at=10.0)
+
+    change_rate_store.put(KEY, ChangeRate(changed_at=20.0, interval=10.0))
+    assert change_rate_store.get(KEY) == ChangeRate(changed_at=20.0, interval=10.0)
+
+
+def test_adaptive_ttl_follows_change_rate(change_rate_store: ChangeRateStore) -> None:
+    """Test that the TTL is a fraction of the average interval between changes.
+
+    :type change_rate_store: ChangeRateStore
+    :param change_rate_store:
+    :return:
+    """
+    adaptive_ttl = AdaptiveTtl(change_rate_store, min_ttl=60, max_ttl=DAY)
+
+    assert adaptive_ttl.record_change(KEY, now=0) == 3600
+    assert adaptive_ttl.record_change(KEY, now=DAY) == 864
+    assert adaptive_ttl.record_change(KEY, now=DAY + 600) == 435
+    for index in range(10):
+        ttl = adaptive_ttl.record_change(KEY, now=DAY + 600 * (index + 2))
+    assert ttl == 60
+
+    # Without changes the TTL grows up to the maximum
+    now = DAY + 600 * 11
+    assert adaptive_ttl.ttl(change_rate_store.get(KEY), now + DAY) == 864
+    assert adaptive_ttl.ttl(change_rate_store.get(KEY), now + 365 * DAY) == DAY
+
+
+def test_adaptive_ttl_update_only_if_worth_it(
+    change_rate_store: ChangeRateStore,
+) -> None:
+    """Test that the TTL of an unchanged record is only changed if it is far off.
+
+    :type change_rate_store: ChangeRateStore
+    :param change_rate_store:
+    :return:
+    """
+    adaptive_ttl = AdaptiveTtl(change_rate_store, change_factor=2)
+
+    # The first observation of an unchanged record starts tracking it
+    assert adaptive_ttl.ttl_update(KEY, current_ttl=3600, now=0) is None
+    assert change_rate_store.get(KEY) == ChangeRate(changed_at=0)
+
+    assert adaptive_ttl.ttl_update(KEY, current_ttl=3600, now=DAY) is None
+    assert adaptive_ttl.ttl_update(KEY, current_ttl=3600, now=7 * DAY) is None
+    assert adaptive_ttl.ttl_update(KEY, current_ttl=3600, now=10 * DAY) == 8640
+    assert adaptive_ttl.ttl_update(KEY, current_ttl=100000, now=10 * DAY) == 8640
+
+
+def test_lambda_handler_adaptive_ttl(
+    mocked_secrets_manager_cache: MagicMock, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Test that TTL changes are written in the change batch of IP changes.
+
+    :type mocked_secrets_manager_cache: MagicMock
+    :param mocked_secrets_manager_cache:
+    :type monkeypatch: pytest.MonkeyPatch
+    :param monkeypatch:
+    :return:
+    """
+    route_53 = FakeRoute53()
+    route_53.add_hosted_zone("ZONE", "example.com")
+    route_53.add_record("ZONE", "home.example.com", "A", ["192.0.2.1"], ttl=300)
+    route_53.add_record("ZONE", "home.example.com", "AAAA", ["2001:db8::1"], ttl=300)
+    now = [0.0]
+    monkeypatch.setattr("aws.lambda_function.route_53_client", lambda: route_53)
+    monkeypatch.setattr("aws.lambda_function.time", lambda: now[0])
+    monkeypatch.setattr("aws.lambda_function.ROUTE_53_HOSTED_ZONE_ID", "ZONE")
+    monkeypatch.setattr("aws.lambda_function.TTL_MODE", "adaptive")
+    mocked_secrets_manager_cache.get_secret_string.return_value = "token"
+
+    def ttl(record_type: str) -> int:
+        return route_53.record_sets["ZONE"][("home.example.com.", record_type)]["TTL"]
+
+    def update(ip: str, ip6: str) -> None:
+        event = {
+            "queryStringParameters": {
+                "client_id": "client",
+                "domain": "home.example.com",
+                "token": "token",
+                "ip": ip,
+                "ip6": ip6,
+            }
+        }
+        assert lambda_handler(event, {})["statusCode"] == 200
+
+    update("192.0.2.2", "2001:db8::2")
+    assert ttl("A") == 3600
+    assert ttl("AAAA") == 3600
+
+    now[0] = DAY
+    update("192.0.2.3", "2001:db8::2")
+    assert ttl("A") == 864
+    assert ttl("AAAA") == 3600
+    assert route_53.calls["change_resource_record_sets"] == 2
+
+    now[0] = 31 * DAY
+    update("192.0.2.4", "2001:db8::2")
+    assert ttl("A") == 13392
+    assert ttl("AAAA") == 26784
+    assert route_53.record_sets["ZONE"][("home.example.com.", "AAAA")][
+        "ResourceRecords"
+    ] == [{"Value": "2001:db8::2"}]
+    assert route_53.calls["change_resource_record_sets"] == 3
@@ -0,0 +1,361 @@
+"""Tests for hosted zone snapshots."""
+
+from unittest.mock import MagicMock
+
+import pytest
+from pytest_mock import MockerFixture
+
+from aws.zone import (
+    HostedZoneIndex,
+    HostedZoneNotFound,
+    ZoneSnapshotCache,
+    load_hosted_zone_index,
+    load_zone_snapshot,
+    lookup_record_sets,
+    normalize_record_name,
+)
+from benchmarks.fakes import FakeRoute53
+
+
+@pytest.fixture(scope="function")
+def paginated_route_53_client(mocker: MockerFixture) -> MagicMock:
+    """Provide a Route 53 client mock which returns a zone in two pages.
+
+    :type mocker: MockerFixture
+    :param mocker:
+    :return:
+    """
+    client = mocker.MagicMock()
+    client.list_resource_record_sets.side_effect = [
+        {
+            "ResourceRecordSets": [
+                {
+                    "Name": "a.example.com.",
+                    "Type": "A",
+                    "TTL": 300,
+                    "ResourceRecords": [{"Value": "1.1.1.1"}, {"Value": "1.1.1.2"}],
+                },
+                {
+                    "Name": "alias.example.com.",
+                    "Type": "A",
+                    "AliasTarget": {"DNSName": "foo.cloudfront.net."},
+                },
+            ],
+            "IsTruncated": True,
+            "NextRecordName": "z.example.com.",
+            "NextRecordType": "A",
+        },
+        {
+            "ResourceRecordSets": [
+                {
+                    "Name": "Z.example.com.",
+                    "Type": "A",
+                    "TTL": 300,
+                    "ResourceRecords": [{"Value": "2.2.2.2"}],
+                },
+                {
+                    "Name": "\\052.example.com.",
+                    "Type": "A",
+                    "TTL": 300,
+                    "ResourceRecords": [{"Value": "3.3.3.3"}],
+                },
+            ],
+            "IsTruncated": False,
+        },
+    ]
+    return client
+
+
+def test_normalize_record_name() -> None:
+    """Test the normalization of record names.
+
+    :return:
+    """
+    assert normalize_record_name("Foo.Example.com.") == "foo.example.com"
+    assert normalize_record_name("\\052.example.com.") == "*.example.com"
+    assert normalize_record_name("foo.example.com") == "foo.example.com"
+
+
+def test_load_zone_snapshot_pages_through_zone(
+    paginated_route_53_client: MagicMock,
+) -> None:
+    """Test that all pages are read and indexed.
+
+    :type paginated_route_53_client: MagicMock
+    :param paginated_route_53_client:
+    :return:
+    """
+    snapshot = load_zone_snapshot(paginated_route_53_client, "ZONE")
+
+    assert paginated_route_53_client.list_resource_record_sets.call_count == 2
+    second_call = paginated_route_53_client.list_resource_record_sets.call_args_list[1]
+    assert second_call.kwargs == {
+        "HostedZoneId": "ZONE",
+        "StartRecordName": "z.example.com.",
+        "StartRecordType": "A",
+    }
+    assert snapshot.values("a.example.com", "A") == ["1.1.1.1", "1.1.1.2"]
+    assert snapshot.values("z.example.com", "A") == ["2.2.2.2"]
+    assert snapshot.values("*.example.com", "A") == ["3.3.3.3"]
+    assert snapshot.values("alias.example.com", "A") == []
+    assert snapshot.get("missing.example.com", "A") is None
+
+
+def test_zone_snapshot_cache(mocker: MockerFixture) -> None:
+    """Test that snapshots are reused until they are invalidated.
+
+    :type mocker: MockerFixture
+    :param mocker:
+    :return:
+    """
+    client = mocker.MagicMock()
+    client.list_resource_record_sets.return_value = {
+        "ResourceRecordSets": [],
+        "IsTruncated": False,
+    }
+    cache = ZoneSnapshotCache(ttl=60)
+
+    first = cache.get(client, "ZONE")
+    assert cache.get(client, "ZONE") is first
+    client.list_resource_record_sets.assert_called_once()
+
+    cache.invalidate("ZONE")
+    assert cache.get(client, "ZONE") is not first
+    assert client.list_resource_record_sets.call_count == 2
+
+
+def test_zone_snapshot_cache_lookup_names() -> None:
+    """Test that names are read without caching a partial snapshot.
+
+    :return:
+    """
+    route_53 = FakeRoute53(page_size=10)
+    route_53.add_hosted_zone("ZONE", "example.com")
+    for index in range(100):
+        route_53.add_record("ZONE", f"static-{index}.example.com", "A", ["192.0.2.9"])
+    route_53.add_record("ZONE", "home.example.com", "A", ["192.0.2.1"])
+    cache = ZoneSnapshotCache(ttl=60)
+
+    snapshot = cache.get(route_53, "ZONE", names=["home.example.com"])
+
+    assert snapshot.values("home.example.com", "A") == ["192.0.2.1"]
+    assert snapshot.get("static-1.example.com", "A") is None
+    assert cache.cached("ZONE") is None
+    assert route_53.calls["list_resource_record_sets"] == 1
+
+    loaded: list = []
+    snapshot = cache.get(route_53, "ZONE", loaded=loaded)
+
+    assert loaded == [snapshot]
+    assert snapshot.values("static-1.example.com", "A") == ["192.0.2.9"]
+    assert cache.cached("ZONE") is None
+
+
+def test_lookup_record_sets() -> None:
+    """Test that the record sets of a name are read with a single call.
+
+    :return:
+    """
+    route_53 = FakeRoute53(page_size=10)
+    route_53.add_hosted_zone("ZONE", "example.com")
+    for index in range(100):
+        route_53.add_record("ZONE", f"static-{index}.example.com", "A", ["192.0.2.9"])
+    route_53.add_record("ZONE", "home.example.com", "A", ["192.0.2.1"])
+
+    snapshot = lookup_record_sets(
+        route_53, "ZONE", ["Home.example.com", "new.example.com"], ["A", "AAAA"]
+    )
+
+    assert snapshot is not None
+    assert snapshot.values("home.example.com", "A") == ["192.0.2.1"]
+    assert snapshot.get("home.example.com", "AAAA") is None
+    assert snapshot.get("new.example.com", "A") is None
+    assert snapshot.get("static-1.example.com", "A") is None
+    assert route_53.calls["list_resource_record_sets"] == 2
+
+
+def test_lookup_record_sets_undetermined(mocker: MockerFixture) -> None:
+    """Test that a truncated page of the name alone gives no snapshot.
+
+    :type mocker: MockerFixture
+    :param mocker:
+    :return:
+    """
+    client = mocker.MagicMock()
+    client.list_resource_record_sets.return_value = {
+        "ResourceRecordSets": [
+            {
+                "Name": "home.example.com.",
+                "Type": "A",
+                "SetIdentifier": "primary",
+                "TTL": 300,
+                "ResourceRecords": [{"Value": "192.0.2.1"}],
+            },
+        ],
+        "IsTruncated": True,
+        "NextRecordName": "home.example.com.",
+        "NextRecordType": "A",
+    }
+
+    assert lookup_record_sets(client, "ZONE", ["home.example.com"], ["A"]) is None
+
+
+def test_zone_snapshot_cache_apply_changes(mocker: MockerFixture) -> None:
+    """Test that changes patch the cached snapshot instead of dropping it.
+
+    :type mocker: MockerFixture
+    :param mocker:
+    :return:
+    """
+    client = mocker.MagicMock()
+    client.list_resource_record_sets.return_value = {
+        "ResourceRecordSets": [
+            {
+                "Name": "a.example.com.",
+                "Type": "A",
+                "TTL": 300,
+                "ResourceRecords": [{"Value": "1.1.1.1"}],
+            },
+            {
+                "Name": "b.example.com.",
+                "Type": "A",
+                "TTL": 300,
+                "ResourceRecords": [{"Value": "2.2.2.2"}],
+            },
+        ],
+        "IsTruncated": False,
+    }
+    cache = ZoneSnapshotCache(ttl=60)
+    first = cache.get(client, "ZONE")
+
+    cache.apply_changes(
+        "ZONE",
+        [
+            {
+                "Action": "UPSERT",
+                "ResourceRecordSet": {
+                    "Name": "A.example.com",
+                    "Type": "A",
+                    "TTL": 60,
+                    "ResourceRecords": [{"Value": "1.1.1.2"}],
+                },
+            },
+            {
+                "Action": "DELETE",
+                "ResourceRecordSet": {
+                    "Name": "b.example.com.",
+                    "Type": "A",
+                    "TTL": 300,
+                    "ResourceRecords": [{"Value": "2.2.2.2"}],
+                },
+            },
+        ],
+    )
+
+    snapshot = cache.get(client, "ZONE")
+    client.list_resource_record_sets.assert_called_once()
+    assert snapshot.created_at == first.created_at
+    assert snapshot.values("a.example.com", "A") == ["1.1.1.2"]
+    assert snapshot.get("b.example.com", "A") is None
+    assert first.values("a.example.com", "A") == ["1.1.1.1"]
+
+    # Without a cached snapshot there is nothing to patch
+    cache.apply_changes("OTHER", [])
+    assert cache.cached("OTHER") is None
+
+
+def test_zone_snapshot_cache_disabled(mocker: MockerFixture) -> None:
+    """Test that a TTL of 0 disables caching.
+
+    :type mocker: MockerFixture
+    :param mocker:
+    :return:
+    """
+    client = mocker.MagicMock()
+    client.list_resource_record_sets.return_value = {
+        "ResourceRecordSets": [],
+        "IsTruncated": False,
+    }
+    cache = ZoneSnapshotCache(ttl=0)
+
+    cache.get(client, "ZONE")
+    cache.get(client, "ZONE")
+    assert client.list_resource_record_sets.call_count == 2
+
+
+@pytest.mark.parametrize(
+    "domain, hosted_zone_id",
+    [
+        ("example.com", "EXAMPLE"),
+        ("www.example.com", "EXAMPLE"),
+        ("www.sub.example.com", "SUB"),
+        ("sub.example.com.", "SUB"),
+        ("WWW.Example.Org", "ORG"),
+    ],
+)
+def test_hosted_zone_index_resolve(domain: str, hosted_zone_id: str) -> None:
+    """Test the longest suffix match of domains to hosted zones.
+
+    :type domain: str
+    :param domain:
+    :type hosted_zone_id: str
+    :param hosted_zone_id:
+    :return:
+    """
+    index = HostedZoneIndex(
+        {
+            "example.com.": "EXAMPLE",
+            "sub.example.com.": "SUB",
+            "example.org.": "ORG",
+        }
+    )
+
+    assert index.resolve(domain) == hosted_zone_id
+    with pytest.raises(HostedZoneNotFound, match=r"notexample\.com"):
+        index.resolve("notexample.com")
+    with pytest.raises(HostedZoneNotFound):
+        index.resolve("example.net")
+
+
+def test_load_hosted_zone_index(mocker: MockerFixture) -> None:
+    """Test that all pages are read and public zones take precedence.
+
+    :type mocker: MockerFixture
+    :param mocker:
+    :return:
+    """
+    client = mocker.MagicMock()
+    client.list_hosted_zones.side_effect = [
+        {
+            "HostedZones": [
+                {
+                    "Id": "/hostedzone/PUBLIC",
+                    "Name": "example.com.",
+                    "Config": {"PrivateZone": False},
+                },
+            ],
+            "IsTruncated": True,
+            "NextMarker": "marker",
+        },
+        {
+            "HostedZones": [
+                {
+                    "Id": "/hostedzone/PRIVATE",
+                    "Name": "example.com.",
+                    "Config": {"PrivateZone": True},
+                },
+                {
+                    "Id": "/hostedzone/INTERNAL",
+                    "Name": "internal.",
+                    "Config": {"PrivateZone": True},
+                },
+            ],
+            "IsTruncated": False,
+        },
+    ]
+
+    index = load_hosted_zone_index(client)
+
+    assert client.list_hosted_zones.call_args_list[1].kwargs == {"Marker": "marker"}
+    assert index.resolve("www.example.com") == "PUBLIC"
+    assert index.resolve("host.internal") == "INTERNAL"